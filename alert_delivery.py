@@ -0,0 +1,320 @@
+"""
+Background alert delivery.
+
+AlertDelivery.submit only appends the alert to an outbox and returns; a
+worker thread does the HTTP. Per destination it
+
+  * coalesces alerts submitted within `coalesce_seconds` into one batch,
+  * sends over a pooled keep-alive requests.Session,
+  * enforces a token-bucket rate limit of HTTP requests per minute (a
+    batch that renders to several requests takes one token for each),
+  * retries failed batches with full-jitter exponential backoff.
+
+With `outbox_path` set, every alert is written to a JSON-lines journal
+before submit returns and marked done once delivered, so alerts still
+queued at a crash or restart are sent by the next process.
+"""
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Destination:
+    """
+    An HTTP endpoint alerts are posted to. Subclasses override `render`,
+    which turns an alert into this destination's message (or None to skip
+    it), and `payloads`, which turns one coalesced batch of messages into
+    the JSON bodies to POST; by default one body with all of them.
+    """
+
+    def __init__(self, name: str, url: str, headers=None, rate_per_minute=60, max_batch=20):
+        self.name = name
+        self.url = url
+        self.headers = headers or {}
+        self.rate_per_minute = rate_per_minute
+        self.max_batch = max_batch
+
+    def render(self, alert: dict):
+        return alert
+
+    def payloads(self, messages: list) -> list:
+        return [{'alerts': messages}]
+
+
+class _TokenBucket:
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, rate_per_minute / 60.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float, take=True) -> float:
+        """Seconds until a token is available; with `take`, takes it if that is now."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            if take:
+                self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class _Outbox:
+    """JSON-lines journal of queued and delivered alert ids."""
+
+    def __init__(self, path: str, compact_after=10_000):
+        self.path = path
+        self.compact_after = compact_after
+        self._done_since_compact = 0
+        self._file = None
+
+    def load(self) -> list:
+        """Returns the (id, destination, message) entries not yet delivered."""
+        pending = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn last write
+                    if record['op'] == 'put':
+                        pending[record['id']] = (record['id'], record['destination'], record['message'])
+                    else:
+                        pending.pop(record['id'], None)
+        entries = list(pending.values())
+        self._rewrite(entries)
+        return entries
+
+    def _rewrite(self, entries: list):
+        if self._file is not None:
+            self._file.close()
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            for entry_id, destination, message in entries:
+                f.write(json.dumps({'op': 'put', 'id': entry_id, 'destination': destination, 'message': message}) + '\n')
+        os.replace(temporary, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._done_since_compact = 0
+
+    def put(self, entry_id: int, destination: str, message):
+        self._file.write(json.dumps({'op': 'put', 'id': entry_id, 'destination': destination, 'message': message}) + '\n')
+        self._file.flush()
+
+    def done(self, entry_ids: list, pending):
+        """Marks entries delivered; `pending()` lists what is left when the journal is compacted."""
+        self._file.write(''.join(json.dumps({'op': 'done', 'id': entry_id}) + '\n' for entry_id in entry_ids))
+        self._file.flush()
+        self._done_since_compact += len(entry_ids)
+        if self._done_since_compact >= self.compact_after:
+            self._rewrite(pending())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _Queue:
+    __slots__ = ('destination', 'session', 'bucket', 'entries', 'attempts', 'not_before', 'retry_size', 'sent')
+
+    def __init__(self, destination: Destination):
+        self.destination = destination
+        self.session = requests.Session()
+        # One worker thread sends, so one kept-alive connection per destination is enough.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(destination.headers)
+        self.bucket = _TokenBucket(destination.rate_per_minute)
+        self.entries = deque()
+        self.attempts = 0
+        self.not_before = 0.0
+        # A failed batch is retried as the same entries, skipping the payloads already accepted.
+        self.retry_size = None
+        self.sent = 0
+
+
+class AlertDelivery:
+    """
+    Delivers alerts to `destinations` from a worker thread. See the module
+    docstring for the batching, rate limiting and retry behaviour.
+    """
+
+    def __init__(self, destinations: list, outbox_path=None, coalesce_seconds=2.0, max_attempts=8,
+                 backoff_base=0.5, backoff_cap=60.0, timeout=10.0):
+        self.coalesce_seconds = coalesce_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self._queues = {d.name: _Queue(d) for d in destinations}
+        self._outbox = _Outbox(outbox_path) if outbox_path else None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._next_id = 0
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dropped = 0
+        self.batches_sent = 0
+        if self._outbox is not None:
+            for entry_id, name, message in self._outbox.load():
+                if name in self._queues:
+                    self._queues[name].entries.append((entry_id, time.monotonic(), message))
+                self._next_id = max(self._next_id, entry_id + 1)
+        self._thread = threading.Thread(target=self._run, name='alert-delivery', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, alert: dict):
+        """Queues `alert` for every destination that wants it; never blocks on the network."""
+        messages = []
+        for queue in self._queues.values():
+            message = queue.destination.render(alert)
+            if message is not None:
+                # Round-trip through JSON so what is queued is exactly what the journal replays.
+                messages.append((queue, json.loads(json.dumps(message, default=str))))
+        with self._lock:
+            for queue, message in messages:
+                entry_id = self._next_id
+                self._next_id += 1
+                if self._outbox is not None:
+                    self._outbox.put(entry_id, queue.destination.name, message)
+                queue.entries.append((entry_id, time.monotonic(), message))
+            self._wakeup.notify()
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(queue.entries) for queue in self._queues.values())
+
+    def stats(self) -> dict:
+        return {
+            'pending': self.pending(),
+            'delivered': self.delivered,
+            'batches_sent': self.batches_sent,
+            'failed_attempts': self.failed_attempts,
+            'dropped': self.dropped,
+        }
+
+    def _ready_batch(self, now: float):
+        """Picks a destination whose batch is due; otherwise returns how long to sleep."""
+        sleep = None
+        for queue in self._queues.values():
+            if not queue.entries:
+                continue
+            due = max(queue.not_before, queue.entries[0][1] + self.coalesce_seconds)
+            size = queue.retry_size or min(len(queue.entries), queue.destination.max_batch)
+            if self._stopping or queue.retry_size or size >= queue.destination.max_batch:
+                due = queue.not_before
+            if due <= now:
+                # _send takes the tokens, one per request.
+                wait = queue.bucket.wait_time(now, take=False)
+                if wait == 0.0:
+                    return queue, [queue.entries[i] for i in range(size)], None
+                due = now + wait
+            sleep = due - now if sleep is None else min(sleep, due - now)
+        return None, None, sleep
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    queue, batch, sleep = self._ready_batch(time.monotonic())
+                    if batch is not None:
+                        break
+                    if self._stopping and sleep is None:
+                        return
+                    self._wakeup.wait(sleep)
+            ok = self._send(queue, batch)
+            with self._lock:
+                if ok is not True and ok is not False:
+                    # Out of tokens partway through; the rest of the batch goes once one is available.
+                    queue.retry_size = len(batch)
+                    queue.not_before = time.monotonic() + ok
+                    continue
+                if ok:
+                    for _ in batch:
+                        queue.entries.popleft()
+                    queue.attempts = 0
+                    queue.not_before = 0.0
+                    queue.retry_size = None
+                    queue.sent = 0
+                    self.delivered += len(batch)
+                    self.batches_sent += 1
+                    self._mark_done([entry[0] for entry in batch])
+                    continue
+                self.failed_attempts += 1
+                queue.attempts += 1
+                queue.retry_size = len(batch)
+                if queue.attempts >= self.max_attempts:
+                    for _ in batch:
+                        queue.entries.popleft()
+                    queue.attempts = 0
+                    queue.retry_size = None
+                    queue.sent = 0
+                    self.dropped += len(batch)
+                    self._mark_done([entry[0] for entry in batch])
+                    print(f"Dropping {len(batch)} alert(s) for {queue.destination.name} "
+                          f"after {self.max_attempts} attempts")
+                else:
+                    backoff = min(self.backoff_cap, self.backoff_base * 2 ** queue.attempts)
+                    queue.not_before = time.monotonic() + random.uniform(0, backoff)
+
+    def _mark_done(self, entry_ids: list):
+        if self._outbox is not None:
+            self._outbox.done(entry_ids, lambda: [(entry_id, name, message) for name, queue in self._queues.items()
+                                                  for entry_id, _, message in queue.entries])
+
+    def _send(self, queue: _Queue, batch: list):
+        """
+        POSTs the batch's payloads not yet accepted, one rate-limit token
+        each. Returns True once all are accepted, False on a failure, or the
+        seconds to wait for a token if the bucket ran out first.
+        """
+        destination = queue.destination
+        payloads = destination.payloads([message for _, _, message in batch])
+        try:
+            for payload in payloads[queue.sent:]:
+                wait = queue.bucket.wait_time(time.monotonic())
+                if wait:
+                    return wait
+                response = queue.session.post(destination.url, json=payload, timeout=self.timeout)
+                if response.status_code >= 300:
+                    return False
+                queue.sent += 1
+        except requests.RequestException:
+            return False
+        return True
+
+    def flush(self, timeout=None) -> bool:
+        """Waits until nothing is queued (or `timeout` passes); True if drained."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=5.0):
+        """Sends what is queued without waiting out the coalesce window, then stops the worker."""
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._wakeup.notify()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # Still retrying; whatever it has not delivered stays in the outbox.
+            return
+        for queue in self._queues.values():
+            queue.session.close()
+        if self._outbox is not None:
+            self._outbox.close()
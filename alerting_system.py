@@ -1,12 +1,185 @@
 import requests 
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
+from hashlib import blake2b
+
+from alert_delivery import AlertDelivery, Destination
+
+PAGERDUTY_EVENTS_URL = "https://events.pagerduty.com/v2/enqueue"
+
+
+class SlackDestination(Destination):
+    """Slack incoming webhook; a coalesced batch goes out as one message of up to 50 blocks."""
+
+    def __init__(self, url: str, format_message, rate_per_minute=60):
+        super().__init__('slack', url, rate_per_minute=rate_per_minute)
+        self.format_message = format_message
+
+    def render(self, alert: dict):
+        if alert.get('severity', 'INFO').upper() not in ('CRITICAL', 'HIGH', 'MEDIUM'):
+            return None
+        return self.format_message(alert)
+
+    def payloads(self, messages: list) -> list:
+        payloads = []
+        for message in messages:
+            if payloads and len(payloads[-1]['blocks']) + len(message['blocks']) <= 50:
+                payloads[-1]['blocks'].extend(message['blocks'])
+                payloads[-1]['attachments'].extend(message['attachments'])
+            else:
+                payloads.append({'blocks': list(message['blocks']), 'attachments': list(message['attachments'])})
+        return payloads
+
+
+class PagerDutyDestination(Destination):
+    """PagerDuty Events API v2; it has no batch endpoint, so each event is its own request on the pooled session."""
+
+    def __init__(self, routing_key: str, url=PAGERDUTY_EVENTS_URL, rate_per_minute=120):
+        super().__init__('pagerduty', url, rate_per_minute=rate_per_minute)
+        self.routing_key = routing_key
+
+    def render(self, alert: dict):
+        if alert.get('severity', 'INFO').upper() != 'CRITICAL':
+            return None
+        return {
+            'routing_key': self.routing_key,
+            'event_action': 'trigger',
+            'dedup_key': alert.get('alert_id'),
+            'payload': {
+                'summary': f"{alert.get('rule_name', 'Predicted Incident')}: {alert.get('predicted_impact', '')}"[:1024],
+                'severity': 'critical',
+                'source': ', '.join(alert.get('component_s_affected', [])) or 'log-analyzer',
+                'timestamp': alert['timestamp'].isoformat() if isinstance(alert.get('timestamp'), datetime) else None,
+                'custom_details': alert.get('contextual_data', {}),
+            },
+        }
+
+    def payloads(self, messages: list) -> list:
+        return messages
+
+
+def alert_fingerprint(alert: dict) -> str:
+    """
+    Stable identity of an alert for deduplication: its rule, the affected
+    components and the set of anomaly keys behind it. Unlike alert_id it
+    does not change from one second to the next.
+    """
+    matched = alert.get('contextual_data', {}).get('active_anomalies_matched', [])
+    identity = json.dumps([alert.get('rule_name'), sorted(alert.get('component_s_affected', [])),
+                           sorted({str(key) for key in matched})])
+    return blake2b(identity.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class DedupeCache:
+    """
+    Remembers which fingerprints were alerted in the last `ttl_seconds`,
+    holding at most `max_entries`. Every entry has the same TTL and is
+    never refreshed, so insertion order is expiry order: the dict doubles
+    as a single-slot time wheel, and expiring or evicting is O(1) per entry
+    from its front. Capacity is only enforced when check() inserts, by
+    evicting the oldest entry. Entries leave through expire(), which returns
+    the ones that suppressed duplicates (evicted ones included) so they can
+    be rolled up.
+
+    That ordering needs time to never go backwards, so a `now` earlier than
+    one already seen (e.g. an out-of-order event time) is treated as the
+    latest time seen.
+    """
+
+    def __init__(self, ttl_seconds=300, max_entries=100_000):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        self._entries = {}
+        # Evicted entries with suppressions, until expire() hands them out.
+        self._evicted = []
+        self.suppressed = 0
+        self.expired = 0
+        self.evicted = 0
+        self.now = None
+
+    def advance(self, now: datetime) -> datetime:
+        """Returns `now`, or the latest time seen if that is later."""
+        if self.now is None or now > self.now:
+            self.now = now
+        return self.now
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self._entries
+
+    def check(self, fingerprint: str, alert: dict, now: datetime) -> bool:
+        """
+        True if `alert` is new, in which case it is remembered, evicting the
+        oldest entry when the cache is full; otherwise counts it as a
+        suppressed duplicate.
+        """
+        now = self.advance(now)
+        entries = self._entries
+        entry = entries.get(fingerprint)
+        if entry is not None:
+            entry['suppressed'] += 1
+            entry['last_suppressed'] = now
+            self.suppressed += 1
+            return False
+        while entries and len(entries) >= self.max_entries:
+            oldest = entries.pop(next(iter(entries)))
+            self.evicted += 1
+            if oldest['suppressed']:
+                self._evicted.append(oldest)
+        entries[fingerprint] = {'sent_at': now, 'alert': alert, 'suppressed': 0, 'last_suppressed': None}
+        return True
+
+    def expire(self, now: datetime) -> list:
+        """Removes entries past their TTL; returns those with suppressions, and any evicted since the last call."""
+        entries = self._entries
+        rollups, self._evicted = self._evicted, []
+        cutoff = self.advance(now) - self.ttl
+        while entries:
+            fingerprint = next(iter(entries))
+            entry = entries[fingerprint]
+            if entry['sent_at'] > cutoff:
+                break
+            self.expired += 1
+            del entries[fingerprint]
+            if entry['suppressed']:
+                rollups.append(entry)
+        return rollups
+
+    def drain(self) -> list:
+        """Removes every entry, as at shutdown; returns those with suppressions."""
+        rollups = self._evicted + [entry for entry in self._entries.values() if entry['suppressed']]
+        self._evicted = []
+        self._entries.clear()
+        return rollups
+
 
 class AlertingSystem:
-    def __init__(self, slack_webhook_url=None, pagerduty_api_key=None):
+    """
+    Formats alerts and hands them to an AlertDelivery worker, so send_alert
+    never waits on Slack or PagerDuty. `outbox_path` keeps undelivered
+    alerts on disk across restarts; `verbose` prints every alert in full.
+
+    Repeats of an alert (same alert_fingerprint) within `dedupe_seconds` are
+    suppressed; once that window closes, one follow-up notification reports
+    how many were suppressed.
+    """
+
+    def __init__(self, slack_webhook_url=None, pagerduty_api_key=None, outbox_path=None, coalesce_seconds=2.0,
+                 verbose=False, dedupe_seconds=300, max_dedupe_entries=100_000):
         self.slack_webhook_url = slack_webhook_url
         self.pagerduty_api_key = pagerduty_api_key
-        self.sent_alerts_cache = {} 
+        self.sent_alerts_cache = DedupeCache(dedupe_seconds, max_dedupe_entries)
+        self.rollups_sent = 0
+        self.verbose = verbose
+        destinations = []
+        if slack_webhook_url:
+            destinations.append(SlackDestination(slack_webhook_url, self._format_slack_message))
+        if pagerduty_api_key:
+            destinations.append(PagerDutyDestination(pagerduty_api_key))
+        self.delivery = AlertDelivery(destinations, outbox_path=outbox_path,
+                                      coalesce_seconds=coalesce_seconds) if destinations else None
 
     def _format_slack_message(self, alert: dict) -> dict:
         color_map = {
@@ -68,24 +241,63 @@ class AlertingSystem:
         ]
         return {"blocks": blocks, "attachments": [{"color": color}]}
 
-    def send_alert(self, alert: dict):
-        alert_id = alert.get('alert_id')
-        severity = alert.get('severity', 'INFO').upper()
-        current_time = datetime.now()
-        if alert_id in self.sent_alerts_cache and \
-           (current_time - self.sent_alerts_cache[alert_id]).total_seconds() < 300:
-            print(f"Suppressing duplicate alert: {alert_id}")
+    def send_alert(self, alert: dict, now: datetime = None):
+        """Sends `alert` unless it duplicates one sent within the dedupe window; `now` defaults to the wall clock."""
+        current_time = now if now is not None else datetime.now()
+        self.tick(current_time)
+        if not self.sent_alerts_cache.check(alert_fingerprint(alert), alert, current_time):
             return
+        self._dispatch(alert)
+
+    def tick(self, now: datetime = None):
+        """Expires dedupe entries and sends the roll-up notifications that are due."""
+        cache = self.sent_alerts_cache
+        expired = cache.expire(now if now is not None else datetime.now())
+        self._send_rollups(expired, cache.now)
+
+    def _send_rollups(self, entries: list, current_time: datetime):
+        for entry in entries:
+            self._dispatch(self._rollup(entry, current_time))
+            self.rollups_sent += 1
 
-        self.sent_alerts_cache[alert_id] = current_time
-        print(f"\n--- Sending Alert: {alert_id} ({severity}) ---")
-        print(json.dumps(alert, indent=2, default=str)) 
+    def _rollup(self, entry: dict, current_time: datetime) -> dict:
+        alert = entry['alert']
+        rollup = dict(alert)
+        rollup.update({
+            'alert_id': f"{alert.get('alert_id')}-ROLLUP",
+            'timestamp': current_time,
+            'root_cause_analysis_predicted': (
+                f"{entry['suppressed']} duplicate(s) of {alert.get('alert_id')} suppressed between "
+                f"{entry['sent_at']:%Y-%m-%d %H:%M:%S} and {entry['last_suppressed']:%Y-%m-%d %H:%M:%S}."),
+            'suppressed_count': entry['suppressed'],
+        })
+        return rollup
 
-        if severity == 'CRITICAL' and self.pagerduty_api_key:
-            
-            print("PagerDuty alert (simulated)")
+    def _dispatch(self, alert: dict):
+        severity = alert.get('severity', 'INFO').upper()
+        print(f"Sending alert {alert.get('alert_id')} ({severity}): {alert.get('rule_name', 'Predicted Incident')}")
+        if self.verbose:
+            print(json.dumps(alert, indent=2, default=str)) 
+
+        if self.delivery is not None:
+            self.delivery.submit(alert)
+
+    def stats(self) -> dict:
+        cache = self.sent_alerts_cache
+        return {
+            'dedupe_entries': len(cache),
+            'suppressed': cache.suppressed,
+            'expired': cache.expired,
+            'evicted': cache.evicted,
+            'rollups_sent': self.rollups_sent,
+        }
 
-        if self.slack_webhook_url and severity in ['CRITICAL', 'HIGH', 'MEDIUM']:
-            slack_message = self._format_slack_message(alert)
-           
-            print("Slack alert (simulated)")
+    def close(self, timeout=5.0):
+        """
+        Sends the roll-ups of every dedupe window still open, then delivers
+        what is queued (up to `timeout`) and stops the delivery worker.
+        """
+        cache = self.sent_alerts_cache
+        self._send_rollups(cache.drain(), cache.now)
+        if self.delivery is not None:
+            self.delivery.close(timeout)
@@ -1,61 +1,472 @@
-from collections import deque, defaultdict
+from collections import defaultdict
+from datetime import datetime
 import numpy as np
 
+from event_batch import EventBatch
+from log_patterns import to_epoch
+from sketches import WindowSketch
+
+# Rough per-key cost of the key index (dict slot plus the key tuple), used
+# on top of the ring buffer row when estimating memory.
+_INDEX_BYTES_PER_KEY = 200
+
+
 class AnomalyDetector:
-    def __init__(self, window_size=60, z_score_threshold=3.0, history_size=1000):
-        self.metrics_history = defaultdict(lambda: deque(maxlen=history_size))
+    """
+    Z-score frequency anomaly detection over per-key count histories.
+
+    The last `window_size` counts of every (service, level, pattern_id) key
+    sit in a NumPy ring buffer, and every known key is evaluated each tick,
+    so drops to zero and silences are caught too. `idle_ttl`, `max_keys`
+    and `memory_budget_bytes` bound the keys tracked. With `window_seconds`
+    windows follow event time (see update_counts); with `approximate` they
+    are counted in a WindowSketch. Its Count-Min table takes about 1.5 MB at
+    the default error_rate and confidence: one for the window, plus one per
+    open pane that sees more than max(4 * top_k, 4096) distinct keys.
+    stats()['sketch_bytes'] reports the total.
+    """
+
+    def __init__(self, window_size=60, z_score_threshold=3.0, history_size=1000,
+                 idle_ttl=None, max_keys=None, memory_budget_bytes=None,
+                 window_seconds=None, slide_seconds=None, allowed_lateness=0,
+                 approximate=False, top_k=1000, error_rate=0.0001, confidence=0.999, hll_precision=12):
         self.window_size = window_size
         self.z_score_threshold = z_score_threshold
-        self.current_window_counts = defaultdict(int) 
+        self.history_size = history_size
+        self.idle_ttl = idle_ttl if idle_ttl is not None else window_size
+
+        self.approximate = approximate
+        self.window_cardinality = {}
+        if approximate:
+            self._sketch_options = dict(top_k=top_k, epsilon=error_rate, delta=1.0 - confidence,
+                                        precision=hll_precision)
+            if max_keys is None:
+                max_keys = top_k
+        self.current_window_counts = self._new_window()
+
+        self.window_seconds = window_seconds
+        self.slide_seconds = slide_seconds if slide_seconds is not None else window_seconds
+        self.allowed_lateness = allowed_lateness
+        if window_seconds is not None:
+            panes, remainder = divmod(window_seconds, self.slide_seconds)
+            if remainder or panes < 1:
+                raise ValueError("window_seconds must be a positive multiple of slide_seconds")
+            self._panes_per_window = int(panes)
+        # Event-time state: per-pane counts, the end pane (exclusive) of the
+        # next window to close, and the newest event time seen.
+        self._panes = {}
+        self._next_window_end = None
+        self._max_event_time = None
+        self.late_events_dropped = 0
+        self.windows_emitted = 0
+
+        # Only the last window_size counts feed the statistics, so that is
+        # all the ring buffer keeps; _lengths still counts up to history_size.
+        self._width = max(1, min(window_size, history_size))
+        self.bytes_per_key = self._width * 4 + 6 * 8 + 1 + _INDEX_BYTES_PER_KEY
+        self.max_keys = max_keys
+        if memory_budget_bytes is not None:
+            budget_keys = max(1, memory_budget_bytes // self.bytes_per_key)
+            self.max_keys = budget_keys if max_keys is None else min(max_keys, budget_keys)
+
+        self._rows = {}
+        self._keys = []
+        self._free_rows = []
+        self._tick = 0
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+        capacity = 1024
+        self._history = np.zeros((capacity, self._width), dtype=np.int32)
+        self._positions = np.zeros(capacity, dtype=np.int64)
+        self._lengths = np.zeros(capacity, dtype=np.int64)
+        self._sums = np.zeros(capacity, dtype=np.int64)
+        self._sums_sq = np.zeros(capacity, dtype=np.int64)
+        self._nonzero = np.zeros(capacity, dtype=np.int64)
+        self._last_active = np.zeros(capacity, dtype=np.int64)
+        self._live = np.zeros(capacity, dtype=bool)
+
+    def _new_window(self):
+        return WindowSketch(**self._sketch_options) if self.approximate else defaultdict(int)
+
+    _COLUMNS = ('_history', '_positions', '_lengths', '_sums', '_sums_sq', '_nonzero', '_last_active', '_live')
+
+    def _grow(self, capacity: int):
+        for name in self._COLUMNS:
+            array = getattr(self, name)
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def _row_for(self, key) -> int:
+        row = self._rows.get(key)
+        if row is None:
+            if self._free_rows:
+                row = self._free_rows.pop()
+                self._keys[row] = key
+            else:
+                row = len(self._keys)
+                if row == len(self._history):
+                    self._grow(2 * row)
+                self._keys.append(key)
+            self._rows[key] = row
+            self._live[row] = True
+        return row
+
+    def _evict(self, rows: np.ndarray):
+        for name in self._COLUMNS:
+            getattr(self, name)[rows] = 0
+        for row in rows.tolist():
+            del self._rows[self._keys[row]]
+            self._keys[row] = None
+            self._free_rows.append(row)
 
-    def update_counts(self, parsed_event: dict):
-        """Aggregates counts for the current time window."""
+    def get_history(self, key) -> list:
+        """Returns the retained counts for `key`, oldest first."""
+        row = self._rows.get(key)
+        if row is None:
+            return []
+        filled = min(self._lengths[row], self._width)
+        position = self._positions[row]
+        ordered = np.roll(self._history[row], -position) if filled == self._width else self._history[row, :filled]
+        return ordered.tolist()
+
+    def stats(self) -> dict:
+        """
+        Key count, memory use and eviction counters. 'bytes' is the estimated
+        cost of the live keys, which is what memory_budget_bytes bounds;
+        'allocated_bytes' also counts free rows left over from array growth.
+        """
+        return {
+            'keys': len(self._rows),
+            'capacity': len(self._history),
+            'bytes': len(self._rows) * self.bytes_per_key,
+            'allocated_bytes': sum(getattr(self, name).nbytes for name in self._COLUMNS) +
+                               len(self._rows) * _INDEX_BYTES_PER_KEY,
+            'max_keys': self.max_keys,
+            'evicted_idle': self.evicted_idle,
+            'evicted_lru': self.evicted_lru,
+            'tick': self._tick,
+            'windows_emitted': self.windows_emitted,
+            'late_events_dropped': self.late_events_dropped,
+            'watermark': self.watermark,
+            'sketch_bytes': self._sketch_bytes(),
+        }
+
+    def _sketch_bytes(self) -> int:
+        if not self.approximate:
+            return 0
+        return self.current_window_counts.nbytes + sum(pane.nbytes for pane in self._panes.values())
+
+    @property
+    def watermark(self):
+        """Event time (epoch seconds) up to which windows are considered complete."""
+        if self._max_event_time is None:
+            return None
+        return self._max_event_time - self.allowed_lateness
+
+    def update_counts(self, parsed_event) -> list:
+        """
+        Aggregates counts for the current time window. With `window_seconds`
+        set, events go into panes of `slide_seconds` by their own timestamp,
+        and the anomalies of every window the watermark (newest event time
+        minus `allowed_lateness`) has passed are returned. Events older than
+        every open window are dropped and counted in late_events_dropped.
+        Also accepts a whole EventBatch, counted in one vectorized pass.
+        """
+        if isinstance(parsed_event, EventBatch):
+            return self._add_batch(parsed_event)
         key = (parsed_event.get('service_name'), parsed_event.get('log_level'), parsed_event.get('pattern_id'))
-        self.current_window_counts[key] += 1
+        if self.window_seconds is None:
+            if self.approximate:
+                self.current_window_counts.add(key)
+            else:
+                self.current_window_counts[key] += 1
+            return []
+        return self._add_at(to_epoch(parsed_event.get('timestamp')), {key: 1})
+
+    def add_counts(self, key_deltas: dict, timestamp=None) -> list:
+        """
+        Adds pre-aggregated {(service, level, pattern_id): count} deltas to the
+        current window. Event-time mode needs the deltas' `timestamp`.
+        """
+        if self.window_seconds is None:
+            self._add_to(self.current_window_counts, key_deltas)
+            return []
+        if timestamp is None:
+            raise ValueError("add_counts needs a timestamp when window_seconds is set")
+        return self._add_at(to_epoch(timestamp), key_deltas)
+
+    def _add_batch(self, batch: EventBatch) -> list:
+        if not len(batch):
+            return []
+        keys, key_index = batch.key_codes()
+        if self.window_seconds is None:
+            counts = np.bincount(key_index, minlength=len(keys))
+            self._add_to(self.current_window_counts, dict(zip(keys, counts.tolist())))
+            return []
+
+        slide = self.slide_seconds
+        times = batch.timestamps / 1000.0
+        panes = np.floor_divide(times, slide).astype(np.int64)
+        newest = np.maximum.accumulate(times)
+        if self._max_event_time is not None:
+            newest = np.maximum(newest, self._max_event_time)
+        # Windows only close on an event that moves the watermark across a
+        # pane boundary. Cutting the batch right after each such event and
+        # counting every piece in one go gives the same result, late drops
+        # included, as adding the events one at a time.
+        closed = np.floor_divide(newest - self.allowed_lateness, slide)
+        before = closed[0] if self._max_event_time is None else \
+            np.floor_divide(self._max_event_time - self.allowed_lateness, slide)
+        ends = (np.flatnonzero(closed != np.concatenate(([before], closed[:-1]))) + 1).tolist()
+        if not ends or ends[-1] != len(batch):
+            ends.append(len(batch))
+        anomalies = []
+        start = 0
+        for end in ends:
+            anomalies.extend(self._add_panes(panes[start:end], key_index[start:end], keys, float(newest[end - 1])))
+            start = end
+        return anomalies
+
+    def _add_panes(self, panes: np.ndarray, key_index: np.ndarray, keys: list, newest: float) -> list:
+        if self._next_window_end is None:
+            self._next_window_end = int(panes[0]) + self._panes_per_window
+        on_time = panes >= self._next_window_end - self._panes_per_window
+        kept = int(np.count_nonzero(on_time))
+        if kept < len(panes):
+            self.late_events_dropped += len(panes) - kept
+            panes = panes[on_time]
+            key_index = key_index[on_time]
+        if kept:
+            key_count = len(keys)
+            first = int(panes.min())
+            codes, counts = np.unique((panes - first) * key_count + key_index, return_counts=True)
+            splits = np.flatnonzero(np.diff(codes // key_count)) + 1
+            for pane_codes, pane_deltas in zip(np.split(codes, splits), np.split(counts, splits)):
+                pane = first + int(pane_codes[0]) // key_count
+                pane_counts = self._panes.get(pane)
+                if pane_counts is None:
+                    pane_counts = self._panes[pane] = self._new_window()
+                self._add_to(pane_counts, dict(zip([keys[k] for k in (pane_codes % key_count).tolist()],
+                                                   pane_deltas.tolist())))
+        if self._max_event_time is None or newest > self._max_event_time:
+            self._max_event_time = newest
+            return self._emit_closed_windows(self.watermark)
+        return []
+
+    def _add_at(self, event_time: float, key_deltas: dict) -> list:
+        pane = int(event_time // self.slide_seconds)
+        if self._next_window_end is None:
+            self._next_window_end = pane + self._panes_per_window
+        elif pane < self._next_window_end - self._panes_per_window:
+            self.late_events_dropped += sum(key_deltas.values())
+            return []
+
+        counts = self._panes.get(pane)
+        if counts is None:
+            counts = self._panes[pane] = self._new_window()
+        self._add_to(counts, key_deltas)
+        if self._max_event_time is None or event_time > self._max_event_time:
+            self._max_event_time = event_time
+            return self._emit_closed_windows(self.watermark)
+        return []
+
+    def _add_to(self, counts, key_deltas: dict):
+        if self.approximate:
+            counts.update(key_deltas)
+            return
+        for key, count in key_deltas.items():
+            counts[key] += count
+
+    def _emit_closed_windows(self, watermark: float) -> list:
+        anomalies = []
+        slide = self.slide_seconds
+        panes_per_window = self._panes_per_window
+        while self._next_window_end is not None and watermark >= self._next_window_end * slide:
+            end = self._next_window_end
+            first = end - panes_per_window
+            if not self._live.any() and not any(first <= pane < end for pane in self._panes):
+                # Nothing is tracked and nothing was counted: fast-forward over
+                # the idle stretch instead of ticking empty windows one by one.
+                pending = [pane for pane in self._panes if pane >= end]
+                if not pending:
+                    self._next_window_end = None
+                    break
+                self._next_window_end = min(pending) + 1
+                continue
+
+            counts = self.current_window_counts
+            for pane in range(first, end):
+                pane_counts = self._panes.get(pane)
+                if pane_counts is None:
+                    continue
+                if self.approximate:
+                    counts.merge(pane_counts)
+                else:
+                    for key, count in pane_counts.items():
+                        counts[key] += count
+            # The oldest pane is not part of any later window.
+            self._panes.pop(first, None)
+            self._next_window_end = end + 1
+
+            window_start = datetime.fromtimestamp(first * slide)
+            window_end = datetime.fromtimestamp(end * slide)
+            for anomaly in self._tick_window():
+                anomaly['window_start'] = window_start
+                anomaly['window_end'] = window_end
+                anomaly['timestamp'] = window_end
+                anomalies.append(anomaly)
+            self.windows_emitted += 1
+        return anomalies
+
+    def flush(self) -> list:
+        """Closes and evaluates every window that still holds events, e.g. at the end of a replay."""
+        if self.window_seconds is None or not self._panes:
+            return []
+        return self._emit_closed_windows((max(self._panes) + self._panes_per_window) * self.slide_seconds)
+
+    def _record(self, rows: np.ndarray, values: np.ndarray):
+        """Appends one count per row and rolls the windowed sums forward."""
+        width = self._width
+        positions = self._positions[rows]
+        full = self._lengths[rows] >= width
+        leaving = np.where(full, self._history[rows, positions].astype(np.int64), 0)
+        self._history[rows, positions] = values
+        self._positions[rows] = (positions + 1) % width
+        self._lengths[rows] = np.minimum(self._lengths[rows] + 1, self.history_size)
+        self._sums[rows] += values - leaving
+        self._sums_sq[rows] += values * values - leaving * leaving
+        self._nonzero[rows] += (values > 0).astype(np.int64) - (full & (leaving > 0))
 
-    def detect_anomalies_in_window(self) -> list:
+    def detect_anomalies_in_window(self, batch: EventBatch = None) -> list:
         """
         Detects anomalies based on the counts accumulated in the current window.
         This method would be called periodically (e.g., every minute) by the stream processor.
+        In event-time mode it only emits windows already closed by the watermark.
+        A `batch` passed in is counted first, as by update_counts.
         """
+        anomalies = self._add_batch(batch) if batch is not None else []
+        if self.window_seconds is not None:
+            if self._max_event_time is not None:
+                anomalies.extend(self._emit_closed_windows(self.watermark))
+            return anomalies
+        return self._tick_window()
+
+    def _tick_window(self) -> list:
+        self._tick += 1
+        counts = self.current_window_counts
+        if self.approximate:
+            counts = self._estimate_counts(counts)
+            self.current_window_counts.clear()
+        keys = list(counts)
+        row_for = self._row_for
+        active_rows = np.fromiter((row_for(key) for key in keys), dtype=np.int64, count=len(keys))
+        active_values = np.fromiter(counts.values(), dtype=np.int64, count=len(keys))
+        counts.clear()
+
+        # Every live key gets a count this tick; idle keys get zero.
+        rows = np.flatnonzero(self._live)
+        if not len(rows):
+            return []
+        tick_values = np.zeros(len(self._history), dtype=np.int64)
+        tick_values[active_rows] = active_values
+        values = tick_values[rows]
+        self._record(rows, values)
+        self._last_active[active_rows] = self._tick
+
+        anomalies = self._evaluate(rows, values)
+        self._enforce_limits()
+        return anomalies
+
+    def _estimate_counts(self, sketch: WindowSketch) -> dict:
+        """Count-Min estimates for the window's heavy hitters and every tracked key."""
+        self.window_cardinality = sketch.cardinality()
+        if not sketch.total:
+            return {}
+        keys = sketch.top_keys()
+        heavy = set(keys)
+        keys.extend(key for key in self._rows if key not in heavy)
+        estimates = sketch.estimate(keys)
+        return {key: count for key, count in zip(keys, estimates.tolist()) if count}
+
+    def _evaluate(self, rows: np.ndarray, values: np.ndarray) -> list:
+        ready = np.flatnonzero(self._lengths[rows] >= self.window_size)
+        if not len(ready):
+            return []
+        n = self.window_size
+        rows = rows[ready]
+        sums = self._sums[rows]
+        current = values[ready]
+        means = sums / n
+        # n * sum(x^2) - sum(x)^2 is an exact integer, so constant windows give exactly 0.
+        spread = n * self._sums_sq[rows] - sums * sums
+        stds = np.sqrt(np.maximum(spread, 0)) / n
+        flat = spread <= 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_scores = np.where(flat, 0.0, (current - means) / stds)
+
+        # Active in every earlier tick of the window, silent in this one.
+        silences = (current == 0) & (self._nonzero[rows] == n - 1)
+        spikes = flat & (current > means) & (means > 0)
+        outliers = ~flat & ~silences & (np.abs(z_scores) > self.z_score_threshold)
+
         anomalies = []
-        for key, current_count in self.current_window_counts.items():
-            history = self.metrics_history[key]
-
-            
-            history.append(current_count)
-
-            if len(history) >= self.window_size: 
-                mean = np.mean(list(history)[-self.window_size:])
-                std_dev = np.std(list(history)[-self.window_size:])
-
-                if std_dev == 0:
-                    if current_count > mean and mean > 0: 
-                        anomalies.append({
-                            'type': 'Frequency Spike',
-                            'key': key,
-                            'current_count': current_count,
-                            'baseline_mean': mean,
-                            'severity': 'Medium' if current_count > mean * 2 else 'Low', 
-                            'details': f"Constant baseline, sudden spike to {current_count}"
-                        })
-                    continue
+        threshold = self.z_score_threshold
+        keys = self._keys
+        for i in np.flatnonzero(silences | spikes | outliers).tolist():
+            key = keys[rows[i]]
+            current_count = int(current[i])
+            mean = float(means[i])
+            if silences[i]:
+                baseline = float(sums[i]) / (n - 1) if n > 1 else 0.0
+                anomalies.append({
+                    'type': 'Silence',
+                    'key': key,
+                    'current_count': 0,
+                    'baseline_mean': baseline,
+                    'severity': 'High',
+                    'details': f"No events for {key} after a steady baseline of {baseline:.2f} per window"
+                })
+                continue
+
+            if spikes[i]:
+                anomalies.append({
+                    'type': 'Frequency Spike',
+                    'key': key,
+                    'current_count': current_count,
+                    'baseline_mean': mean,
+                    'severity': 'Medium' if current_count > mean * 2 else 'Low',
+                    'details': f"Constant baseline, sudden spike to {current_count}"
+                })
+                continue
+
+            z_score = float(z_scores[i])
+            severity = 'High' if abs(z_score) > threshold * 1.5 else 'Medium'
+            anomaly_type = "High Frequency" if z_score > 0 else "Low Frequency"
+            anomalies.append({
+                'type': anomaly_type,
+                'key': key,
+                'current_count': current_count,
+                'baseline_mean': mean,
+                'z_score': z_score,
+                'severity': severity,
+                'details': f"Z-score {z_score:.2f} for {key} count {current_count}"
+            })
 
-                z_score = (current_count - mean) / std_dev
-
-                if abs(z_score) > self.z_score_threshold:
-                    severity = 'High' if abs(z_score) > self.z_score_threshold * 1.5 else 'Medium'
-                    anomaly_type = "High Frequency" if z_score > 0 else "Low Frequency"
-                    anomalies.append({
-                        'type': anomaly_type,
-                        'key': key,
-                        'current_count': current_count,
-                        'baseline_mean': mean,
-                        'z_score': z_score,
-                        'severity': severity,
-                        'details': f"Z-score {z_score:.2f} for {key} count {current_count}"
-                    })
-
-       
-        self.current_window_counts.clear()
         return anomalies
+
+    def _enforce_limits(self):
+        live = np.flatnonzero(self._live)
+        idle = live[self._tick - self._last_active[live] > self.idle_ttl]
+        if len(idle):
+            self._evict(idle)
+            self.evicted_idle += len(idle)
+            live = np.flatnonzero(self._live)
+
+        if self.max_keys is not None and len(live) > self.max_keys:
+            excess = len(live) - self.max_keys
+            # Least recently active first; among equals, the shortest history goes first.
+            recency = self._last_active[live] * (self.history_size + 1) + self._lengths[live]
+            coldest = live[np.argpartition(recency, excess - 1)[:excess]]
+            self._evict(coldest)
+            self.evicted_lru += excess
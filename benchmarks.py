@@ -0,0 +1,1127 @@
+"""
+Benchmarks for the log analysis pipeline.
+
+Run all of them with `python benchmarks.py`, or pick some by name:
+`python benchmarks.py template_lookup`. `--output results.json` saves what
+the benchmarks return (micro and e2e) for comparing runs.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import joblib
+import numpy as np
+import requests
+from werkzeug.serving import make_server
+
+import instrumentation
+from alert_delivery import _TokenBucket
+from alerting_system import AlertingSystem
+from anomaly_detector import AnomalyDetector
+from dashboard_snapshots import DashboardPublisher
+from event_store import EventStore, replay
+from incident_predictor import IncidentPredictionEngine
+from log_generator import SyntheticLogGenerator
+from log_patterns import LogPatternRecognizer, TemplateMasker
+from log_parsers import LogParserRegistry, parse_simple_log
+from sharded_patterns import ShardedPatternRecognizer
+from stream_pipeline import StreamPipeline
+from template_store import TemplateJournal, TemplateStore
+
+
+def _timeit(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _sample_messages(count, seed=0):
+    rng = random.Random(seed)
+    shapes = [
+        "User {n} logged in from 10.0.{a}.{b}",
+        "Failed to connect to DB on port {n}. Error code {a}.",
+        "Processing message {uuid} completed successfully in {a}ms.",
+        "GET /api/v1/orders/{n} from host node-{a}.cluster.example.com returned 200",
+        "Cache miss for key session:{uuid}",
+    ]
+    uuids = [f"{rng.getrandbits(32):08x}-{rng.getrandbits(16):04x}-4{rng.getrandbits(12):03x}-"
+             f"a{rng.getrandbits(12):03x}-{rng.getrandbits(48):012x}" for _ in range(1000)]
+    return [rng.choice(shapes).format(n=rng.randrange(100000), a=rng.randrange(256), b=rng.randrange(256),
+                                      uuid=rng.choice(uuids))
+            for _ in range(count)]
+
+
+def _legacy_extract_template(message):
+    template = message
+    template = re.sub(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', '<IP_ADDR>', template)
+    template = re.sub(r'\d+', '<NUM>', template)
+    template = re.sub(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}', '<UUID>', template)
+    template = re.sub(r'[a-zA-Z0-9_-]+\.[a-zA-Z]{2,}', '<DOMAIN>', template)
+    return template, {}
+
+
+def bench_masking(lines=1_000_000):
+    """Single-pass TemplateMasker against the original four re.sub calls."""
+    messages = _sample_messages(lines)
+    masker = TemplateMasker()
+    timings = {}
+    for label, extract in (('legacy re.sub x4', _legacy_extract_template), ('TemplateMasker', masker.mask)):
+        timings[label] = elapsed = _timeit(lambda: [extract(m) for m in messages], repeat=1)
+        print(f"{label:<18} {lines:,} lines in {elapsed:6.2f}s  ({lines / elapsed:,.0f} lines/s)")
+    print(f"speedup: {timings['legacy re.sub x4'] / timings['TemplateMasker']:.2f}x")
+
+
+def bench_template_mining(lines=200_000):
+    """Throughput and template count of the regex and drain strategies."""
+    rng = random.Random(1)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+    messages = _sample_messages(lines)
+    # Add free-text variation that regex masking cannot fold into one template.
+    messages = [f"{m} by worker {rng.choice(words)}{rng.choice(words)}" for m in messages]
+    for strategy in ('regex', 'drain'):
+        recognizer = LogPatternRecognizer(template_storage_path=None, strategy=strategy)
+        events = [{'message': m, 'service_name': 'svc', 'timestamp': 0.0} for m in messages]
+        elapsed = _timeit(lambda: [recognizer.process_log_event(e) for e in events], repeat=1)
+        print(f"{strategy:<6} {lines / elapsed:10,.0f} lines/s  templates={len(recognizer.store):,}")
+
+
+def bench_template_lookup(sizes=(10, 1_000, 100_000, 1_000_000), lookups=200_000):
+    """Lookup time in TemplateStore as the number of templates grows."""
+    services = [f"service-{i}" for i in range(20)]
+    for size in sizes:
+        store = TemplateStore()
+        for i in range(size):
+            store.add(f"P{i + 1}", services[i % len(services)], f"Request <NUM> failed with code E{i}", 0.0)
+
+        rng = random.Random(size)
+        probes = []
+        for _ in range(lookups):
+            i = rng.randrange(size)
+            probes.append((services[i % len(services)], f"Request <NUM> failed with code E{i}"))
+
+        def run():
+            lookup = store.lookup
+            touch = store.touch
+            for service_name, template in probes:
+                touch(lookup(service_name, template), 1.0)
+
+        elapsed = _timeit(run)
+        print(f"templates={size:>9,}  lookup+touch={elapsed / lookups * 1e9:8.1f} ns/event")
+
+
+def bench_template_startup(size=1_000_000):
+    """Time to restore a recognizer's template store from its snapshot and journal."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'templates.bin')
+        store = TemplateStore()
+        journal = TemplateJournal(path, store)
+        journal.load()
+        for i in range(size):
+            store.add(f"P{i + 1}", f"service-{i % 20}", f"Request <NUM> failed with code E{i}", float(i))
+        start = time.perf_counter()
+        journal.flush(compact=True)
+        print(f"snapshot write: {time.perf_counter() - start:6.3f}s  ({os.path.getsize(path) / 1e6:.1f} MB)")
+        # Leave some work in the journal, as after a crash.
+        for i in range(0, size, 10):
+            store.touch(i, float(size + i))
+        store.add(f"P{size + 1}", "service-0", "Late template", float(size))
+        journal.flush()
+
+        restored = TemplateStore()
+        start = time.perf_counter()
+        TemplateJournal(path, restored).load()
+        elapsed = time.perf_counter() - start
+        print(f"startup with {len(restored):,} templates: {elapsed:6.3f}s")
+
+
+def _sample_log_lines(count, seed=0, start='2025-07-04 12:00:00', lines_per_second=1000):
+    """Lines in the `YYYY-MM-DD HH:MM:SS [LEVEL] service - msg` format."""
+    from datetime import datetime, timedelta
+    rng = random.Random(seed)
+    base = datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
+    services = [f"service-{i}" for i in range(20)]
+    levels = ['INFO'] * 8 + ['WARN', 'ERROR']
+    lines = []
+    for i, message in enumerate(_sample_messages(count, seed)):
+        stamp = (base + timedelta(seconds=i // lines_per_second)).strftime("%Y-%m-%d %H:%M:%S")
+        lines.append(f"{stamp} [{rng.choice(levels)}] {rng.choice(services)} - {message}")
+    return lines
+
+
+
+def _legacy_parse_log_event(raw_log_line, fixed=False):
+    """The original new.parse_log_event; `fixed` repairs its regexes (escaping, nginx brackets) so it actually parses."""
+    if fixed:
+        nginx = r'\[(\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4})\] "([A-Z]+) (.+?) HTTP/\d\.\d" (\d{3}) (\d+)'
+        java = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) \[(\w+)\] (.+?) - (.*)'
+    else:
+        nginx = r'(\\d{2}/\\w{3}/\\d{4}:\\d{2}:\\d{2}:\\d{2} \\+\\d{4}) "([A-Z]+) (.+?) HTTP/\\d\\.\\d" (\\d{3}) (\\d+)'
+        java = r'(\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}:\\d{2},\\d{3}) \\[(\\w+)\\] (.+?) - (.*)'
+    parsed_data = {}
+    try:
+        if "nginx" in raw_log_line:
+            match = re.search(nginx, raw_log_line)
+            if match:
+                parsed_data['timestamp'] = datetime.strptime(match.group(1), "%d/%b/%Y:%H:%M:%S %z")
+                parsed_data['service_name'] = 'nginx'
+                parsed_data['log_level'] = 'INFO' if 200 <= int(match.group(4)) < 400 else 'ERROR'
+                parsed_data['http_method'] = match.group(2)
+                parsed_data['request_path'] = match.group(3)
+                parsed_data['status_code'] = int(match.group(4))
+                parsed_data['bytes_sent'] = int(match.group(5))
+                parsed_data['message'] = f"Request {match.group(3)} returned {match.group(4)}"
+        elif "java" in raw_log_line and "OutOfMemoryError" in raw_log_line:
+            match = re.search(java, raw_log_line)
+            if match:
+                parsed_data['timestamp'] = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S,%f")
+                parsed_data['log_level'] = match.group(2)
+                parsed_data['service_name'] = match.group(3)
+                parsed_data['message'] = match.group(4)
+                parsed_data['error_type'] = 'OutOfMemoryError'
+        else:
+            parsed_data['timestamp'] = datetime.now()
+            parsed_data['log_level'] = 'UNKNOWN'
+            parsed_data['service_name'] = 'UNKNOWN'
+            parsed_data['message'] = raw_log_line
+    except Exception as e:
+        print(f"Error parsing log: {e} - {raw_log_line}")
+    return parsed_data
+
+
+def _mixed_format_corpus(per_format, seed=0, lines_per_second=200):
+    """(source, line) pairs: `per_format` lines of each supported format, each format from its own source."""
+    rng = random.Random(seed)
+    base = datetime(2025, 7, 4, 12, 0, 0)
+    corpus = []
+    for i in range(per_format):
+        at = base + timedelta(seconds=i // lines_per_second)
+        status = rng.choice([200, 200, 200, 304, 404, 500])
+        corpus.append(('app.log', f"{at:%Y-%m-%d %H:%M:%S} [INFO] service-{i % 20} - User {rng.randrange(10_000)} "
+                                  f"logged in from 10.0.{rng.randrange(256)}.{rng.randrange(256)}"))
+        corpus.append(('access.log', f'10.1.{rng.randrange(256)}.{rng.randrange(256)} - - '
+                                     f'[{at:%d/%b/%Y:%H:%M:%S} +0000] "GET /api/v1/orders/{rng.randrange(10_000)} '
+                                     f'HTTP/1.1" {status} {rng.randrange(5_000)} "-" "curl/8.4.0" nginx'))
+        corpus.append(('java.log', f"{at:%Y-%m-%d %H:%M:%S},{rng.randrange(1000):03d} [ERROR] com.acme.java.Worker - "
+                                   f"java.lang.OutOfMemoryError: Java heap space in thread pool-{rng.randrange(8)}"))
+        corpus.append(('syslog', f"<{rng.choice([11, 13, 14])}>{at:%b} {at.day:2d} {at:%H:%M:%S} node-{i % 5} "
+                                 f"sshd[{rng.randrange(30_000)}]: Accepted publickey for deploy port {rng.randrange(65_536)}"))
+        corpus.append(('events.jsonl', json.dumps({'ts': f"{at:%Y-%m-%dT%H:%M:%S}Z", 'level': 'warn', 'service': 'api',
+                                                   'msg': f"slow request {rng.randrange(10_000)}",
+                                                   'latency_ms': rng.randrange(2_000)})))
+    return corpus
+
+
+def bench_parsing(per_format=40_000):
+    """Throughput of LogParserRegistry on a mixed-format corpus against the original new.parse_log_event."""
+    corpus = _mixed_format_corpus(per_format)
+    lines = [line for _, line in corpus]
+    registry = LogParserRegistry()
+    variants = [
+        ('legacy as shipped (parses nothing)', lambda: [_legacy_parse_log_event(line) for line in lines]),
+        ('legacy with working regexes', lambda: [_legacy_parse_log_event(line, fixed=True) for line in lines]),
+        ('registry, detection per source', lambda: [registry.parse(line, source) for source, line in corpus]),
+        ('registry, one mixed source', lambda: [registry.parse(line) for line in lines]),
+    ]
+    rates = {}
+    for label, run in variants:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            elapsed = _timeit(run)
+        rates[label] = len(lines) / elapsed
+        print(f"{label:<36} {rates[label]:>10,.0f} lines/s")
+    print(f"per-source registry vs working legacy: "
+          f"{rates['registry, detection per source'] / rates['legacy with working regexes']:.1f}x  "
+          f"(unparsed: {registry.unparsed})")
+    for source in ('app.log', 'access.log', 'java.log', 'syslog', 'events.jsonl'):
+        format_lines = [line for s, line in corpus if s == source]
+        elapsed = _timeit(lambda: [registry.parse(line, source) for line in format_lines])
+        print(f"  {registry.source_format(source):<7} {len(format_lines) / elapsed:>10,.0f} lines/s")
+
+
+def bench_columnar(events=1_000_000, batch_size=8_192):
+    """Parse, pattern and count stages with dict-per-event vs EventBatch columns."""
+    lines = _sample_log_lines(events, lines_per_second=2_000)
+    chunks = [lines[i:i + batch_size] for i in range(0, events, batch_size)]
+
+    def dict_per_event():
+        registry = LogParserRegistry()
+        recognizer = LogPatternRecognizer(template_storage_path=None)
+        detector = AnomalyDetector(window_size=5, window_seconds=60)
+        timings = [0.0, 0.0, 0.0]
+        for chunk in chunks:
+            start = time.perf_counter()
+            parsed = [registry.parse(line) for line in chunk]
+            parsed_at = time.perf_counter()
+            for event in parsed:
+                recognizer.process_log_event(event)
+            recognized_at = time.perf_counter()
+            for event in parsed:
+                detector.update_counts(event)
+            timings[0] += parsed_at - start
+            timings[1] += recognized_at - parsed_at
+            timings[2] += time.perf_counter() - recognized_at
+        detector.flush()
+        return timings, detector.windows_emitted
+
+    def batched():
+        registry = LogParserRegistry()
+        recognizer = LogPatternRecognizer(template_storage_path=None)
+        detector = AnomalyDetector(window_size=5, window_seconds=60)
+        timings = [0.0, 0.0, 0.0]
+        for chunk in chunks:
+            start = time.perf_counter()
+            batch = registry.parse_batch(chunk)
+            parsed_at = time.perf_counter()
+            recognizer.process_event_batch(batch)
+            recognized_at = time.perf_counter()
+            detector.update_counts(batch)
+            timings[0] += parsed_at - start
+            timings[1] += recognized_at - parsed_at
+            timings[2] += time.perf_counter() - recognized_at
+        detector.flush()
+        return timings, detector.windows_emitted
+
+    results = {}
+    for name, run in (('dict per event', dict_per_event), ('EventBatch', batched)):
+        timings, windows = run()
+        results[name] = sum(timings)
+        print(f"{name:<15} {events / sum(timings):>10,.0f} events/s  parse {timings[0]:5.2f}s  "
+              f"pattern {timings[1]:5.2f}s  count {timings[2]:5.2f}s  ({windows} windows)")
+    print(f"batch speedup: {results['dict per event'] / results['EventBatch']:.1f}x")
+
+
+def bench_pipeline(lines=500_000):
+    """End-to-end StreamPipeline run with per-stage throughput."""
+    log_lines = _sample_log_lines(lines)
+    pipeline = StreamPipeline(recognizer=LogPatternRecognizer(template_storage_path=None),
+                              detector=AnomalyDetector(window_size=5, history_size=10, window_seconds=60))
+    start = time.perf_counter()
+    metrics = pipeline.run(log_lines)
+    elapsed = time.perf_counter() - start
+    print(f"{lines:,} lines in {elapsed:.2f}s ({lines / elapsed:,.0f} lines/s wall clock)")
+    for name, stage in metrics['stages'].items():
+        print(f"  {name:<8} in={stage['items_in']:>9,}  {stage['items_per_busy_second']:>12,.0f} items/busy-s"
+              f"  max_queue={stage['max_queue_depth']}")
+
+
+def bench_sharded_patterns(lines=400_000, worker_counts=(1, 2, 4, 8), batch_size=20_000):
+    """Throughput of ShardedPatternRecognizer for increasing worker counts."""
+    events = [parse_simple_log(line) for line in _sample_log_lines(lines)]
+    recognizer = LogPatternRecognizer(template_storage_path=None)
+    elapsed = _timeit(lambda: [recognizer.process_log_event(dict(e)) for e in events], repeat=1)
+    print(f"in-process  {lines / elapsed:10,.0f} events/s")
+    for workers in worker_counts:
+        sharded = ShardedPatternRecognizer(workers=workers)
+        detector = AnomalyDetector()
+
+        def run():
+            for i in range(0, lines, batch_size):
+                _, key_deltas = sharded.process_batch([dict(e) for e in events[i:i + batch_size]])
+                detector.add_counts(key_deltas)
+
+        elapsed = _timeit(run, repeat=1)
+        sharded.close()
+        print(f"workers={workers}   {lines / elapsed:10,.0f} events/s  templates={len(sharded.store):,}")
+
+
+class _LegacyAnomalyDetector:
+    """The original deque-per-key detector, kept as a baseline."""
+
+    def __init__(self, window_size=60, z_score_threshold=3.0, history_size=1000):
+        from collections import defaultdict, deque
+        self.metrics_history = defaultdict(lambda: deque(maxlen=history_size))
+        self.window_size = window_size
+        self.z_score_threshold = z_score_threshold
+        self.current_window_counts = defaultdict(int)
+
+    def detect_anomalies_in_window(self):
+        anomalies = []
+        for key, current_count in self.current_window_counts.items():
+            history = self.metrics_history[key]
+            history.append(current_count)
+            if len(history) >= self.window_size:
+                mean = np.mean(list(history)[-self.window_size:])
+                std_dev = np.std(list(history)[-self.window_size:])
+                if std_dev == 0:
+                    continue
+                z_score = (current_count - mean) / std_dev
+                if abs(z_score) > self.z_score_threshold:
+                    anomalies.append({'key': key, 'z_score': z_score})
+        self.current_window_counts.clear()
+        return anomalies
+
+
+def bench_anomaly_tick(key_counts=(1_000, 100_000, 1_000_000), window_size=30, legacy_max_keys=100_000):
+    """Time of one detect_anomalies_in_window tick once every key has a full window."""
+    rng = np.random.default_rng(0)
+    for key_count in key_counts:
+        keys = [(f"service-{i % 50}", 'INFO', f"P{i}") for i in range(key_count)]
+        variants = [('ring buffer', AnomalyDetector)]
+        if key_count <= legacy_max_keys:
+            variants.append(('legacy deques', _LegacyAnomalyDetector))
+        for label, detector_class in variants:
+            detector = detector_class(window_size=window_size, history_size=window_size * 2)
+            elapsed = 0.0
+            for _ in range(window_size + 1):
+                detector.current_window_counts.update(zip(keys, rng.poisson(20, key_count).tolist()))
+                start = time.perf_counter()
+                detector.detect_anomalies_in_window()
+                elapsed = time.perf_counter() - start
+            print(f"keys={key_count:>9,}  {label:<14} tick={elapsed * 1000:9.1f} ms")
+
+
+def bench_anomaly_key_churn(ticks=300, steady_keys=1_000, transient_per_tick=5_000, memory_budget_bytes=32 * 1024 ** 2):
+    """Key count and memory of AnomalyDetector under a stream of short-lived keys."""
+    detector = AnomalyDetector(window_size=30, memory_budget_bytes=memory_budget_bytes)
+    steady = [('service-0', 'INFO', f"P{i}") for i in range(steady_keys)]
+    start = time.perf_counter()
+    for tick in range(ticks):
+        counts = detector.current_window_counts
+        for key in steady:
+            counts[key] += 10
+        for i in range(transient_per_tick):
+            counts[('service-1', 'DEBUG', f"T{tick}-{i}")] += 1
+        detector.detect_anomalies_in_window()
+        if (tick + 1) % 50 == 0:
+            stats = detector.stats()
+            print(f"tick={tick + 1:>4}  keys={stats['keys']:>8,}  bytes={stats['bytes'] / 1e6:7.1f} MB  "
+                  f"evicted idle={stats['evicted_idle']:,} lru={stats['evicted_lru']:,}")
+    print(f"{(time.perf_counter() - start) / ticks * 1000:.1f} ms per tick")
+
+
+def bench_anomaly_sketch(ticks=50, window_size=30, steady_keys=500, leaked_per_tick=20_000, top_k=1_000):
+    """Memory, speed and accuracy of approximate=True against the exact detector on a leaky pattern."""
+    rng = np.random.default_rng(0)
+    steady = [(f"service-{i % 10}", 'INFO', f"P{i}") for i in range(steady_keys)]
+    windows = []
+    for tick in range(ticks):
+        counts = rng.poisson(200, steady_keys)
+        if tick >= window_size and tick % 7 == 0:
+            counts[:20] *= 3
+        deltas = dict(zip(steady, counts.tolist()))
+        # A pattern that leaked a variable token: every event is a new key.
+        deltas.update(((f"service-{i % 10}", 'DEBUG', f"L{tick}-{i}"), 1) for i in range(leaked_per_tick))
+        windows.append(deltas)
+
+    results = {}
+    for label, options in (('exact', {}), ('approximate', {'approximate': True, 'top_k': top_k})):
+        detector = AnomalyDetector(window_size=window_size, **options)
+        found = set()
+        peak_bytes = 0
+        elapsed = 0.0
+        for tick, deltas in enumerate(windows):
+            start = time.perf_counter()
+            detector.add_counts(deltas)
+            anomalies = detector.detect_anomalies_in_window()
+            elapsed += time.perf_counter() - start
+            found.update((tick, a['key'], a['type']) for a in anomalies if a['key'][1] == 'INFO')
+            stats = detector.stats()
+            peak_bytes = max(peak_bytes, stats['bytes'] + stats['sketch_bytes'])
+        results[label] = found
+        steady_error = np.mean([abs(detector.get_history(key)[-1] - windows[-1][key]) / windows[-1][key]
+                                for key in steady])
+        print(f"{label:<12} {elapsed / ticks * 1000:8.1f} ms/tick  peak={peak_bytes / 1e6:8.1f} MB  "
+              f"keys={detector.stats()['keys']:>9,}  steady count error={steady_error:.2%}")
+    print(f"distinct keys per service, last window: true={leaked_per_tick // 10 + steady_keys // 10:,}  "
+          f"estimated={sorted(detector.window_cardinality.values())}")
+    exact, approximate = results['exact'], results['approximate']
+    matched = len(exact & approximate)
+    print(f"steady-key anomalies: exact={len(exact)}  approximate={len(approximate)}  "
+          f"recall={matched / max(len(exact), 1):.1%}  precision={matched / max(len(approximate), 1):.1%}")
+
+
+class _LegacyIncidentPredictionEngine(IncidentPredictionEngine):
+    """The original rule x trigger x anomaly scan, kept as a baseline."""
+
+    def predict_incidents(self, now=None):
+        predicted_incidents = []
+        current_time = now if now is not None else datetime.now()
+        for rule in self.incident_rules:
+            matched_triggers = []
+            for trigger in rule['trigger_patterns']:
+                for anomaly_data in self.active_anomalies.values():
+                    if 'key' in anomaly_data and isinstance(anomaly_data['key'], tuple):
+                        service_name, _, pattern_id = anomaly_data['key']
+                        if (trigger[0] == 'service_name' and service_name == trigger[1] and
+                                pattern_id and trigger[2] in pattern_id):
+                            matched_triggers.append(anomaly_data)
+                            break
+            for trigger_anomaly_type in rule.get('trigger_anomalies', []):
+                for anomaly_data in self.active_anomalies.values():
+                    if anomaly_data['type'] == trigger_anomaly_type:
+                        matched_triggers.append(anomaly_data)
+            if len(matched_triggers) >= rule['min_concurrency']:
+                first_match_time = min(m['timestamp'] for m in matched_triggers)
+                if (current_time - first_match_time).total_seconds() / 60 <= rule['time_window_minutes']:
+                    incident_key = f"{rule['name']}-{matched_triggers[0]['key']}"
+                    if incident_key not in self.potential_incidents or \
+                       (current_time - self.potential_incidents[incident_key]['last_alert_time']).total_seconds() > 300:
+                        predicted_incidents.append({'rule_name': rule['name'], 'timestamp': current_time,
+                                                    'contextual_data': {'active_anomalies_matched':
+                                                                        [m['key'] for m in matched_triggers]}})
+                        self.potential_incidents[incident_key] = {'last_alert_time': current_time}
+        return predicted_incidents
+
+
+def _sample_anomaly(rng, services, types, timestamp):
+    return {'type': rng.choice(types), 'key': (rng.choice(services), 'ERROR', f"P{rng.randrange(1000)}"),
+            'timestamp': timestamp}
+
+
+def bench_incident_rules(rule_count=1_000, anomaly_count=10_000, ticks=10):
+    """predict_incidents tick time with 1k rules and 10k active anomalies, indexed vs. full scan."""
+    rng = random.Random(0)
+    services = [f"service-{i}" for i in range(100)]
+    types = ['Frequency Spike', 'High Frequency', 'Low Frequency', 'Silence']
+    rules = [{
+        'name': f"rule-{i}",
+        'trigger_patterns': [('service_name', rng.choice(services), f"P{rng.randrange(100)}")
+                             for _ in range(rng.randint(1, 3))],
+        'trigger_anomalies': [rng.choice(types)] if rng.random() < 0.01 else [],
+        'min_concurrency': rng.randint(2, 3),
+        'time_window_minutes': 10,
+        'severity': 'HIGH',
+        'predicted_impact': '',
+    } for i in range(rule_count)]
+    # Anomalies arrive evenly over a 10 minute horizon; every tick (one
+    # minute) expires the oldest tenth and admits as many new ones.
+    start = datetime(2024, 1, 1)
+    per_tick = anomaly_count // 10
+    batches = [[_sample_anomaly(rng, services, types, start + timedelta(minutes=minute, seconds=rng.randrange(60)))
+                for _ in range(per_tick)] for minute in range(10 + ticks)]
+
+    results = {}
+    for label, engine_class in (('indexed', IncidentPredictionEngine), ('full scan', _LegacyIncidentPredictionEngine)):
+        engine = engine_class()
+        engine.incident_rules = [dict(rule) for rule in rules]
+        for batch in batches[:10]:
+            for anomaly in batch:
+                engine.add_active_anomaly(anomaly)
+        incidents = []
+        elapsed = 0.0
+        for tick in range(ticks):
+            now = start + timedelta(minutes=10 + tick)
+            begin = time.perf_counter()
+            for anomaly in batches[tick]:
+                engine.clear_resolved_anomaly(f"{anomaly['type']}-{anomaly['key']}-{anomaly['timestamp']}")
+            for anomaly in batches[10 + tick]:
+                engine.add_active_anomaly(anomaly)
+            incidents.extend(engine.predict_incidents(now=now))
+            elapsed += time.perf_counter() - begin
+        results[label] = [(i['rule_name'], i['timestamp'], i['contextual_data']['active_anomalies_matched'])
+                          for i in incidents]
+        print(f"{label:<10} {elapsed / ticks * 1000:8.1f} ms/tick (expiry + admission + prediction)  "
+              f"incidents={len(incidents)}")
+    print(f"identical incidents: {results['indexed'] == results['full scan']}")
+
+
+def bench_incident_expiry(hours=24, anomalies_per_minute=200, rule_count=1_000):
+    """Live-set size and tick time of IncidentPredictionEngine over a long run that never clears anomalies."""
+    rng = random.Random(0)
+    services = [f"service-{i}" for i in range(100)]
+    types = ['Frequency Spike', 'High Frequency', 'Low Frequency', 'Silence']
+    engine = IncidentPredictionEngine()
+    engine.incident_rules = [{
+        'name': f"rule-{i}",
+        'trigger_patterns': [('service_name', rng.choice(services), f"P{rng.randrange(100)}")],
+        'trigger_anomalies': [rng.choice(types)] if rng.random() < 0.01 else [],
+        'min_concurrency': 2,
+        'time_window_minutes': rng.choice((5, 10, 30)),
+        'severity': 'HIGH',
+        'predicted_impact': '',
+    } for i in range(rule_count)]
+    start = datetime(2024, 1, 1)
+    elapsed = 0.0
+    for minute in range(hours * 60):
+        now = start + timedelta(minutes=minute)
+        anomalies = [_sample_anomaly(rng, services, types, now - timedelta(seconds=rng.randrange(60)))
+                     for _ in range(anomalies_per_minute)]
+        begin = time.perf_counter()
+        for anomaly in anomalies:
+            engine.add_active_anomaly(anomaly)
+        engine.predict_incidents(now=now)
+        elapsed += time.perf_counter() - begin
+        if (minute + 1) % (4 * 60) == 0:
+            stats = engine.stats()
+            print(f"hour={(minute + 1) // 60:>3}  active={stats['active_anomalies']:>7,}  "
+                  f"cooldowns={stats['potential_incidents']:>5,}  expired={stats['expired_anomalies']:>9,}  "
+                  f"queue={stats['expiry_queue']:>7,}  bytes={stats['bytes'] / 1e6:6.2f} MB  "
+                  f"{elapsed / (minute + 1) * 1000:6.1f} ms/tick")
+
+
+class _LogisticModel:
+    """Stand-in for a fitted classifier: anything with predict_proba works."""
+
+    def __init__(self, weights, bias):
+        self.coef_ = np.asarray(weights, dtype=np.float64)
+        self.intercept_ = bias
+
+    def predict_proba(self, features):
+        positive = 1.0 / (1.0 + np.exp(-(features @ self.coef_ + self.intercept_)))
+        return np.column_stack([1.0 - positive, positive])
+
+
+def bench_incident_scoring(candidates=10_000, anomalies_per_service=3):
+    """ML scoring latency for 10k candidate incidents: batched, cached and one call per incident."""
+    rng = random.Random(0)
+    types = ['Frequency Spike', 'High Frequency', 'Low Frequency', 'Silence']
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = os.path.join(directory, 'incident_model.pkl')
+        joblib.dump(_LogisticModel([0.8, 0.6, 0.3, 1.2, 0.1, 0.5, 0.2, 0.3], -6.0), model_path)
+        engine = IncidentPredictionEngine(model_path=model_path, use_ml_model=True)
+        engine.incident_rules = []
+        now = datetime(2024, 1, 1)
+        for i in range(candidates):
+            for _ in range(anomalies_per_service):
+                engine.add_active_anomaly({
+                    'type': rng.choice(types), 'key': (f"service-{i}", 'ERROR', f"P{rng.randrange(50)}"),
+                    'timestamp': now, 'severity': rng.choice(['High', 'Medium']),
+                    'z_score': rng.uniform(-8, 8), 'current_count': rng.randrange(1, 500), 'baseline_mean': 50.0,
+                })
+
+        start = time.perf_counter()
+        model = engine._load_model(model_path)
+        load = time.perf_counter() - start
+        start = time.perf_counter()
+        services, features = engine._feature_matrix()
+        build = time.perf_counter() - start
+        cold = _timeit(lambda: engine.score_features(features, model), repeat=1)
+        warm = _timeit(lambda: engine.score_features(features, model))
+        batched = _timeit(lambda: model.predict_proba(features))
+        per_row = _timeit(lambda: [model.predict_proba(row[None, :]) for row in features], repeat=1)
+        incidents = engine.predict_incidents(now=now)
+    print(f"candidates={len(services):,}  load={load * 1000:.1f} ms  features={build * 1000:.1f} ms")
+    print(f"one predict_proba={batched * 1000:.1f} ms  cold cache={cold * 1000:.1f} ms  warm cache={warm * 1000:.1f} ms  "
+          f"one call per incident={per_row * 1000:.1f} ms  incidents={len(incidents):,}")
+
+
+class _StubAlertHandler(BaseHTTPRequestHandler):
+    """Local stand-in for Slack: counts requests and connections, fails some, takes `latency` per call."""
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.server.latency)
+        self.server.requests += 1
+        failed = self.server.rng.random() < self.server.failure_rate
+        if not failed:
+            self.server.alert_ids.update(re.findall(r'Alert ID:\*\\n`([^`]+)`', body.decode()))
+            self.server.messages += 1
+        self.send_response(500 if failed else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _stub_alert_server(latency, failure_rate):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubAlertHandler)
+    server.latency, server.failure_rate, server.rng = latency, failure_rate, random.Random(0)
+    server.requests = server.connections = server.messages = 0
+    server.alert_ids = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_alert_delivery(alerts=2_000, latency=0.05, failure_rate=0.2):
+    """send_alert latency and delivery against a local stub webhook that is slow and fails 20% of requests."""
+    server = _stub_alert_server(latency, failure_rate)
+    url = f"http://127.0.0.1:{server.server_port}/hook"
+    incidents = [{'alert_id': f"PRED-{i}", 'timestamp': datetime(2024, 1, 1), 'severity': 'HIGH',
+                  'rule_name': 'bench', 'component_s_affected': [f"svc-{i}"]} for i in range(alerts)]
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = os.path.join(directory, 'alerts.outbox')
+        alerting = AlertingSystem(slack_webhook_url=url, outbox_path=outbox, coalesce_seconds=0.2)
+        alerting.delivery._queues['slack'].destination.rate_per_minute = 6_000
+        alerting.delivery._queues['slack'].bucket = _TokenBucket(6_000)
+        alerting.delivery.backoff_base = 0.05
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for incident in incidents:
+                alerting.send_alert(incident)
+        submitted = time.perf_counter() - start
+        drained = alerting.delivery.flush(timeout=120)
+        elapsed = time.perf_counter() - start
+        stats = alerting.delivery.stats()
+        alerting.close()
+        print(f"send_alert {submitted / alerts * 1e6:.0f} us/alert  drained={drained} in {elapsed:.1f}s  "
+              f"delivered={stats['delivered']:,}  dropped={stats['dropped']}")
+        print(f"requests={server.requests:,} (failed attempts={stats['failed_attempts']})  "
+              f"connections={server.connections}  messages accepted={server.messages:,}  "
+              f"distinct alerts received={len(server.alert_ids):,}")
+
+        # Restart: queue alerts while the endpoint is unreachable, abandon that
+        # instance, then let a fresh one deliver them from the outbox.
+        down = AlertingSystem(slack_webhook_url='http://127.0.0.1:9/unreachable', outbox_path=outbox,
+                              coalesce_seconds=60)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for incident in incidents[:100]:
+                down.send_alert(dict(incident, alert_id=incident['alert_id'] + '-restart', rule_name='restart'))
+        down.close(timeout=0)
+        server.alert_ids.clear()
+        restarted = AlertingSystem(slack_webhook_url=url, outbox_path=outbox, coalesce_seconds=0.2)
+        restarted.delivery.backoff_base = 0.05
+        restarted.delivery.flush(timeout=60)
+        restarted.close()
+        print(f"after restart: {len(server.alert_ids)} of 100 queued alerts delivered from the outbox")
+    server.shutdown()
+
+
+def bench_dashboard(events=100_000, clients=8, requests_per_client=250, publish_batch=512):
+    """
+    Dashboard latency under concurrent clients against 100k retained events,
+    while the pipeline keeps publishing; a third of requests revalidate with
+    If-None-Match.
+    """
+    import web_dashboard
+
+    lines = _sample_log_lines(events + 50_000)
+    registry = LogParserRegistry()
+    recognizer = LogPatternRecognizer(template_storage_path=None)
+    publisher = DashboardPublisher(max_events=events)
+    for i in range(0, events, publish_batch):
+        publisher.publish(events=recognizer.process_event_batch(registry.parse_batch(lines[i:i + publish_batch])))
+    anomalies = [{'type': 'High Frequency', 'key': (f"service-{i % 20}", 'ERROR', f"P{i}"), 'current_count': 50,
+                  'baseline_mean': 5.0, 'z_score': 4.2, 'severity': 'High', 'details': 'bench',
+                  'timestamp': datetime(2025, 7, 4, 12, 0)} for i in range(200)]
+    publisher.publish(anomalies=anomalies)
+    web_dashboard.publisher = publisher
+
+    # Legacy routes re-parsed and re-recognized every log on each hit.
+    legacy = LogPatternRecognizer(template_storage_path=None)
+    start = time.perf_counter()
+    [legacy.process_log_event(parse_simple_log(line)) for line in lines[:events]]
+    legacy_seconds = time.perf_counter() - start
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, web_dashboard.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    stop = threading.Event()
+
+    def keep_publishing():
+        position = events
+        while not stop.is_set() and position < len(lines):
+            publisher.publish(events=recognizer.process_event_batch(
+                registry.parse_batch(lines[position:position + publish_batch])))
+            position += publish_batch
+            time.sleep(0.01)
+
+    latencies = {'/': [], '/api/logs': [], '/api/anomalies': [], '304': []}
+
+    def client(seed):
+        session = requests.Session()
+        local = random.Random(seed)
+        etags = {}
+        for _ in range(requests_per_client):
+            choice = local.random()
+            if choice < 0.2:
+                route, url = '/', base + '/'
+            elif choice < 0.8:
+                cursor = local.randrange(publisher.snapshot.first_seq, publisher.snapshot.end_seq)
+                route, url = '/api/logs', f"{base}/api/logs?cursor={cursor}&limit=100"
+                if local.random() < 0.5:
+                    url = f"{base}/api/logs?cursor={local.randrange(0, 10) * 100 + publisher.snapshot.first_seq}"
+            else:
+                route, url = '/api/anomalies', base + '/api/anomalies'
+            headers = {}
+            if url in etags and local.random() < 0.33:
+                headers['If-None-Match'] = etags[url]
+            begin = time.perf_counter()
+            response = session.get(url, headers=headers)
+            elapsed = time.perf_counter() - begin
+            if 'ETag' in response.headers:
+                etags[url] = response.headers['ETag']
+            latencies['304' if response.status_code == 304 else route].append(elapsed)
+        session.close()
+
+    publisher_thread = threading.Thread(target=keep_publishing, daemon=True)
+    publisher_thread.start()
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    stop.set()
+    publisher_thread.join()
+    server.shutdown()
+
+    total = sum(len(samples) for samples in latencies.values())
+    print(f"legacy /api/logs over {events:,} logs: {legacy_seconds * 1000:,.0f} ms per request")
+    print(f"{clients} clients, {total:,} requests in {wall:.1f}s ({total / wall:,.0f} req/s), "
+          f"{publisher.snapshot.version:,} snapshots published")
+    for route, samples in latencies.items():
+        if samples:
+            p50, p99 = np.percentile(np.array(samples) * 1000, [50, 99])
+            print(f"  {route:<15} n={len(samples):>5}  p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
+    all_samples = np.concatenate([np.array(samples) for samples in latencies.values() if samples]) * 1000
+    print(f"  {'all':<15} n={len(all_samples):>5}  p50 {np.percentile(all_samples, 50):6.2f} ms  "
+          f"p99 {np.percentile(all_samples, 99):6.2f} ms")
+
+
+def bench_event_store(events=1_000_000, batch_size=8_192):
+    """Segment store over a week of events: write, range + pattern queries against a full scan, and replay."""
+    lines = _sample_log_lines(events, lines_per_second=2)
+    registry = LogParserRegistry()
+    recognizer = LogPatternRecognizer(template_storage_path=None)
+    batches = [recognizer.process_event_batch(registry.parse_batch(lines[i:i + batch_size]))
+               for i in range(0, events, batch_size)]
+    with tempfile.TemporaryDirectory() as directory:
+        store = EventStore(directory, segment_seconds=3600)
+        start = time.perf_counter()
+        for batch in batches:
+            store.append(batch)
+        store.flush()
+        elapsed = time.perf_counter() - start
+        stats = store.stats()
+        print(f"write   {events / elapsed:10,.0f} events/s  {stats['segments']} segments  "
+              f"{stats['bytes'] / events:.0f} bytes/event")
+
+        store = EventStore(directory)
+        pattern_id, service = 'P7', store.query(pattern_id='P7', limit=1)[0]['service_name']
+        begin = datetime(2025, 7, 7, 9, 0)
+        end = begin + timedelta(hours=1)
+
+        def full_scan():
+            matched = 0
+            for segment in store.segments:
+                timestamps = segment.column('timestamps')
+                codes = segment.column('pattern_codes')
+                wanted = segment.patterns.index(pattern_id) if pattern_id in segment.patterns else -1
+                mask = ((codes == wanted) & (timestamps >= begin.timestamp() * 1000) &
+                        (timestamps < end.timestamp() * 1000))
+                matched += int(np.count_nonzero(mask))
+            return matched
+
+        found = store.query(begin, end, pattern_id=pattern_id, service=service)
+        indexed = _timeit(lambda: store.query(begin, end, pattern_id=pattern_id, service=service), repeat=5)
+        scanned = _timeit(full_scan, repeat=5)
+        print(f"query   1h of {pattern_id} on {service}: {len(found)} events in {indexed * 1000:.2f} ms "
+              f"(full columnar scan {scanned * 1000:.1f} ms, {scanned / indexed:.0f}x)")
+        timeline = _timeit(lambda: store.pattern_timeline(pattern_id, bucket_seconds=3600), repeat=5)
+        print(f"timeline of {pattern_id} over the week, hourly: {timeline * 1000:.1f} ms")
+
+        for label, options in (('stored patterns', {}),
+                               ('re-recognized', {'recognizer': LogPatternRecognizer(template_storage_path=None)})):
+            detector = AnomalyDetector(window_size=10, window_seconds=60)
+            start = time.perf_counter()
+            result = replay(store, detector, **options)
+            elapsed = time.perf_counter() - start
+            print(f"replay  {label:<16} {result['events'] / elapsed:10,.0f} events/s  "
+                  f"{detector.windows_emitted:,} windows  {len(result['anomalies']):,} anomalies")
+
+
+def bench_alert_dedupe(alerts_per_minute=50_000, minutes=15, recurring=2_000, repeat_share=0.7):
+    """Dedupe cache size and process memory at 50k alerts/min, 70% of them repeats of 2k recurring incidents."""
+    rng = random.Random(0)
+    alerting = AlertingSystem()
+    start = datetime(2024, 1, 1)
+    step = timedelta(minutes=1) / alerts_per_minute
+    unique = 0
+    tracemalloc.start()
+    began = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for minute in range(minutes):
+            for i in range(alerts_per_minute):
+                if rng.random() < repeat_share:
+                    incident = rng.randrange(recurring)
+                else:
+                    incident = recurring + unique
+                    unique += 1
+                now = start + (minute * alerts_per_minute + i) * step
+                alerting.send_alert({'alert_id': f"PRED-{now:%H%M%S}", 'timestamp': now, 'severity': 'HIGH',
+                                     'rule_name': f"rule-{incident % 50}",
+                                     'component_s_affected': [f"service-{incident}"],
+                                     'contextual_data': {'active_anomalies_matched': [('service', 'ERROR', f"P{incident}")]}},
+                                    now=now)
+            if (minute + 1) % 3 == 0:
+                stats = alerting.stats()
+                current, _ = tracemalloc.get_traced_memory()
+                with contextlib.redirect_stdout(sys.__stdout__):
+                    print(f"minute={minute + 1:>3}  entries={stats['dedupe_entries']:>7,}  "
+                          f"suppressed={stats['suppressed']:>9,}  rollups={stats['rollups_sent']:>6,}  "
+                          f"traced memory={current / 1e6:6.1f} MB")
+    elapsed = time.perf_counter() - began
+    tracemalloc.stop()
+    print(f"{alerts_per_minute * minutes / elapsed:,.0f} alerts/s through send_alert")
+
+
+def bench_micro(lines=200_000, batch_size=8_192, anomalies=10_000, alerts=20_000):
+    """Time per call of each method in instrumentation.HOT_METHODS, on generated logs."""
+    generator = SyntheticLogGenerator(lines_per_second=500)
+    log_lines = generator.lines(lines)
+    chunks = [log_lines[i:i + batch_size] for i in range(0, lines, batch_size)]
+    registry = LogParserRegistry()
+    recognizer = LogPatternRecognizer(template_storage_path=None)
+    events = [registry.parse(line) for line in log_lines]
+    messages = [event['message'] for event in events]
+    # Every template is known by the time anything is timed, as in a long-running process.
+    batches = [recognizer.process_event_batch(registry.parse_batch(chunk)) for chunk in chunks]
+    for event in events:
+        recognizer.process_log_event(event)
+    lookups = [(event['service_name'], event['template']) for event in events]
+
+    rng = random.Random(0)
+    types = ['Frequency Spike', 'High Frequency', 'Low Frequency', 'Silence']
+    sample_anomalies = [_sample_anomaly(rng, generator.services, types,
+                                        generator.start + timedelta(seconds=rng.randrange(600)))
+                        for _ in range(anomalies)]
+    now = generator.start + timedelta(minutes=10)
+
+    def loop(method, arguments):
+        def run():
+            for argument in arguments:
+                method(argument)
+        return run
+
+    def update_counts():
+        detector = AnomalyDetector(window_size=20, window_seconds=60)
+        for batch in batches:
+            detector.update_counts(batch)
+
+    def tick_window(keys=10_000, ticks=20):
+        # Only the tick is timed, not filling the window's counts.
+        np_rng = np.random.default_rng(0)
+        detector = AnomalyDetector(window_size=ticks, history_size=ticks * 2)
+        key_list = [(f"service-{i % 50}", 'INFO', f"P{i}") for i in range(keys)]
+        elapsed = 0.0
+        for _ in range(ticks * 2):
+            detector.current_window_counts.update(zip(key_list, np_rng.poisson(20, keys).tolist()))
+            start = time.perf_counter()
+            detector._tick_window()
+            elapsed += time.perf_counter() - start
+        return elapsed
+
+    def add_active_anomaly():
+        engine = IncidentPredictionEngine()
+        for anomaly in sample_anomalies:
+            engine.add_active_anomaly(anomaly)
+
+    engine = IncidentPredictionEngine()
+    for anomaly in sample_anomalies:
+        engine.add_active_anomaly(anomaly)
+
+    def predict_incidents():
+        for _ in range(20):
+            engine.predict_incidents(now=now)
+
+    def send_alert():
+        alerting = AlertingSystem()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for i in range(alerts):
+                at = now + timedelta(milliseconds=i)
+                alerting.send_alert({'alert_id': f"PRED-{i}", 'timestamp': at, 'severity': 'HIGH',
+                                     'rule_name': f"rule-{i % 50}", 'component_s_affected': [f"service-{i % 500}"],
+                                     'contextual_data': {}}, now=at)
+
+    results = {}
+
+    def report(name, calls, seconds, events=None):
+        # A size parameter of 0 (e.g. no anomalies) leaves nothing to divide by.
+        if not calls:
+            results[name] = {'calls': 0, 'ns_per_call': None}
+            print(f"{name:<55} {'n/a':>14} (no calls)")
+            return
+        results[name] = {'calls': calls, 'ns_per_call': seconds / calls * 1e9}
+        line = f"{name:<55} {seconds / calls * 1e9:>14,.0f} ns/call"
+        if events:
+            results[name]['ns_per_event'] = seconds / events * 1e9
+            line += f"  {seconds / events * 1e9:>8,.0f} ns/event"
+        print(line)
+
+    report('LogParserRegistry.parse', lines, _timeit(loop(registry.parse, log_lines)))
+    report('LogParserRegistry.parse_batch', len(chunks), _timeit(loop(registry.parse_batch, chunks)), lines)
+    report('TemplateMasker.mask', lines, _timeit(loop(recognizer.masker.mask, messages)))
+    report('LogPatternRecognizer.process_log_event', lines, _timeit(loop(recognizer.process_log_event, events)))
+    report('LogPatternRecognizer.process_event_batch', len(batches),
+           _timeit(loop(recognizer.process_event_batch, batches)), lines)
+    lookup = recognizer.store.lookup
+    report('TemplateStore.lookup', lines, _timeit(lambda: [lookup(service, template) for service, template in lookups]))
+    report('AnomalyDetector.update_counts', len(batches), _timeit(update_counts), lines)
+    report('AnomalyDetector._tick_window (10k keys)', 40, min(tick_window() for _ in range(3)))
+    report('IncidentPredictionEngine.add_active_anomaly', anomalies, _timeit(add_active_anomaly))
+    report(f"IncidentPredictionEngine.predict_incidents ({anomalies // 1000}k active)", 20,
+           _timeit(predict_incidents))
+    report('AlertingSystem.send_alert', alerts, _timeit(send_alert))
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = EventStore(directory, segment_seconds=600)
+
+        def append():
+            for batch in batches:
+                store.append(batch)
+            store.flush()
+
+        report('EventStore.append', len(batches), _timeit(append, repeat=1), lines)
+        pattern_id = batches[0].patterns[0]
+        ranges = [(generator.start + timedelta(minutes=minute), generator.start + timedelta(minutes=minute + 1))
+                  for minute in range(lines // generator.lines_per_second // 60)]
+        report('EventStore.query (1 min, one pattern)', len(ranges),
+               _timeit(lambda: [store.query(begin, end, pattern_id=pattern_id) for begin, end in ranges]))
+    return results
+
+
+class _LatencyPipeline(StreamPipeline):
+    """Records when each batch starts parsing and when its counts are in, and every anomaly emitted."""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.parse_started = []
+        self.counted = []
+        self.anomalies = []
+
+    def _parse(self, lines):
+        self.parse_started.append(time.perf_counter())
+        return super()._parse(lines)
+
+    def _count(self, events):
+        windows = super()._count(events)
+        self.counted.append(time.perf_counter())
+        self.anomalies.extend(anomaly for _, anomalies in windows for anomaly in anomalies)
+        return windows
+
+    def _finish_counts(self):
+        windows = super()._finish_counts()
+        self.anomalies.extend(anomaly for _, anomalies in windows for anomaly in anomalies)
+        return windows
+
+
+def _paced(lines, lines_per_second, chunk=512):
+    start = time.perf_counter()
+    for i in range(0, len(lines), chunk):
+        delay = start + i / lines_per_second - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        yield from lines[i:i + chunk]
+
+
+def bench_e2e(lines=1_000_000, lines_per_second=400, batch_size=2_048, paced_lines=200_000):
+    """
+    StreamPipeline over generated logs with an injected burst and silence:
+    throughput, batch latency (parse start to counted), detection of the
+    incidents, and the cost of enabling instrumentation.
+    """
+    generator = SyntheticLogGenerator(lines_per_second=lines_per_second)
+    generator.inject_burst('service-7', at_seconds=1_500, duration_seconds=120)
+    generator.inject_silence('service-0', at_seconds=1_900, duration_seconds=300)
+    log_lines = generator.lines(lines)
+
+    def run(source, count):
+        pipeline = _LatencyPipeline(recognizer=LogPatternRecognizer(template_storage_path=None),
+                                    detector=AnomalyDetector(window_size=20, window_seconds=60),
+                                    parser=LogParserRegistry(), batch_size=batch_size)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            metrics = pipeline.run(source)
+            elapsed = time.perf_counter() - start
+        latencies = np.subtract(pipeline.counted, pipeline.parse_started)
+        return pipeline, {
+            'lines': count,
+            'seconds': elapsed,
+            'lines_per_second': count / elapsed,
+            'latency_p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'latency_p99_ms': float(np.percentile(latencies, 99) * 1000),
+            'anomalies': len(pipeline.anomalies),
+            'stages': {name: {'busy_seconds': stage['busy_seconds'], 'max_queue_depth': stage['max_queue_depth']}
+                       for name, stage in metrics['stages'].items()},
+        }
+
+    def show(label, result):
+        print(f"{label:<14} {result['lines_per_second']:>10,.0f} lines/s  latency p50 {result['latency_p50_ms']:7.1f} ms"
+              f"  p99 {result['latency_p99_ms']:7.1f} ms  {result['anomalies']:,} anomalies")
+
+    results = {}
+    pipeline, results['saturated'] = run(log_lines, len(log_lines))
+    show('saturated', results['saturated'])
+    busy = ', '.join(f"{name} {stage['busy_seconds']:.1f}s" for name, stage in results['saturated']['stages'].items())
+    print(f"  busy: {busy}")
+    results['detection'] = generator.detection_report(pipeline.anomalies)
+    for incident in results['detection']:
+        found = f"after {incident['delay_seconds']:.0f}s" if incident['detected'] else 'MISSED'
+        print(f"  {incident['kind']:<8} on {incident['service']:<11} detected {found} "
+              f"({incident['anomalies']} anomalies)")
+
+    rate = results['saturated']['lines_per_second'] / 2
+    _, results['paced'] = run(_paced(log_lines[:paced_lines], rate), paced_lines)
+    show(f"paced {rate / 1000:.0f}k/s", results['paced'])
+
+    instrumentation.enable()
+    instrumentation.reset()
+    try:
+        _, results['instrumented'] = run(log_lines, len(log_lines))
+    finally:
+        instrumentation.disable()
+    show('instrumented', results['instrumented'])
+    results['instrumentation_overhead'] = (results['saturated']['lines_per_second'] /
+                                           results['instrumented']['lines_per_second'] - 1)
+    print(f"  instrumentation overhead: {results['instrumentation_overhead']:.1%}")
+    results['methods'] = instrumentation.snapshot()
+    busiest = sorted(results['methods'].items(), key=lambda item: -item[1]['seconds'])[:5]
+    for name, method in busiest:
+        print(f"  {name:<45} {method['calls']:>10,} calls  {method['seconds']:6.2f}s")
+    return results
+
+
+BENCHMARKS = {
+    'template_lookup': bench_template_lookup,
+    'masking': bench_masking,
+    'template_mining': bench_template_mining,
+    'template_startup': bench_template_startup,
+    'pipeline': bench_pipeline,
+    'sharded_patterns': bench_sharded_patterns,
+    'anomaly_tick': bench_anomaly_tick,
+    'anomaly_key_churn': bench_anomaly_key_churn,
+    'anomaly_sketch': bench_anomaly_sketch,
+    'incident_rules': bench_incident_rules,
+    'incident_expiry': bench_incident_expiry,
+    'incident_scoring': bench_incident_scoring,
+    'alert_delivery': bench_alert_delivery,
+    'alert_dedupe': bench_alert_dedupe,
+    'parsing': bench_parsing,
+    'columnar': bench_columnar,
+    'dashboard': bench_dashboard,
+    'event_store': bench_event_store,
+    'micro': bench_micro,
+    'e2e': bench_e2e,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    parser.add_argument('--output', help="write the results of benchmarks that return them to this JSON file")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    results = {}
+    for name in args.names or BENCHMARKS:
+        print(f"--- {name} ---")
+        result = BENCHMARKS[name]()
+        if result is not None:
+            results[name] = result
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'cpu_count': os.cpu_count(), 'results': results}, f,
+                      indent=2, default=str)
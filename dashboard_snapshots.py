@@ -0,0 +1,201 @@
+"""
+Immutable dashboard snapshots published by a background pipeline.
+
+A DashboardPublisher receives processed events, anomalies and incidents
+from the pipeline stages (StreamPipeline(publisher=...)) and, after each
+update, swaps in a new DashboardSnapshot. Web request handlers only ever
+read `publisher.snapshot`, so a page view never parses, recognizes or
+counts anything and cannot disturb the detector's history.
+
+Events are numbered with a sequence (`seq`) that doubles as the pagination
+cursor. They are kept in fixed-size chunks shared between snapshots, so
+publishing costs O(chunk size) and reading a page costs O(page size) no
+matter how many events are retained. Each publish also records a delta
+(the new event range, anomalies and incidents) for streaming clients.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from event_batch import EventBatch
+
+
+def to_jsonable(value):
+    """Converts datetimes, tuples and NumPy scalars so the value serializes as JSON."""
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class DashboardSnapshot:
+    """One published state. Nothing in it is modified after publication."""
+
+    def __init__(self, version: int, published_at: float, chunks: tuple, chunk_size: int, first_seq: int,
+                 end_seq: int, anomalies: tuple, incidents: tuple, anomalies_version=0, incidents_version=0):
+        self.version = version
+        self.published_at = published_at
+        self._chunks = chunks
+        self._chunk_size = chunk_size
+        self.first_seq = first_seq
+        self.end_seq = end_seq
+        self.anomalies = anomalies
+        self.incidents = incidents
+        # Version that last changed each list, for ETags that survive unrelated publishes.
+        self.anomalies_version = anomalies_version
+        self.incidents_version = incidents_version
+
+    @property
+    def etag(self) -> str:
+        return f"v{self.version}"
+
+    def events(self, start: int, stop: int) -> list:
+        """Events with start <= seq < stop that are still retained."""
+        start = max(start, self.first_seq)
+        stop = min(stop, self.end_seq)
+        size = self._chunk_size
+        events = []
+        while start < stop:
+            chunk_index, offset = divmod(start - self.first_seq, size)
+            chunk = self._chunks[chunk_index]
+            take = min(stop - start, len(chunk) - offset)
+            events.extend(chunk[offset:offset + take])
+            start += take
+        return events
+
+    def page(self, cursor=None, limit=100) -> (list, int, int):
+        """Returns (events, start, stop) for up to `limit` events from `cursor`, or the latest page."""
+        if cursor is None:
+            cursor = self.end_seq - limit
+        start = min(max(cursor, self.first_seq), self.end_seq)
+        stop = min(start + limit, self.end_seq)
+        return self.events(start, stop), start, stop
+
+
+class DashboardPublisher:
+    """
+    Collects pipeline output into DashboardSnapshots. Keeps the newest
+    `max_events` events and `max_items` anomalies and incidents, and the
+    deltas of the last `max_deltas` publishes.
+    """
+
+    def __init__(self, max_events=100_000, max_items=1_000, chunk_size=1_024, max_deltas=256):
+        self.max_events = max_events
+        self.chunk_size = chunk_size
+        self._chunks = deque()
+        self._tail = []
+        self._first_seq = 0
+        self._end_seq = 0
+        self._anomalies = deque(maxlen=max_items)
+        self._incidents = deque(maxlen=max_items)
+        self._deltas = deque(maxlen=max_deltas)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.snapshot = DashboardSnapshot(0, time.time(), (), chunk_size, 0, 0, (), ())
+
+    @staticmethod
+    def _event_rows(events) -> list:
+        if isinstance(events, EventBatch):
+            services, levels = events.services, events.levels
+            patterns, templates = events.patterns, events.templates
+            stamps = {}
+            rows = []
+            pattern_codes = events.pattern_codes.tolist() if events.pattern_codes is not None else None
+            for i, (epoch_ms, service, level, message) in enumerate(zip(
+                    events.timestamps.tolist(), events.service_codes.tolist(), events.level_codes.tolist(),
+                    events.messages)):
+                stamp = stamps.get(epoch_ms)
+                if stamp is None:
+                    stamp = stamps[epoch_ms] = datetime.fromtimestamp(epoch_ms / 1000.0).isoformat(sep=' ')
+                pattern = pattern_codes[i] if pattern_codes is not None else None
+                rows.append({
+                    'timestamp': stamp,
+                    'service_name': services[service],
+                    'log_level': levels[level],
+                    'message': message,
+                    'pattern_id': patterns[pattern] if pattern is not None else None,
+                    'template': templates[pattern] if pattern is not None and templates is not None else None,
+                })
+            return rows
+        return [to_jsonable({key: event.get(key) for key in
+                             ('timestamp', 'service_name', 'log_level', 'message', 'pattern_id', 'template')})
+                for event in events]
+
+    def publish(self, events=None, anomalies=None, incidents=None) -> DashboardSnapshot:
+        """
+        Appends `events` (an EventBatch or event dicts), `anomalies` and
+        `incidents`, and swaps in a new snapshot. With nothing to append the
+        current snapshot is kept, so ETags and streams see no change.
+        """
+        rows = self._event_rows(events) if events is not None and len(events) else []
+        anomalies = tuple(to_jsonable(anomaly) for anomaly in anomalies or ())
+        incidents = tuple(to_jsonable(incident) for incident in incidents or ())
+        if not rows and not anomalies and not incidents:
+            return self.snapshot
+        with self._lock:
+            start = self._end_seq
+            size = self.chunk_size
+            tail = self._tail
+            for row in rows:
+                row['seq'] = self._end_seq
+                self._end_seq += 1
+                tail.append(row)
+                if len(tail) == size:
+                    self._chunks.append(tuple(tail))
+                    tail = self._tail = []
+            while len(self._chunks) * size > self.max_events:
+                self._chunks.popleft()
+                self._first_seq += size
+
+            previous = self.snapshot
+            version = previous.version + 1
+            current_anomalies, anomalies_version = previous.anomalies, previous.anomalies_version
+            if anomalies:
+                self._anomalies.extend(anomalies)
+                current_anomalies, anomalies_version = tuple(self._anomalies), version
+            current_incidents, incidents_version = previous.incidents, previous.incidents_version
+            if incidents:
+                self._incidents.extend(incidents)
+                current_incidents, incidents_version = tuple(self._incidents), version
+            chunks = tuple(self._chunks) + ((tuple(tail),) if tail else ())
+            snapshot = DashboardSnapshot(version, time.time(), chunks, size, self._first_seq, self._end_seq,
+                                         current_anomalies, current_incidents, anomalies_version, incidents_version)
+            self._deltas.append((snapshot.version, start, self._end_seq, anomalies, incidents))
+            self.snapshot = snapshot
+            self._changed.notify_all()
+        return snapshot
+
+    def wait(self, version: int, timeout=None) -> DashboardSnapshot:
+        """Blocks until a snapshot newer than `version` is published (or `timeout` passes)."""
+        with self._lock:
+            self._changed.wait_for(lambda: self.snapshot.version > version, timeout)
+            return self.snapshot
+
+    def delta(self, version: int, snapshot: DashboardSnapshot, event_limit=500):
+        """
+        Changes from `version` up to `snapshot` as a JSON-ready dict, or None
+        when `version` is too old for the retained deltas to cover.
+        """
+        with self._lock:
+            deltas = [delta for delta in self._deltas if version < delta[0] <= snapshot.version]
+        if len(deltas) != snapshot.version - version:
+            return None
+        start = deltas[0][1] if deltas else snapshot.end_seq
+        stop = deltas[-1][2] if deltas else snapshot.end_seq
+        return {
+            'version': snapshot.version,
+            'from_seq': start,
+            'end_seq': stop,
+            # Only the newest events are pushed; older ones stay reachable through the cursor API.
+            'events': snapshot.events(max(start, stop - event_limit), stop),
+            'anomalies': [anomaly for delta in deltas for anomaly in delta[3]],
+            'incidents': [incident for delta in deltas for incident in delta[4]],
+        }
@@ -0,0 +1,175 @@
+"""
+Columnar batches of parsed log events.
+
+An EventBatch holds the events of one batch as parallel columns instead of
+one dict per event: timestamps as int64 epoch milliseconds, service names
+and levels dictionary-encoded as int32 codes into small tables, and the
+messages as a plain list. LogPatternRecognizer.process_event_batch fills
+in pattern codes the same way, and AnomalyDetector.update_counts counts a
+whole batch with one np.unique pass.
+
+    batch = LogParserRegistry().parse_batch(lines)
+    recognizer.process_event_batch(batch)
+    anomalies = detector.update_counts(batch)
+
+Besides timestamp, log_level, service_name and message, from_events keeps
+the pattern_id, template and params a recognizer added to the dicts. Other
+fields (e.g. the nginx status or a log4j error_type) are not carried.
+"""
+import time
+from datetime import datetime
+
+import numpy as np
+
+
+class EventBatch:
+    def __init__(self, timestamps, service_codes, services, level_codes, levels, messages,
+                 pattern_codes=None, patterns=None, templates=None, params=None):
+        self.timestamps = timestamps
+        self.service_codes = service_codes
+        self.services = services
+        self.level_codes = level_codes
+        self.levels = levels
+        self.messages = messages
+        # Set by a recognizer: patterns[pattern_codes[i]] is event i's pattern ID.
+        self.pattern_codes = pattern_codes
+        self.patterns = patterns
+        self.templates = templates
+        # Per event, the values masked out of the message ({'NUM': ['42'], ...}).
+        self.params = params
+
+    def __len__(self):
+        return len(self.messages)
+
+    @classmethod
+    def from_events(cls, events) -> 'EventBatch':
+        builder = EventBatchBuilder()
+        for event in events:
+            builder.append_event(event)
+        return builder.build()
+
+    def set_patterns(self, pattern_ids: list, templates: list = None):
+        """Dictionary-encodes one pattern ID (and optionally template) per event."""
+        codes = {}
+        patterns = []
+        pattern_templates = [] if templates is not None else None
+        for i, pattern_id in enumerate(pattern_ids):
+            if pattern_id not in codes:
+                codes[pattern_id] = len(patterns)
+                patterns.append(pattern_id)
+                if templates is not None:
+                    pattern_templates.append(templates[i])
+        self.pattern_codes = np.fromiter((codes[pattern_id] for pattern_id in pattern_ids),
+                                         dtype=np.int32, count=len(pattern_ids))
+        self.patterns = patterns
+        self.templates = pattern_templates
+
+    def key_codes(self) -> (list, np.ndarray):
+        """
+        Returns the distinct (service, level, pattern_id) keys of the batch and,
+        per event, the index of its key in that list.
+        """
+        pattern_codes = self.pattern_codes
+        patterns = self.patterns
+        if pattern_codes is None:
+            pattern_codes = np.zeros(len(self), dtype=np.int32)
+            patterns = [None]
+        levels = max(len(self.levels), 1)
+        pattern_count = max(len(patterns), 1)
+        combined = ((self.service_codes.astype(np.int64) * levels + self.level_codes) * pattern_count +
+                    pattern_codes)
+        unique, inverse = np.unique(combined, return_inverse=True)
+        services, levels_table = self.services, self.levels
+        keys = [(services[code // (levels * pattern_count)], levels_table[code // pattern_count % levels],
+                 patterns[code % pattern_count]) for code in unique.tolist()]
+        return keys, inverse.reshape(-1)
+
+    def to_events(self) -> list:
+        """Materializes the batch as the dict-per-event representation."""
+        services, levels = self.services, self.levels
+        events = []
+        for timestamp, service, level, message in zip(self.timestamps.tolist(), self.service_codes.tolist(),
+                                                      self.level_codes.tolist(), self.messages):
+            events.append({
+                'timestamp': datetime.fromtimestamp(timestamp / 1000.0),
+                'log_level': levels[level],
+                'service_name': services[service],
+                'message': message,
+            })
+        if self.pattern_codes is not None:
+            for event, code in zip(events, self.pattern_codes.tolist()):
+                event['pattern_id'] = self.patterns[code]
+                if self.templates is not None:
+                    event['template'] = self.templates[code]
+        return events
+
+
+class EventBatchBuilder:
+    """Accumulates events column by column; build() returns the EventBatch."""
+
+    def __init__(self):
+        self._timestamps = []
+        self._service_codes = []
+        self._level_codes = []
+        self._messages = []
+        self._services = {}
+        self._levels = {}
+        # Row -> (pattern_id, template) and row -> params, for dicts already recognized.
+        self._patterns = {}
+        self._params = {}
+        # Parsers hand out the same datetime objects for repeated timestamps,
+        # so converting each distinct one once covers most of a batch.
+        self._epoch_ms = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def append(self, timestamp, log_level, service_name, message):
+        epoch_ms = self._epoch_ms.get(timestamp)
+        if epoch_ms is None:
+            if isinstance(timestamp, datetime):
+                epoch_ms = round(timestamp.timestamp() * 1000)
+            elif timestamp is None:
+                epoch_ms = round(time.time() * 1000)
+            else:
+                epoch_ms = round(float(timestamp) * 1000)
+            if timestamp is not None:
+                self._epoch_ms[timestamp] = epoch_ms
+        self._timestamps.append(epoch_ms)
+        services = self._services
+        code = services.get(service_name)
+        if code is None:
+            code = services[service_name] = len(services)
+        self._service_codes.append(code)
+        levels = self._levels
+        code = levels.get(log_level)
+        if code is None:
+            code = levels[log_level] = len(levels)
+        self._level_codes.append(code)
+        self._messages.append(message)
+
+    def append_event(self, event: dict):
+        row = len(self._messages)
+        self.append(event.get('timestamp'), event.get('log_level'), event.get('service_name', 'UNKNOWN'),
+                    event.get('message', ''))
+        pattern_id = event.get('pattern_id')
+        if pattern_id is not None:
+            self._patterns[row] = (pattern_id, event.get('template'))
+        params = event.get('params')
+        if params is not None:
+            self._params[row] = params
+
+    def build(self) -> EventBatch:
+        batch = EventBatch(np.array(self._timestamps, dtype=np.int64),
+                           np.array(self._service_codes, dtype=np.int32), list(self._services),
+                           np.array(self._level_codes, dtype=np.int32), list(self._levels),
+                           self._messages)
+        rows = range(len(self._messages))
+        if self._patterns:
+            recognized = [self._patterns.get(row, (None, None)) for row in rows]
+            templates = [template for _, template in recognized]
+            batch.set_patterns([pattern_id for pattern_id, _ in recognized],
+                               templates if any(template is not None for template in templates) else None)
+        if self._params:
+            batch.params = [self._params.get(row, {}) for row in rows]
+        return batch
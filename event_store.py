@@ -0,0 +1,411 @@
+"""
+On-disk store of processed events for search and replay.
+
+Events (timestamp, service, level, pattern_id, message and the masked
+params) are appended in EventBatches, buffered per time partition of
+`segment_seconds`, and written by flush() as immutable segment files:
+
+    <directory>/<partition start>-<segment id>.seg
+
+A segment is a JSON header followed by 8-byte aligned columns. Rows are
+sorted by time, services, levels and patterns are dictionary-encoded, and
+a posting list per pattern holds that pattern's rows in time order. The
+header records the segment's min/max time, so a range query opens only
+the segments it overlaps, binary-searches their timestamp column and, for
+a pattern, reads just that pattern's postings. Columns are read through
+np.memmap, so only the pages a query touches are loaded.
+
+replay() streams a time range back through a detector (and optionally a
+recognizer and prediction engine) in event-time order, as fast as the
+components allow.
+"""
+import glob
+import json
+import os
+import struct
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from event_batch import EventBatch
+from log_patterns import to_epoch
+
+_MAGIC = b'LEVSEG01'
+_HEADER = struct.Struct('<8sQ')
+
+
+def _epoch_ms(value):
+    return None if value is None else round(to_epoch(value) * 1000)
+
+
+def _pack_blob(strings: list) -> (np.ndarray, bytes):
+    encoded = [string.encode('utf-8', 'surrogatepass') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+
+class _Segment:
+    """A sealed segment file; columns are memory-mapped on first use."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, size = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not an event segment")
+            header = json.loads(f.read(size))
+        self.data_start = (_HEADER.size + size + 7) & ~7
+        self.partition = header['partition']
+        self.segment_id = header['segment_id']
+        self.rows = header['rows']
+        self.min_time = header['min_time']
+        self.max_time = header['max_time']
+        self.services = header['services']
+        self.levels = header['levels']
+        self.patterns = header['patterns']
+        self._columns = header['columns']
+        self._pattern_codes = {pattern: code for code, pattern in enumerate(self.patterns)}
+        self._data = None
+        self._readers = {}
+
+    def column(self, name: str) -> np.ndarray:
+        if self._data is None:
+            self._data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        offset, dtype, count = self._columns[name]
+        start = self.data_start + offset
+        return self._data[start:start + count * np.dtype(dtype).itemsize].view(dtype)
+
+    def reader(self, name: str):
+        """Returns a function from row to the string stored in column `name`."""
+        reader = self._readers.get(name)
+        if reader is None:
+            blob = self.column(name).tobytes()
+            offsets = self.column(name + '_offsets').tolist()
+
+            def reader(row):
+                return blob[offsets[row]:offsets[row + 1]].decode('utf-8', 'surrogatepass')
+
+            self._readers[name] = reader
+        return reader
+
+    def row_range(self, start_ms=None, end_ms=None) -> (int, int):
+        """Rows with start_ms <= timestamp < end_ms."""
+        timestamps = self.column('timestamps')
+        low = 0 if start_ms is None else int(np.searchsorted(timestamps, start_ms, side='left'))
+        high = self.rows if end_ms is None else int(np.searchsorted(timestamps, end_ms, side='left'))
+        return low, high
+
+    def pattern_rows(self, pattern_id: str, low: int, high: int) -> np.ndarray:
+        """Rows of `pattern_id` within [low, high), from its posting list."""
+        code = self._pattern_codes.get(pattern_id)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        offsets = self.column('posting_offsets')
+        postings = self.column('postings')[offsets[code]:offsets[code + 1]]
+        return postings[np.searchsorted(postings, low):np.searchsorted(postings, high)].astype(np.int64)
+
+    def overlaps(self, start_ms, end_ms) -> bool:
+        return (start_ms is None or self.max_time >= start_ms) and (end_ms is None or self.min_time < end_ms)
+
+
+class _PartitionBuffer:
+    def __init__(self):
+        self.timestamps = []
+        self.service_codes = []
+        self.level_codes = []
+        self.pattern_codes = []
+        self.messages = []
+        self.params = []
+        self.services = {}
+        self.levels = {}
+        self.patterns = {}
+        self.rows = 0
+
+    @staticmethod
+    def _remap(table: dict, names: list) -> np.ndarray:
+        codes = []
+        for name in names:
+            code = table.get(name)
+            if code is None:
+                code = table[name] = len(table)
+            codes.append(code)
+        return np.array(codes, dtype=np.int32)
+
+    def extend(self, batch: EventBatch, rows: np.ndarray, params: list):
+        self.timestamps.append(batch.timestamps[rows])
+        self.service_codes.append(self._remap(self.services, batch.services)[batch.service_codes[rows]])
+        self.level_codes.append(self._remap(self.levels, batch.levels)[batch.level_codes[rows]])
+        if batch.pattern_codes is not None:
+            self.pattern_codes.append(self._remap(self.patterns, batch.patterns)[batch.pattern_codes[rows]])
+        else:
+            self.pattern_codes.append(np.full(len(rows), self._remap(self.patterns, [None])[0], dtype=np.int32))
+        row_list = rows.tolist()
+        messages = batch.messages
+        self.messages.extend(messages[row] for row in row_list)
+        if params is None:
+            self.params.extend('{}' for _ in row_list)
+        else:
+            dumps = json.dumps
+            self.params.extend(dumps(params[row], separators=(',', ':')) for row in row_list)
+        self.rows += len(row_list)
+
+
+class EventStore:
+    """
+    Time-partitioned segment store under `directory`. Appended events become
+    visible to queries and replay once flush() writes them, which append()
+    does on its own every `flush_events` buffered events.
+    """
+
+    def __init__(self, directory: str, segment_seconds=3600, flush_events=100_000):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.flush_events = flush_events
+        os.makedirs(directory, exist_ok=True)
+        self.segments = [_Segment(path) for path in glob.glob(os.path.join(directory, '*.seg'))]
+        self.segments.sort(key=lambda segment: (segment.partition, segment.segment_id))
+        self._next_segment_id = max((segment.segment_id for segment in self.segments), default=-1) + 1
+        self._buffers = {}
+        self._buffered = 0
+        self._lock = threading.Lock()
+
+    def append(self, events, params=None):
+        """Buffers an EventBatch (or a list of event dicts); `params` defaults to the batch's."""
+        batch = events if isinstance(events, EventBatch) else EventBatch.from_events(events)
+        if not len(batch):
+            return
+        if params is None:
+            params = batch.params
+        partitions = batch.timestamps // (self.segment_seconds * 1000)
+        with self._lock:
+            for partition in np.unique(partitions).tolist():
+                buffer = self._buffers.get(partition)
+                if buffer is None:
+                    buffer = self._buffers[partition] = _PartitionBuffer()
+                buffer.extend(batch, np.flatnonzero(partitions == partition), params)
+            self._buffered += len(batch)
+            if self._buffered >= self.flush_events:
+                self._flush()
+
+    def flush(self):
+        """Writes every buffered partition out as a new segment."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        written = [self._write_segment(partition, buffer) for partition, buffer in sorted(self._buffers.items())]
+        # Swapped in whole, so queries running meanwhile see the old or the new list.
+        self.segments = sorted(self.segments + written, key=lambda segment: (segment.partition, segment.segment_id))
+        self._buffers = {}
+        self._buffered = 0
+
+    def _write_segment(self, partition: int, buffer: _PartitionBuffer) -> _Segment:
+        timestamps = np.concatenate(buffer.timestamps)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        pattern_codes = np.concatenate(buffer.pattern_codes)[order]
+        pattern_count = len(buffer.patterns)
+        posting_offsets = np.zeros(pattern_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pattern_codes, minlength=pattern_count), out=posting_offsets[1:])
+        order_list = order.tolist()
+        message_offsets, messages = _pack_blob([buffer.messages[row] for row in order_list])
+        params_offsets, params = _pack_blob([buffer.params[row] for row in order_list])
+        columns = [
+            ('timestamps', timestamps),
+            ('service_codes', np.concatenate(buffer.service_codes)[order]),
+            ('level_codes', np.concatenate(buffer.level_codes)[order]),
+            ('pattern_codes', pattern_codes),
+            ('posting_offsets', posting_offsets),
+            # A stable sort keeps each pattern's rows in time order.
+            ('postings', np.argsort(pattern_codes, kind='stable').astype(np.int32)),
+            ('messages_offsets', message_offsets),
+            ('messages', np.frombuffer(messages, dtype=np.uint8)),
+            ('params_offsets', params_offsets),
+            ('params', np.frombuffer(params, dtype=np.uint8)),
+        ]
+        layout = {}
+        position = 0
+        for name, array in columns:
+            layout[name] = [position, array.dtype.str, len(array)]
+            position = (position + array.nbytes + 7) & ~7
+        header = json.dumps({
+            'partition': partition,
+            'segment_id': self._next_segment_id,
+            'rows': len(timestamps),
+            'min_time': int(timestamps[0]),
+            'max_time': int(timestamps[-1]),
+            'services': list(buffer.services),
+            'levels': list(buffer.levels),
+            'patterns': list(buffer.patterns),
+            'columns': layout,
+        }).encode('utf-8')
+
+        path = os.path.join(self.directory, f"{partition * self.segment_seconds:012d}-{self._next_segment_id:06d}.seg")
+        self._next_segment_id += 1
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(header)) + header)
+            f.write(b'\x00' * (-f.tell() % 8))
+            for name, array in columns:
+                f.write(array.tobytes())
+                f.write(b'\x00' * (-array.nbytes % 8))
+        os.replace(temporary, path)
+        return _Segment(path)
+
+    def _matching_rows(self, start, end, pattern_id=None):
+        """Yields (segment, rows) for the rows in [start, end) of every overlapping segment."""
+        start_ms, end_ms = _epoch_ms(start), _epoch_ms(end)
+        for segment in self.segments:
+            if not segment.overlaps(start_ms, end_ms):
+                continue
+            low, high = segment.row_range(start_ms, end_ms)
+            if pattern_id is not None:
+                rows = segment.pattern_rows(pattern_id, low, high)
+            else:
+                rows = np.arange(low, high, dtype=np.int64)
+            if len(rows):
+                yield segment, rows
+
+    @staticmethod
+    def _filter(segment: _Segment, rows: np.ndarray, service=None, level=None) -> np.ndarray:
+        if service is not None:
+            if service not in segment.services:
+                return rows[:0]
+            rows = rows[segment.column('service_codes')[rows] == segment.services.index(service)]
+        if level is not None:
+            if level not in segment.levels:
+                return rows[:0]
+            rows = rows[segment.column('level_codes')[rows] == segment.levels.index(level)]
+        return rows
+
+    def query(self, start=None, end=None, pattern_id=None, service=None, level=None, limit=None) -> list:
+        """Stored events in [start, end) matching the filters, oldest first, as event dicts."""
+        found = []
+        for segment, rows in self._matching_rows(start, end, pattern_id):
+            rows = self._filter(segment, rows, service, level)
+            if len(rows):
+                found.append((segment, rows))
+        if not found:
+            return []
+        timestamps = np.concatenate([segment.column('timestamps')[rows] for segment, rows in found])
+        owners = np.concatenate([np.full(len(rows), i, dtype=np.int64) for i, (_, rows) in enumerate(found)])
+        positions = np.concatenate([np.arange(len(rows)) for _, rows in found])
+        order = np.argsort(timestamps, kind='stable')[:limit]
+        # Gather each segment's columns for the matched rows once, rather than per event.
+        gathered = [(segment, rows.tolist(), segment.column('service_codes')[rows].tolist(),
+                     segment.column('level_codes')[rows].tolist(), segment.column('pattern_codes')[rows].tolist(),
+                     segment.reader('messages'), segment.reader('params')) for segment, rows in found]
+
+        events = []
+        for epoch_ms, owner, i in zip(timestamps[order].tolist(), owners[order].tolist(), positions[order].tolist()):
+            segment, rows, services, levels, patterns, messages, params = gathered[owner]
+            events.append({
+                'timestamp': datetime.fromtimestamp(epoch_ms / 1000.0),
+                'service_name': segment.services[services[i]],
+                'log_level': segment.levels[levels[i]],
+                'pattern_id': segment.patterns[patterns[i]],
+                'message': messages(rows[i]),
+                'params': json.loads(params(rows[i])),
+            })
+        return events
+
+    def pattern_timeline(self, pattern_id: str, start=None, end=None, bucket_seconds=60, service=None) -> list:
+        """
+        Per-bucket counts of `pattern_id` as [(bucket start, count)], built from
+        the posting lists alone, e.g. to see when a pattern started spiking.
+        """
+        stamps = [segment.column('timestamps')[self._filter(segment, rows, service)]
+                  for segment, rows in self._matching_rows(start, end, pattern_id)]
+        if not stamps:
+            return []
+        buckets = np.concatenate(stamps) // (bucket_seconds * 1000)
+        first = int(buckets.min())
+        counts = np.bincount(buckets - first)
+        return [(datetime.fromtimestamp((first + i) * bucket_seconds), int(count))
+                for i, count in enumerate(counts.tolist())]
+
+    def replay_batches(self, start=None, end=None, batch_size=65_536):
+        """Yields the stored events in [start, end) as EventBatches in event-time order."""
+        start_ms, end_ms = _epoch_ms(start), _epoch_ms(end)
+        partitions = {}
+        for segment in self.segments:
+            if segment.overlaps(start_ms, end_ms):
+                partitions.setdefault(segment.partition, []).append(segment)
+        for partition in sorted(partitions):
+            # Segments of one partition may overlap in time; merge them by timestamp.
+            services, levels, patterns = {}, {}, {}
+            parts = []
+            for segment in partitions[partition]:
+                low, high = segment.row_range(start_ms, end_ms)
+                if low == high:
+                    continue
+                parts.append((segment, low, high,
+                              _PartitionBuffer._remap(services, segment.services),
+                              _PartitionBuffer._remap(levels, segment.levels),
+                              _PartitionBuffer._remap(patterns, segment.patterns)))
+            if not parts:
+                continue
+            timestamps = np.concatenate([segment.column('timestamps')[low:high] for segment, low, high, *_ in parts])
+            owners = np.concatenate([np.full(high - low, i, dtype=np.int64)
+                                     for i, (_, low, high, *_) in enumerate(parts)])
+            rows = np.concatenate([np.arange(low, high, dtype=np.int64) for _, low, high, *_ in parts])
+            service_codes = np.concatenate([remap[segment.column('service_codes')[low:high]]
+                                            for segment, low, high, remap, _, _ in parts])
+            level_codes = np.concatenate([remap[segment.column('level_codes')[low:high]]
+                                          for segment, low, high, _, remap, _ in parts])
+            pattern_codes = np.concatenate([remap[segment.column('pattern_codes')[low:high]]
+                                            for segment, low, high, _, _, remap in parts])
+            order = np.argsort(timestamps, kind='stable')
+            readers = [segment.reader('messages') for segment, *_ in parts]
+            for chunk_start in range(0, len(order), batch_size):
+                chunk = order[chunk_start:chunk_start + batch_size]
+                messages = [readers[owner](row) for owner, row in zip(owners[chunk].tolist(), rows[chunk].tolist())]
+                yield EventBatch(timestamps[chunk], service_codes[chunk], list(services), level_codes[chunk],
+                                 list(levels), messages, pattern_codes[chunk], list(patterns))
+
+    def stats(self) -> dict:
+        return {
+            'segments': len(self.segments),
+            'events': sum(segment.rows for segment in self.segments),
+            'buffered': self._buffered,
+            'bytes': sum(os.path.getsize(segment.path) for segment in self.segments),
+        }
+
+
+def replay(store: EventStore, detector, recognizer=None, engine=None, start=None, end=None,
+           batch_size=65_536) -> dict:
+    """
+    Streams stored events in [start, end) through `detector` on event time,
+    then flushes it, so the result matches what live processing would have
+    produced for the same events. With `recognizer`, patterns are derived
+    again from the messages (e.g. to try a different masker); otherwise the
+    stored pattern IDs are used. With `engine`, every closed window's
+    anomalies are run through predict_incidents at the window end.
+    """
+    if detector.window_seconds is None:
+        raise ValueError("replay needs an AnomalyDetector with window_seconds set")
+    anomalies = []
+    incidents = []
+    events = 0
+
+    def predict(window_anomalies):
+        anomalies.extend(window_anomalies)
+        if engine is None:
+            return
+        windows = {}
+        for anomaly in window_anomalies:
+            windows.setdefault(anomaly['window_end'], []).append(anomaly)
+        for window_end, group in windows.items():
+            for anomaly in group:
+                engine.add_active_anomaly(anomaly)
+            incidents.extend(engine.predict_incidents(now=window_end))
+
+    for batch in store.replay_batches(start, end, batch_size):
+        if recognizer is not None:
+            recognizer.process_event_batch(batch)
+        events += len(batch)
+        predict(detector.update_counts(batch))
+    predict(detector.flush())
+    return {'events': events, 'anomalies': anomalies, 'incidents': incidents}
@@ -1,9 +1,34 @@
-import joblib 
-from datetime import datetime
+import heapq
+import os
+import sys
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from hashlib import blake2b
+
+import numpy as np
+
+# Incidents for the same rule and first match are not raised again within this many seconds.
+ALERT_COOLDOWN_SECONDS = 300
+
+# Columns of the per-service feature matrix scored by the incident model.
+ML_FEATURES = ('frequency_spikes', 'high_frequency', 'low_frequency', 'silences',
+               'distinct_patterns', 'high_severity', 'max_abs_z_score', 'max_count_ratio')
+_FEATURE_COLUMNS = {'Frequency Spike': 0, 'High Frequency': 1, 'Low Frequency': 2, 'Silence': 3}
 
 class IncidentPredictionEngine:
-    def __init__(self, model_path="incident_predictor_model.pkl"):
+    def __init__(self, model_path="incident_predictor_model.pkl", anomaly_ttl_minutes=None,
+                 use_ml_model=False, ml_threshold=0.8, score_cache_size=100_000):
         self.prediction_models = {}
+        self.model_path = model_path
+        # With use_ml_model, every tick also scores one feature row per service
+        # (see ML_FEATURES) with the model at model_path, in a single
+        # predict_proba call; services scoring at least ml_threshold raise an incident.
+        self.use_ml_model = use_ml_model
+        self.ml_threshold = ml_threshold
+        self.score_cache_size = score_cache_size
+        self._score_cache = OrderedDict()
+        self.score_cache_hits = 0
+        self.score_cache_misses = 0
         self.active_anomalies = {}
         self.incident_rules = [
            
@@ -19,73 +44,384 @@ class IncidentPredictionEngine:
            
         ]
         self.potential_incidents = {} 
+        # Anomalies are forgotten this long after their timestamp; by default
+        # once they are outside every rule's time window.
+        self.anomaly_ttl_minutes = anomaly_ttl_minutes
+        self._compiled_rules = None
+        self._matches = {}
+        self._indexed_windows = {}
+        self._satisfied = set()
+        self._clock = None
+        self._sequence = 0
+        self._anomaly_expiry = []
+        self._incident_expiry = []
+        self.expired_anomalies = 0
+        self.expired_incidents = 0
 
     def _load_model(self, model_name):
-       
-        return None 
+        """
+        Loads a joblib-pickled model with predict_proba once and keeps it in
+        prediction_models. Large NumPy arrays inside it are memory-mapped
+        instead of read into memory. Returns None if there is no model file.
+        """
+        if model_name in self.prediction_models:
+            return self.prediction_models[model_name]
+        model = None
+        if os.path.exists(model_name):
+            # joblib is only imported by processes that actually score.
+            import joblib
+            model = joblib.load(model_name, mmap_mode='r')
+        else:
+            print(f"Incident model {model_name} not found; ML scoring disabled.")
+        self.prediction_models[model_name] = model
+        return model
+
+    def _feature_matrix(self) -> (list, np.ndarray):
+        """One row of ML_FEATURES per service with active anomalies."""
+        rows = {}
+        patterns = defaultdict(set)
+        for anomaly in self.active_anomalies.values():
+            key = anomaly.get('key')
+            if not isinstance(key, tuple):
+                continue
+            service_name = key[0]
+            row = rows.get(service_name)
+            if row is None:
+                row = rows[service_name] = [0.0] * len(ML_FEATURES)
+            column = _FEATURE_COLUMNS.get(anomaly['type'])
+            if column is not None:
+                row[column] += 1
+            patterns[service_name].add(key[2])
+            if anomaly.get('severity') in ('High', 'Critical'):
+                row[5] += 1
+            row[6] = max(row[6], abs(anomaly.get('z_score', 0.0)))
+            baseline = anomaly.get('baseline_mean') or 0.0
+            if baseline > 0:
+                row[7] = max(row[7], anomaly.get('current_count', 0) / baseline)
+        services = list(rows)
+        for service_name in services:
+            rows[service_name][4] = len(patterns[service_name])
+        return services, np.array([rows[s] for s in services], dtype=np.float64).reshape(-1, len(ML_FEATURES))
+
+    def score_features(self, features: np.ndarray, model) -> np.ndarray:
+        """
+        Incident probabilities for each row of `features`. Rows seen before
+        come from a cache keyed on a hash of the row; the rest go to the
+        model in one predict_proba call. A score_cache_size of 0 turns the
+        cache off, which is faster for models cheaper than hashing the rows.
+        """
+        if not self.score_cache_size:
+            return np.asarray(model.predict_proba(features))[:, 1]
+        cache = self._score_cache
+        scores = np.empty(len(features), dtype=np.float64)
+        digests = [blake2b(row.tobytes(), digest_size=16).digest() for row in features]
+        missing = []
+        for i, digest in enumerate(digests):
+            score = cache.get(digest)
+            if score is None:
+                missing.append(i)
+            else:
+                cache.move_to_end(digest)
+                scores[i] = score
+        self.score_cache_hits += len(features) - len(missing)
+        self.score_cache_misses += len(missing)
+        if missing:
+            probabilities = np.asarray(model.predict_proba(features[missing]))[:, 1]
+            scores[missing] = probabilities
+            for i, score in zip(missing, probabilities.tolist()):
+                cache[digests[i]] = score
+            while len(cache) > self.score_cache_size:
+                cache.popitem(last=False)
+        return scores
+
+    def _predict_with_model(self, current_time: datetime) -> list:
+        model = self._load_model(self.model_path)
+        if model is None or not self.active_anomalies:
+            return []
+        services, features = self._feature_matrix()
+        scores = self.score_features(features, model)
+        incidents = []
+        for i in np.flatnonzero(scores >= self.ml_threshold).tolist():
+            service_name = services[i]
+            incident_key = f"ML_Model-{service_name}"
+            if incident_key in self.potential_incidents:
+                continue
+            score = float(scores[i])
+            incident = {
+                'alert_id': f"PRED-{current_time.strftime('%Y%m%d-%H%M%S')}",
+                'timestamp': current_time,
+                'severity': 'CRITICAL' if score >= 0.95 else 'HIGH',
+                'likelihood': f"{score:.0%}",
+                'predicted_impact': f"Model predicts an incident on {service_name}.",
+                'component_s_affected': [service_name],
+                'root_cause_analysis_predicted': "Incident model score over the active anomalies of the service.",
+                'contextual_data': {'features': dict(zip(ML_FEATURES, features[i].tolist())), 'score': score},
+                'recommended_actions': ["Review relevant service logs immediately.", "Check system dashboards for affected components."],
+                'rule_name': 'ML_Model'
+            }
+            incidents.append(incident)
+            self.potential_incidents[incident_key] = {'last_alert_time': current_time, 'details': incident}
+            self._push_expiry(self._incident_expiry, current_time + timedelta(seconds=ALERT_COOLDOWN_SECONDS), incident_key)
+        return incidents
+
+    def add_rule(self, rule: dict):
+        """Adds an incident rule; it is matched against the anomalies already active."""
+        self.set_rules(self.incident_rules + [rule])
+
+    def set_rules(self, rules: list):
+        """
+        Replaces the incident rules and rebuilds the rule index. Rules are
+        not copied and must not be edited in place afterwards, since the
+        index would not see the change; pass an edited copy here instead.
+        """
+        self.incident_rules = list(rules)
+        self._compile_rules()
+
+    def _compile_rules(self):
+        """
+        Indexes the rules so each anomaly only touches the rules it can
+        satisfy. A trigger is ('pattern', service, pattern substring) or
+        ('type', anomaly type); per trigger and rule time window, the
+        matching anomalies inside that window are kept in arrival order,
+        and per rule the number of matches predict_incidents would collect
+        is kept up to date. Every indexed anomaly has an entry in a
+        time-ordered heap per window, so leaving a window and expiring
+        altogether are O(log n).
+        """
+        self._compiled_rules = list(self.incident_rules)
+        self._pattern_index = defaultdict(dict)
+        self._trigger_rules = defaultdict(lambda: defaultdict(list))
+        for rule_index, rule in enumerate(self._compiled_rules):
+            window = rule['time_window_minutes']
+            for trigger in rule['trigger_patterns']:
+                if trigger[0] == 'service_name':
+                    self._pattern_index[trigger[1]].setdefault(trigger[2], None)
+                    self._trigger_rules[('pattern', trigger[1], trigger[2])][window].append(rule_index)
+            for anomaly_type in rule.get('trigger_anomalies', []):
+                self._trigger_rules[('type', anomaly_type)][window].append(rule_index)
+        windows = [rule['time_window_minutes'] for rule in self._compiled_rules]
+        ttl = self.anomaly_ttl_minutes if self.anomaly_ttl_minutes is not None else max(windows, default=0)
+        self._anomaly_ttl = timedelta(minutes=ttl)
+
+        self._matches = defaultdict(dict)
+        self._first_seen_cache = {}
+        self._indexed_windows = {}
+        self._match_counts = [0] * len(self._compiled_rules)
+        self._satisfied = set()
+        self._anomaly_expiry = []
+        for anomaly_id, anomaly_data in self.active_anomalies.items():
+            self._index_anomaly(anomaly_id, anomaly_data)
+
+    def _rules_changed(self) -> bool:
+        compiled = self._compiled_rules
+        return compiled is None or len(compiled) != len(self.incident_rules) or \
+            any(a is not b for a, b in zip(compiled, self.incident_rules))
+
+    def _triggers_for(self, anomaly_data: dict) -> list:
+        triggers = []
+        key = anomaly_data.get('key')
+        if isinstance(key, tuple):
+            service_name, _, pattern_id = key
+            patterns = self._pattern_index.get(service_name)
+            if patterns and pattern_id:
+                triggers.extend(('pattern', service_name, pattern) for pattern in patterns if pattern in pattern_id)
+        if ('type', anomaly_data['type']) in self._trigger_rules:
+            triggers.append(('type', anomaly_data['type']))
+        return triggers
+
+    def _push_expiry(self, heap: list, expires_at, *entry):
+        self._sequence += 1
+        heapq.heappush(heap, (expires_at, self._sequence) + entry)
+
+    def _adjust(self, rule_index: int, delta: int):
+        self._match_counts[rule_index] += delta
+        if self._match_counts[rule_index] >= self._compiled_rules[rule_index]['min_concurrency']:
+            self._satisfied.add(rule_index)
+        else:
+            self._satisfied.discard(rule_index)
+
+    def _index_anomaly(self, anomaly_id: str, anomaly_data: dict):
+        timestamp = anomaly_data['timestamp']
+        indexed = set()
+        for trigger in self._triggers_for(anomaly_data):
+            for window, rules in self._trigger_rules[trigger].items():
+                expires_at = timestamp + timedelta(minutes=window)
+                if self._clock is not None and expires_at < self._clock:
+                    continue
+                matches = self._matches[(trigger, window)]
+                matches[anomaly_id] = anomaly_data
+                # A pattern trigger counts once, however many anomalies match it.
+                if trigger[0] == 'type' or len(matches) == 1:
+                    for rule_index in rules:
+                        self._adjust(rule_index, 1)
+                cached = self._first_seen_cache.get((trigger, window))
+                if cached is not None and timestamp < cached:
+                    self._first_seen_cache[(trigger, window)] = timestamp
+                if window not in indexed:
+                    indexed.add(window)
+                    self._push_expiry(self._anomaly_expiry, expires_at, anomaly_id, window, anomaly_data)
+        self._indexed_windows[anomaly_id] = indexed
+        self._push_expiry(self._anomaly_expiry, timestamp + self._anomaly_ttl, anomaly_id, None, anomaly_data)
+
+    def _unindex_anomaly(self, anomaly_id: str, anomaly_data: dict, windows: set):
+        for trigger in self._triggers_for(anomaly_data):
+            for window, rules in self._trigger_rules[trigger].items():
+                if window not in windows:
+                    continue
+                matches = self._matches[(trigger, window)]
+                del matches[anomaly_id]
+                if trigger[0] == 'type' or not matches:
+                    for rule_index in rules:
+                        self._adjust(rule_index, -1)
+                if not matches:
+                    del self._matches[(trigger, window)]
+                if self._first_seen_cache.get((trigger, window)) == anomaly_data['timestamp']:
+                    # Recomputed on the next predict_incidents that needs it.
+                    del self._first_seen_cache[(trigger, window)]
+
+    def _first_seen(self, trigger: tuple, window: int):
+        first_seen = self._first_seen_cache.get((trigger, window))
+        if first_seen is None:
+            first_seen = min(m['timestamp'] for m in self._matches[(trigger, window)].values())
+            self._first_seen_cache[(trigger, window)] = first_seen
+        return first_seen
 
     def add_active_anomaly(self, anomaly_alert: dict):
         """Adds a newly detected anomaly to the active list."""
         anomaly_id = f"{anomaly_alert['type']}-{anomaly_alert['key']}-{anomaly_alert['timestamp']}"
-        self.active_anomalies[anomaly_id] = anomaly_alert
+        # The index is rebuilt from active_anomalies whenever the rules change,
+        # so keeping it in step with a stale rule set is harmless.
+        if self._compiled_rules is not None:
+            previous = self.active_anomalies.get(anomaly_id)
+            if previous is not None:
+                self._unindex_anomaly(anomaly_id, previous, self._indexed_windows.pop(anomaly_id))
+            self.active_anomalies[anomaly_id] = anomaly_alert
+            self._index_anomaly(anomaly_id, anomaly_alert)
+        else:
+            self.active_anomalies[anomaly_id] = anomaly_alert
 
     def clear_resolved_anomaly(self, anomaly_id: str):
         """Removes a resolved anomaly from the active list."""
-        self.active_anomalies.pop(anomaly_id, None)
+        anomaly_data = self.active_anomalies.pop(anomaly_id, None)
+        if anomaly_data is not None and self._compiled_rules is not None:
+            self._unindex_anomaly(anomaly_id, anomaly_data, self._indexed_windows.pop(anomaly_id))
 
-    def predict_incidents(self) -> list:
+    def expire(self, now: datetime):
+        """
+        Drops anomalies from rule windows they have fallen out of, forgets
+        them after the TTL, and forgets incident cooldowns that have run out.
+        predict_incidents calls this; heap entries of anomalies that were
+        cleared or replaced in the meantime are skipped.
+        """
+        self._clock = now if self._clock is None else max(self._clock, now)
+        if self._compiled_rules is not None:
+            heap = self._anomaly_expiry
+            while heap and heap[0][0] < now:
+                _, _, anomaly_id, window, anomaly_data = heapq.heappop(heap)
+                if self.active_anomalies.get(anomaly_id) is not anomaly_data:
+                    continue
+                if window is None:
+                    self.clear_resolved_anomaly(anomaly_id)
+                    self.expired_anomalies += 1
+                elif window in self._indexed_windows[anomaly_id]:
+                    self._indexed_windows[anomaly_id].discard(window)
+                    self._unindex_anomaly(anomaly_id, anomaly_data, {window})
+
+        heap = self._incident_expiry
+        while heap and heap[0][0] < now:
+            expires_at, _, incident_key = heapq.heappop(heap)
+            entry = self.potential_incidents.get(incident_key)
+            if entry is not None and entry['last_alert_time'] + timedelta(seconds=ALERT_COOLDOWN_SECONDS) == expires_at:
+                del self.potential_incidents[incident_key]
+                self.expired_incidents += 1
+
+    def stats(self) -> dict:
+        """Live-set sizes, expiry counters and an estimate of the engine's container memory."""
+        containers = [self.active_anomalies, self.potential_incidents, self._anomaly_expiry, self._incident_expiry,
+                      self._indexed_windows]
+        return {
+            'active_anomalies': len(self.active_anomalies),
+            'potential_incidents': len(self.potential_incidents),
+            'expired_anomalies': self.expired_anomalies,
+            'expired_incidents': self.expired_incidents,
+            'expiry_queue': len(self._anomaly_expiry) + len(self._incident_expiry),
+            'satisfied_rules': len(self._satisfied),
+            'score_cache': len(self._score_cache),
+            'score_cache_hits': self.score_cache_hits,
+            'score_cache_misses': self.score_cache_misses,
+            'bytes': sum(sys.getsizeof(c) for c in containers) + sum(sys.getsizeof(m) for m in self._matches.values()),
+        }
+
+    def predict_incidents(self, now: datetime = None) -> list:
         """
         Evaluates active anomalies and patterns against predefined rules or ML models
         to predict incidents.
         This would be called periodically (e.g., every 30 seconds or minute).
+        `now` defaults to the wall clock; stream processors pass event time.
+        Only rules with enough matching anomalies inside their time window
+        are looked at, and the matches come from the rule index instead of
+        a scan of every anomaly.
         """
         predicted_incidents = []
-        current_time = datetime.now()
+        current_time = now if now is not None else datetime.now()
+        if self._rules_changed():
+            self._compile_rules()
+        self.expire(current_time)
 
-        for rule in self.incident_rules:
-            matched_triggers = []
+        matches = self._matches
+        for rule_index in sorted(self._satisfied):
+            rule = self._compiled_rules[rule_index]
+            window = rule['time_window_minutes']
+            first_matches = []
             for trigger in rule['trigger_patterns']:
-                for anomaly_id, anomaly_data in self.active_anomalies.items():
-                    if 'key' in anomaly_data and isinstance(anomaly_data['key'], tuple):
-                       
-                        service_name, _, pattern_id = anomaly_data['key']
-                        if (trigger[0] == 'service_name' and service_name == trigger[1] and
-                            pattern_id and trigger[2] in pattern_id):
-                            matched_triggers.append(anomaly_data)
-                            break 
-            
-            for trigger_anomaly_type in rule.get('trigger_anomalies', []):
-                for anomaly_id, anomaly_data in self.active_anomalies.items():
-                    if anomaly_data['type'] == trigger_anomaly_type:
-                        matched_triggers.append(anomaly_data)
-
-
-            if len(matched_triggers) >= rule['min_concurrency']:
-                first_match_time = min([m['timestamp'] for m in matched_triggers if 'timestamp' in m]) if matched_triggers else current_time
-                if (current_time - first_match_time).total_seconds() / 60 <= rule['time_window_minutes']:
-
-                    incident_key = f"{rule['name']}-{matched_triggers[0]['key']}" 
-                    if incident_key not in self.potential_incidents or \
-                       (current_time - self.potential_incidents[incident_key]['last_alert_time']).total_seconds() > 300: 
-
-                        predicted_incident = {
-                            'alert_id': f"PRED-{current_time.strftime('%Y%m%d-%H%M%S')}",
-                            'timestamp': current_time,
-                            'severity': rule['severity'],
-                            'likelihood': 'High' if len(matched_triggers) >= rule['min_concurrency'] else 'Medium', 
-                            'predicted_impact': rule['predicted_impact'],
-                            'component_s_affected': list(set([m['key'][0] for m in matched_triggers if isinstance(m['key'], tuple)])),
-                            'root_cause_analysis_predicted': f"Rule '{rule['name']}' triggered by {len(matched_triggers)} matched patterns/anomalies.",
-                            'contextual_data': {
-                                'active_anomalies_matched': [anom['key'] for anom in matched_triggers],
-                            },
-                            'recommended_actions': ["Review relevant service logs immediately.", "Escalate to on-call team.", "Check system dashboards for affected components."],
-                            'rule_name': rule['name']
-                        }
-                        predicted_incidents.append(predicted_incident)
-                        self.potential_incidents[incident_key] = {
-                            'last_alert_time': current_time,
-                            'details': predicted_incident
-                        }
+                if trigger[0] != 'service_name':
+                    continue
+                pattern_matches = matches.get((('pattern', trigger[1], trigger[2]), window))
+                if pattern_matches:
+                    first_matches.append(next(iter(pattern_matches.values())))
+            type_triggers = [('type', t) for t in rule.get('trigger_anomalies', []) if (('type', t), window) in matches]
+            if first_matches:
+                first_key = first_matches[0]['key']
+            else:
+                first_key = next(iter(matches[(type_triggers[0], window)].values()))['key']
+
+            # Cheap checks first: the cooldown needs only the first match and
+            # the time window only the oldest one.
+            incident_key = f"{rule['name']}-{first_key}"
+            if incident_key in self.potential_incidents and \
+               (current_time - self.potential_incidents[incident_key]['last_alert_time']).total_seconds() <= ALERT_COOLDOWN_SECONDS:
+                continue
+            first_match_time = min([m['timestamp'] for m in first_matches] +
+                                   [self._first_seen(trigger, window) for trigger in type_triggers])
+            if (current_time - first_match_time).total_seconds() / 60 > window:
+                continue
+
+            matched_triggers = list(first_matches)
+            for trigger in type_triggers:
+                matched_triggers.extend(matches[(trigger, window)].values())
+
+            predicted_incident = {
+                'alert_id': f"PRED-{current_time.strftime('%Y%m%d-%H%M%S')}",
+                'timestamp': current_time,
+                'severity': rule['severity'],
+                'likelihood': 'High' if len(matched_triggers) >= rule['min_concurrency'] else 'Medium', 
+                'predicted_impact': rule['predicted_impact'],
+                'component_s_affected': list(set([m['key'][0] for m in matched_triggers if isinstance(m['key'], tuple)])),
+                'root_cause_analysis_predicted': f"Rule '{rule['name']}' triggered by {len(matched_triggers)} matched patterns/anomalies.",
+                'contextual_data': {
+                    'active_anomalies_matched': [anom['key'] for anom in matched_triggers],
+                },
+                'recommended_actions': ["Review relevant service logs immediately.", "Escalate to on-call team.", "Check system dashboards for affected components."],
+                'rule_name': rule['name']
+            }
+            predicted_incidents.append(predicted_incident)
+            self.potential_incidents[incident_key] = {
+                'last_alert_time': current_time,
+                'details': predicted_incident
+            }
+            self._push_expiry(self._incident_expiry, current_time + timedelta(seconds=ALERT_COOLDOWN_SECONDS), incident_key)
+
+        if self.use_ml_model:
+            predicted_incidents.extend(self._predict_with_model(current_time))
 
         return predicted_incidents
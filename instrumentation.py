@@ -0,0 +1,247 @@
+"""
+Optional per-method profiling hooks.
+
+enable() wraps the hot methods listed in HOT_METHODS so every call records
+its latency in a histogram and counts the calls that raise; with
+`track_allocations` it also adds up the bytes each call leaves allocated,
+as traced by tracemalloc. disable() puts the original methods back.
+Nothing is wrapped until enable() is called, so with profiling off the
+methods run exactly as before.
+
+render() returns everything recorded, plus the values of any registered
+collectors, in the Prometheus text format; web_dashboard.py serves it on
+/metrics. snapshot() returns the same measurements as a dict.
+
+    instrumentation.enable()
+    pipeline.run(lines)
+    print(instrumentation.render())
+
+Counters are updated without a lock, as each method is normally called
+from a single pipeline stage; a call racing another on the same method can
+occasionally be lost.
+"""
+import functools
+import importlib
+import time
+import tracemalloc
+from bisect import bisect_left
+
+# (module, class, methods) called once per line or once per batch. A registry
+# used as the pipeline's `parser(line)` goes through __call__, which is bound
+# to the unwrapped parse, so it is listed on its own.
+HOT_METHODS = [
+    ('log_parsers', 'LogParserRegistry', ('parse', '__call__', 'parse_batch')),
+    ('log_patterns', 'TemplateMasker', ('mask',)),
+    ('log_patterns', 'LogPatternRecognizer', ('process_log_event', 'process_event_batch')),
+    ('template_store', 'TemplateStore', ('lookup',)),
+    ('anomaly_detector', 'AnomalyDetector', ('update_counts', '_tick_window')),
+    ('incident_predictor', 'IncidentPredictionEngine', ('add_active_anomaly', 'predict_incidents')),
+    ('alerting_system', 'AlertingSystem', ('send_alert',)),
+    ('event_store', 'EventStore', ('append', 'query')),
+]
+
+LATENCY_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    """Latency histogram with fixed upper bounds, in seconds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf if it is past the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class _MethodStats:
+    __slots__ = ('latency', 'errors', 'allocated_bytes')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.allocated_bytes = 0
+
+
+_stats = {}
+_originals = {}
+_collectors = []
+_started_tracemalloc = False
+
+
+def _wrap(method, stats: _MethodStats, track_allocations: bool):
+    latency = stats.latency
+    clock = time.perf_counter
+
+    if track_allocations:
+        traced = tracemalloc.get_traced_memory
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            before = traced()[0]
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            except BaseException:
+                stats.errors += 1
+                raise
+            finally:
+                latency.observe(clock() - start)
+                stats.allocated_bytes += traced()[0] - before
+    else:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            except BaseException:
+                stats.errors += 1
+                raise
+            finally:
+                latency.observe(clock() - start)
+
+    return wrapper
+
+
+def instrument(cls, name: str, track_allocations=False):
+    """Wraps `cls.name` (once) and returns the stats it records into."""
+    key = (cls.__name__, name)
+    if (cls, name) in _originals:
+        return _stats[key]
+    stats = _stats.setdefault(key, _MethodStats())
+    original = cls.__dict__[name]
+    _originals[(cls, name)] = original
+    setattr(cls, name, _wrap(original, stats, track_allocations))
+    return stats
+
+
+def enable(track_allocations=False, methods=HOT_METHODS):
+    """
+    Wraps every method in `methods`. Bound methods captured before this
+    call (e.g. `mask = self.masker.mask` at the top of a batch loop) keep
+    the unwrapped version until they are looked up again.
+    """
+    global _started_tracemalloc
+    if track_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    for module_name, class_name, names in methods:
+        cls = getattr(importlib.import_module(module_name), class_name)
+        for name in names:
+            instrument(cls, name, track_allocations)
+
+
+def disable():
+    """Restores the original methods. Recorded stats are kept until reset()."""
+    global _started_tracemalloc
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+
+def enabled() -> bool:
+    return bool(_originals)
+
+
+def reset():
+    """Zeroes the recorded stats (wrapped methods keep recording into them)."""
+    for stats in _stats.values():
+        stats.latency.__init__(stats.latency.buckets)
+        stats.errors = 0
+        stats.allocated_bytes = 0
+
+
+def register_collector(collect):
+    """
+    Adds `collect() -> [(metric_name, labels_dict, value), ...]`, called on
+    every render() for values kept elsewhere (stage metrics, cache sizes).
+    """
+    _collectors.append(collect)
+
+
+def unregister_collector(collect):
+    if collect in _collectors:
+        _collectors.remove(collect)
+
+
+def snapshot() -> dict:
+    """Per 'Class.method': calls, total and mean seconds, p50/p99 bucket bounds, errors and allocated bytes."""
+    result = {}
+    for (component, method), stats in sorted(_stats.items()):
+        latency = stats.latency
+        result[f"{component}.{method}"] = {
+            'calls': latency.count,
+            'seconds': latency.sum,
+            'mean_seconds': latency.sum / latency.count if latency.count else 0.0,
+            'p50_seconds': latency.quantile(0.5),
+            'p99_seconds': latency.quantile(0.99),
+            'errors': stats.errors,
+            'allocated_bytes': stats.allocated_bytes,
+        }
+    return result
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def render() -> str:
+    """Prometheus text exposition (version 0.0.4) of the method stats and collector values."""
+    lines = []
+    if _stats:
+        lines.append('# HELP log_analysis_call_seconds Latency of instrumented method calls.')
+        lines.append('# TYPE log_analysis_call_seconds histogram')
+        for (component, method), stats in sorted(_stats.items()):
+            latency = stats.latency
+            labels = {'component': component, 'method': method}
+            cumulative = 0
+            for bound, count in zip(latency.buckets, latency.counts):
+                cumulative += count
+                lines.append(f"log_analysis_call_seconds_bucket{_labels(dict(labels, le=repr(bound)))} {cumulative}")
+            lines.append(f"log_analysis_call_seconds_bucket{_labels(dict(labels, le='+Inf'))} {latency.count}")
+            lines.append(f"log_analysis_call_seconds_sum{_labels(labels)} {latency.sum!r}")
+            lines.append(f"log_analysis_call_seconds_count{_labels(labels)} {latency.count}")
+        lines.append('# HELP log_analysis_call_errors_total Instrumented method calls that raised.')
+        lines.append('# TYPE log_analysis_call_errors_total counter')
+        for (component, method), stats in sorted(_stats.items()):
+            lines.append(f"log_analysis_call_errors_total{_labels({'component': component, 'method': method})} "
+                         f"{stats.errors}")
+        if any(stats.allocated_bytes for stats in _stats.values()):
+            lines.append('# HELP log_analysis_call_allocated_bytes Net bytes left allocated by instrumented calls.')
+            lines.append('# TYPE log_analysis_call_allocated_bytes gauge')
+            for (component, method), stats in sorted(_stats.items()):
+                lines.append(f"log_analysis_call_allocated_bytes"
+                             f"{_labels({'component': component, 'method': method})} {stats.allocated_bytes}")
+
+    # Samples of one metric have to be listed together, whichever collector reported them.
+    samples = {}
+    for collect in list(_collectors):
+        for name, labels, value in collect():
+            samples.setdefault(name, []).append(f"{name}{_labels(labels)} {float(value)!r}")
+    for name, metric_lines in samples.items():
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.extend(metric_lines)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,132 @@
+"""
+Synthetic logs for benchmarks, in the `YYYY-MM-DD HH:MM:SS [LEVEL] service - msg`
+format of parse_simple_log.
+
+Each service gets its own set of templates, and (service, template) pairs
+are drawn from a Zipf distribution with exponent `zipf_exponent`, so a few
+templates dominate and a long tail is rare, as in production logs. The
+variable parts (ids, IPs, durations, ...) are drawn from
+`variable_cardinality` distinct values. Incidents can be injected as error
+bursts or silences; `incidents` records them as ground truth and
+detection_report() scores detector output against it.
+
+    generator = SyntheticLogGenerator(services=50, lines_per_second=2000)
+    generator.inject_burst('service-7', at_seconds=600, duration_seconds=120)
+    lines = generator.lines(1_000_000)
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+_SHAPES = [
+    ('INFO', "GET /api/v1/{word}/{n} returned 200 in {ms}ms"),
+    ('INFO', "POST /api/v1/{word} from {ip} accepted"),
+    ('INFO', "User {n} logged in from {ip}"),
+    ('INFO', "Processing message {uuid} for {word} completed successfully in {ms}ms."),
+    ('DEBUG', "Cache miss for key {word}:{uuid}"),
+    ('DEBUG', "Connection {n} to node-{k}.cluster.example.com reused"),
+    ('INFO', "Scheduled job {word} finished, {k} items processed"),
+    ('WARN', "Slow query on {word} took {ms}ms (rows={k})"),
+    ('WARN', "Retrying {word} request to {ip} (attempt {k})"),
+    ('ERROR', "Failed to connect to {word} on port {k}. Error code {n}."),
+    ('ERROR', "Request {uuid} to {word} timed out after {ms}ms"),
+]
+_WORDS = ['orders', 'users', 'payments', 'inventory', 'sessions', 'carts', 'invoices', 'shipments', 'reviews',
+          'search', 'accounts', 'billing', 'catalog', 'profiles', 'tokens', 'reports', 'metrics', 'events']
+
+
+class SyntheticLogGenerator:
+    def __init__(self, services=50, templates_per_service=40, zipf_exponent=1.2, lines_per_second=1000,
+                 variable_cardinality=100_000, start='2025-07-04 12:00:00', seed=0):
+        self.services = [f"service-{i}" for i in range(services)]
+        self.lines_per_second = lines_per_second
+        self.variable_cardinality = variable_cardinality
+        self.start = datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
+        self.rng = np.random.default_rng(seed)
+        combinations = [(level, shape.replace('{word}', word)) for level, shape in _SHAPES for word in _WORDS]
+        self.templates = []
+        for service in self.services:
+            picks = self.rng.choice(len(combinations), size=min(templates_per_service, len(combinations)),
+                                    replace=False)
+            self.templates.extend((service,) + combinations[i] for i in picks.tolist())
+        weights = 1.0 / np.arange(1, len(self.templates) + 1) ** zipf_exponent
+        self.weights = self.rng.permutation(weights / weights.sum())
+        self.incidents = []
+        self._uuids = [f"{a:08x}-{b & 0xffff:04x}-4{c & 0xfff:03x}-a{d & 0xfff:03x}-{e:012x}"
+                       for a, b, c, d, e in self.rng.integers(0, 2 ** 32, size=(4096, 5)).tolist()]
+
+    def inject_burst(self, service: str, at_seconds: int, duration_seconds: int, lines_per_second=50):
+        """
+        `service`'s most frequent ERROR or WARN template is logged an extra
+        `lines_per_second` times a second, on top of its normal traffic.
+        """
+        self.incidents.append({'kind': 'burst', 'service': service, 'start': at_seconds,
+                               'end': at_seconds + duration_seconds, 'rate': lines_per_second})
+
+    def inject_silence(self, service: str, at_seconds: int, duration_seconds: int):
+        """`service` logs nothing at all for `duration_seconds`."""
+        self.incidents.append({'kind': 'silence', 'service': service, 'start': at_seconds,
+                               'end': at_seconds + duration_seconds})
+
+    def _format(self, template: str, values: np.ndarray) -> str:
+        n, k, ms, ip, uuid = values
+        return template.format(n=n, k=k % 64, ms=ms % 5000, uuid=self._uuids[uuid % 4096],
+                               ip=f"10.{ip >> 16 & 255}.{ip >> 8 & 255}.{ip & 255}")
+
+    def lines(self, count: int) -> list:
+        """The first `count` lines of normal traffic, with the injected incidents applied."""
+        picks = self.rng.choice(len(self.templates), size=count, p=self.weights)
+        seconds = np.arange(count) // self.lines_per_second
+        values = self.rng.integers(0, self.variable_cardinality, size=(count, 5)).tolist()
+        rows = list(zip(seconds.tolist(), picks.tolist(), values))
+
+        service_of = [self.services.index(service) for service, _, _ in self.templates]
+        for incident in self.incidents:
+            if incident['kind'] == 'silence':
+                silenced = self.services.index(incident['service'])
+                rows = [row for row in rows if not (service_of[row[1]] == silenced and
+                                                    incident['start'] <= row[0] < incident['end'])]
+        extra = []
+        for incident in self.incidents:
+            if incident['kind'] != 'burst':
+                continue
+            own = [i for i, (service, _, _) in enumerate(self.templates) if service == incident['service']]
+            errors = [i for i in own if self.templates[i][1] in ('ERROR', 'WARN')] or own
+            template_index = max(errors, key=lambda i: self.weights[i])
+            last_second = min(incident['end'], int(seconds[-1]) + 1) if count else 0
+            for second in range(incident['start'], last_second):
+                burst_values = self.rng.integers(0, self.variable_cardinality, size=(incident['rate'], 5)).tolist()
+                extra.extend((second, template_index, value) for value in burst_values)
+        if extra:
+            rows.extend(extra)
+            rows.sort(key=lambda row: row[0])
+
+        templates = self.templates
+        stamps = {}
+        lines = []
+        for second, template_index, value in rows:
+            stamp = stamps.get(second)
+            if stamp is None:
+                stamp = stamps[second] = (self.start + timedelta(seconds=second)).strftime("%Y-%m-%d %H:%M:%S")
+            service, level, template = templates[template_index]
+            lines.append(f"{stamp} [{level}] {service} - {self._format(template, value)}")
+        return lines
+
+    def detection_report(self, anomalies: list) -> list:
+        """
+        For each injected incident, the first anomaly on its service whose
+        window overlaps it, and the delay from incident start to that
+        window's end in event-time seconds (None if it was missed).
+        """
+        report = []
+        for incident in self.incidents:
+            start = self.start + timedelta(seconds=incident['start'])
+            end = self.start + timedelta(seconds=incident['end'])
+            hits = [anomaly for anomaly in anomalies
+                    if isinstance(anomaly.get('key'), tuple) and anomaly['key'][0] == incident['service'] and
+                    anomaly['window_end'] > start and anomaly['window_start'] < end + timedelta(minutes=1)]
+            first = min((anomaly['window_end'] for anomaly in hits), default=None)
+            report.append(dict(incident, detected=first is not None,
+                               delay_seconds=(first - start).total_seconds() if first is not None else None,
+                               anomalies=len(hits)))
+        return report
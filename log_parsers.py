@@ -0,0 +1,318 @@
+import json
+import re
+from datetime import datetime
+from functools import lru_cache
+
+from event_batch import EventBatch, EventBatchBuilder
+
+
+def parse_fixed_timestamp(timestamp_str: str) -> datetime:
+    """
+    Parses `YYYY-MM-DD HH:MM:SS` by slicing fixed offsets, which is several
+    times faster than strptime. Anything else raises ValueError.
+    """
+    if len(timestamp_str) != 19 or timestamp_str[4] != '-' or timestamp_str[13] != ':':
+        raise ValueError(f"Unexpected timestamp layout: {timestamp_str!r}")
+    return datetime(int(timestamp_str[0:4]), int(timestamp_str[5:7]), int(timestamp_str[8:10]),
+                    int(timestamp_str[11:13]), int(timestamp_str[14:16]), int(timestamp_str[17:19]))
+
+
+def parse_simple_log(log_line: str) -> dict:
+    parts = log_line.split(' ', 4)
+    timestamp_str = f"{parts[0]} {parts[1]}"
+    log_level = parts[2].strip('[]')
+    service_name = parts[3].strip('- ')
+    message = parts[4]
+    try:
+        timestamp = parse_fixed_timestamp(timestamp_str)
+    except ValueError:
+        timestamp = datetime.now()
+    return {
+        'timestamp': timestamp,
+        'log_level': log_level,
+        'service_name': service_name,
+        'message': message
+    }
+
+
+# Busy logs repeat the same timestamp text for every line within a second,
+# so the per-format timestamp converters below are memoized.
+_TIMESTAMP_CACHE_SIZE = 4096
+
+_cached_fixed_timestamp = lru_cache(maxsize=_TIMESTAMP_CACHE_SIZE)(parse_fixed_timestamp)
+
+_MONTHS = {name: number for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+_UNIX_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=_TIMESTAMP_CACHE_SIZE)
+def _clf_timestamp(text: str) -> datetime:
+    """
+    `10/Oct/2000:13:55:36 -0700` as naive local time, like every other
+    parser returns, by fixed offsets instead of strptime.
+    """
+    seconds = ((datetime(int(text[7:11]), _MONTHS[text[3:6]], int(text[0:2])).toordinal() - _UNIX_EPOCH_ORDINAL) * 86400 +
+               int(text[12:14]) * 3600 + int(text[15:17]) * 60 + int(text[18:20]))
+    offset = int(text[22:24]) * 3600 + int(text[24:26]) * 60
+    return datetime.fromtimestamp(seconds + offset if text[21] == '-' else seconds - offset)
+
+
+_SIMPLE_RE = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) \[(\w+)\] (\S+) (.*)', re.S)
+
+
+def _parse_simple(line: str):
+    """The `YYYY-MM-DD HH:MM:SS [LEVEL] service - msg` format of parse_simple_log."""
+    match = _SIMPLE_RE.match(line)
+    if match is None:
+        return None
+    timestamp, level, service, message = match.groups()
+    return {
+        'timestamp': _cached_fixed_timestamp(timestamp),
+        'log_level': level,
+        'service_name': service.strip('- '),
+        'message': message,
+    }
+
+
+_LOG4J_RE = re.compile(
+    r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3}) +(?:\[(\w+)\]|(\w+)) +(?:\[[^\]]*\] +)?(\S+?) +- (.*)', re.S)
+_ERROR_TYPE_RE = re.compile(r'\b(\w+(?:Error|Exception))\b')
+
+
+def _parse_log4j(line: str):
+    """Java/log4j: `2024-01-01 12:00:00,123 [ERROR] logger - msg` or `... ERROR [thread] logger - msg`."""
+    match = _LOG4J_RE.match(line)
+    if match is None:
+        return None
+    timestamp, millis, bracketed, bare, logger, message = match.groups()
+    event = {
+        'timestamp': _cached_fixed_timestamp(timestamp).replace(microsecond=int(millis) * 1000),
+        'log_level': bracketed or bare,
+        'service_name': logger,
+        'message': message,
+    }
+    if 'Error' in message or 'Exception' in message:
+        error = _ERROR_TYPE_RE.search(message)
+        if error is not None:
+            event['error_type'] = error.group(1)
+    return event
+
+
+_NGINX_RE = re.compile(
+    r'(\S+) \S+ \S+ \[(\d\d/\w{3}/\d{4}:\d\d:\d\d:\d\d [+-]\d{4})\] '
+    r'"(\S+) (\S+)[^"]*" (\d{3}) (\d+|-)(?: "([^"]*)" "([^"]*)")?')
+
+
+def _parse_nginx(line: str):
+    """nginx `combined` (or `common`) access log."""
+    match = _NGINX_RE.match(line)
+    if match is None:
+        return None
+    remote_addr, timestamp, method, path, status, sent, referer, user_agent = match.groups()
+    if timestamp[3:6] not in _MONTHS:
+        return None
+    status_code = int(status)
+    return {
+        'timestamp': _clf_timestamp(timestamp),
+        'log_level': 'INFO' if 200 <= status_code < 400 else 'ERROR',
+        'service_name': 'nginx',
+        'message': f"Request {path} returned {status}",
+        'remote_addr': remote_addr,
+        'http_method': method,
+        'request_path': path,
+        'status_code': status_code,
+        'bytes_sent': 0 if sent == '-' else int(sent),
+        'referer': referer,
+        'user_agent': user_agent,
+    }
+
+
+_SYSLOG_RE = re.compile(
+    r'(?:<(\d{1,3})>)?(\w{3} [ \d]\d \d\d:\d\d:\d\d) (\S+) ([^:\[\s]+)(?:\[(\d+)\])?: (.*)', re.S)
+_SYSLOG_LEVELS = ('EMERG', 'ALERT', 'CRITICAL', 'ERROR', 'WARN', 'NOTICE', 'INFO', 'DEBUG')
+
+
+@lru_cache(maxsize=_TIMESTAMP_CACHE_SIZE)
+def _syslog_timestamp(text: str) -> datetime:
+    """`Oct 11 22:14:15`; the year is not logged, so the current one is assumed."""
+    now = datetime.now()
+    month = _MONTHS[text[0:3]]
+    year = now.year - 1 if month > now.month + 1 else now.year  # a December line read in January
+    return datetime(year, month, int(text[4:6]), int(text[7:9]), int(text[10:12]), int(text[13:15]))
+
+
+def _parse_syslog(line: str):
+    """BSD syslog (RFC 3164), with or without the `<PRI>` prefix. The year is not logged; the current one is used."""
+    match = _SYSLOG_RE.match(line)
+    if match is None:
+        return None
+    priority, timestamp, host, tag, pid, message = match.groups()
+    if timestamp[0:3] not in _MONTHS:
+        return None
+    event = {
+        'timestamp': _syslog_timestamp(timestamp),
+        'log_level': _SYSLOG_LEVELS[int(priority) & 7] if priority else 'INFO',
+        'service_name': tag,
+        'message': message,
+        'host': host,
+    }
+    if pid:
+        event['pid'] = int(pid)
+    return event
+
+
+_JSON_FIELDS = {
+    'timestamp': ('timestamp', '@timestamp', 'time', 'ts'),
+    'log_level': ('log_level', 'level', 'severity', 'levelname'),
+    'service_name': ('service_name', 'service', 'app', 'logger', 'name'),
+    'message': ('message', 'msg', 'log'),
+}
+
+
+def _json_timestamp(value) -> datetime:
+    if isinstance(value, bool):
+        raise TypeError("A boolean is not a timestamp")
+    if isinstance(value, (int, float)):
+        # Epoch seconds, or milliseconds for values past 2286.
+        return datetime.fromtimestamp(value / 1000 if value > 1e10 else value)
+    return _json_text_timestamp(value)
+
+
+@lru_cache(maxsize=_TIMESTAMP_CACHE_SIZE)
+def _json_text_timestamp(value: str) -> datetime:
+    if len(value) == 19 and value[10] == ' ':
+        return parse_fixed_timestamp(value)
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
+def _parse_json(line: str):
+    """JSON lines; common field names are mapped onto the standard keys and the rest are kept."""
+    if not line.startswith('{'):
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    event = {}
+    for field, names in _JSON_FIELDS.items():
+        for name in names:
+            if name in record:
+                event[field] = record.pop(name)
+                break
+    try:
+        event['timestamp'] = _json_timestamp(event['timestamp']) if 'timestamp' in event else datetime.now()
+    except (TypeError, ValueError, OverflowError, OSError):
+        # Wrong type, or an epoch datetime cannot represent.
+        return None
+    event['log_level'] = str(event.get('log_level', 'INFO')).upper()
+    # Later stages expect text, whatever type the record used.
+    service_name = event.get('service_name')
+    event['service_name'] = 'UNKNOWN' if service_name is None else str(service_name)
+    message = event.get('message')
+    event['message'] = '' if message is None else str(message)
+    for key, value in record.items():
+        event.setdefault(key, value)
+    return event
+
+
+def _unknown_event(line: str) -> dict:
+    return {
+        'timestamp': datetime.now(),
+        'log_level': 'UNKNOWN',
+        'service_name': 'UNKNOWN',
+        'message': line,
+    }
+
+
+# Built-in formats as (name, parser), in detection order. A parser returns
+# an event dict, or None when the line is not in its format.
+DEFAULT_FORMATS = [
+    ('simple', _parse_simple),
+    ('json', _parse_json),
+    ('log4j', _parse_log4j),
+    ('nginx', _parse_nginx),
+    ('syslog', _parse_syslog),
+]
+
+
+class LogParserRegistry:
+    """
+    Parses lines in any registered format. The format is detected once per
+    source, by trying each parser in order, and remembered; later lines from
+    the same source go straight to that parser and only fall back to
+    detection when it stops matching. Lines no format accepts become
+    UNKNOWN events rather than errors.
+
+    Calling the registry parses a line without a source, so an instance can
+    be used wherever a `parser(line)` callable is expected.
+    """
+
+    def __init__(self, formats=None):
+        self.formats = list(DEFAULT_FORMATS if formats is None else formats)
+        self._source_formats = {}
+        self.unparsed = 0
+
+    def register_format(self, name: str, parser, first: bool = False):
+        """Adds a format; `first` puts it ahead of the built-ins in detection order."""
+        if any(existing == name for existing, _ in self.formats):
+            raise ValueError(f"Format '{name}' is already registered")
+        if first:
+            self.formats.insert(0, (name, parser))
+        else:
+            self.formats.append((name, parser))
+        self._source_formats.clear()
+
+    def detect(self, line: str):
+        """Returns ((name, parser), event) for the first format that parses `line`, or (None, None)."""
+        for name, parser in self.formats:
+            try:
+                event = parser(line)
+            except ValueError:
+                continue
+            if event is not None:
+                return (name, parser), event
+        return None, None
+
+    def parse(self, line: str, source=None) -> dict:
+        cached = self._source_formats.get(source)
+        if cached is not None:
+            try:
+                event = cached[1](line)
+            except ValueError:
+                event = None
+            if event is not None:
+                return event
+        detected, event = self.detect(line)
+        if detected is None:
+            self.unparsed += 1
+            return _unknown_event(line)
+        self._source_formats[source] = detected
+        return event
+
+    __call__ = parse
+
+    def parse_batch(self, lines, source=None) -> EventBatch:
+        """Parses `lines` (skipping empty ones) into a columnar EventBatch."""
+        builder = EventBatchBuilder()
+        append = builder.append_event
+        parse = self.parse
+        for line in lines:
+            if line:
+                append(parse(line, source))
+        return builder.build()
+
+    def source_format(self, source=None):
+        """Name of the format last detected for `source`, if any."""
+        cached = self._source_formats.get(source)
+        return cached[0] if cached is not None else None
+
+
+DEFAULT_REGISTRY = LogParserRegistry()
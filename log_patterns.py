@@ -1,66 +1,332 @@
 from collections import defaultdict
+import hashlib
 import re
+import time
 from datetime import datetime
 
+import numpy as np
+
+from event_batch import EventBatch
+from template_miner import DrainTemplateMiner
+from template_store import TemplateJournal, TemplateStore
+
+
+def to_epoch(timestamp) -> float:
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    if timestamp is None:
+        return time.time()
+    return float(timestamp)
+
+
+# Built-in variable patterns as (name, regex, token_start), in alternation
+# priority order: where two patterns can match at the same position the
+# earlier one wins. token_start patterns only match where no letter or digit
+# precedes them, which keeps the scan from retrying them inside every word.
+DEFAULT_PATTERNS = [
+    ('UUID', r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}', True),
+    ('DOMAIN', r'(?:[a-zA-Z0-9_-]+\.)+[a-zA-Z]{2,}', True),
+    ('IP_ADDR', r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', False),
+    ('NUM', r'\d+', False),
+]
+
+# Optional patterns that can be registered with TemplateMasker.register_pattern.
+EXTRA_PATTERNS = {
+    'HEX_ID': (r'0[xX][0-9a-fA-F]+\b|[0-9a-fA-F]{16,}\b', True),
+    'EMAIL': (r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+', True),
+    'DURATION': (r'\d+(?:\.\d+)?(?:ms|us|ns|s|m|h)\b', False),
+}
+
+# Generic patterns that user-registered ones are placed in front of.
+_GENERIC_PATTERNS = ('DOMAIN', 'IP_ADDR', 'NUM')
+
+_TOKEN_START = r'(?<![0-9A-Za-z])'
+
+
+class TemplateMasker:
+    """
+    Masks variable tokens in a log message in a single scan.
+
+    All patterns are compiled into one alternation of named groups, so a
+    message is scanned once no matter how many patterns are registered.
+    """
+
+    def __init__(self, patterns=None):
+        self.patterns = list(DEFAULT_PATTERNS if patterns is None else patterns)
+        self._compile()
+
+    def _compile(self):
+        # Consecutive token_start patterns share a single lookbehind.
+        branches = []
+        run = []
+        for name, regex, token_start in self.patterns:
+            if token_start:
+                run.append(f'(?P<{name}>{regex})')
+                continue
+            if run:
+                branches.append(f"{_TOKEN_START}(?:{'|'.join(run)})")
+                run = []
+            branches.append(f'(?P<{name}>{regex})')
+        if run:
+            branches.append(f"{_TOKEN_START}(?:{'|'.join(run)})")
+        self._sub = re.compile('|'.join(branches)).sub
+        self._placeholders = {name: f'<{name}>' for name, _, _ in self.patterns}
+
+    def register_pattern(self, name: str, regex: str = None, token_start: bool = False):
+        """
+        Adds a variable pattern ahead of the generic DOMAIN/IP_ADDR/NUM patterns.
+        Without `regex`, the pattern is taken from EXTRA_PATTERNS.
+        """
+        if regex is None:
+            regex, token_start = EXTRA_PATTERNS[name]
+        if any(existing == name for existing, _, _ in self.patterns):
+            raise ValueError(f"Pattern '{name}' is already registered")
+        position = next((i for i, (existing, _, _) in enumerate(self.patterns) if existing in _GENERIC_PATTERNS),
+                        len(self.patterns))
+        self.patterns.insert(position, (name, regex, token_start))
+        self._compile()
+
+    def mask(self, message: str) -> (str, dict):
+        """Returns the masked template and the extracted values per pattern name."""
+        params = {}
+        placeholders = self._placeholders
+
+        def replace(match):
+            name = match.lastgroup
+            if name in params:
+                params[name].append(match.group())
+            else:
+                params[name] = [match.group()]
+            return placeholders[name]
+
+        return self._sub(replace, message), params
+
+
 class LogPatternRecognizer:
-    def __init__(self, template_storage_path="log_templates.json"):
-        self.templates = {}
+    """
+    Assigns pattern IDs to log events.
+
+    With strategy='regex' every distinct masked message is its own template.
+    With strategy='drain' masked messages are further clustered online by a
+    DrainTemplateMiner (pass `miner` to tune it), so templates that differ
+    only in a few tokens share one pattern ID; the stored template gains
+    wildcards as the cluster grows.
+
+    Templates are kept in memory unless `template_storage_path` is given;
+    then a TemplateJournal persists them there so pattern IDs survive
+    restarts. Only one process may use a given path at a time, since the
+    journal is appended to without a file lock.
+
+    pattern_id_scheme='sequential' numbers templates P1, P2, ... in creation
+    order. 'hashed' derives the ID from a 64-bit hash of the service name
+    and first template, so independent recognizers (e.g. the shards of a
+    ShardedPatternRecognizer) agree on IDs without sharing a counter.
+    """
+
+    def __init__(self, template_storage_path=None, masker=None, strategy='regex', miner=None,
+                 pattern_id_scheme='sequential'):
+        if strategy not in ('regex', 'drain'):
+            raise ValueError(f"Unknown strategy '{strategy}'")
+        if pattern_id_scheme not in ('sequential', 'hashed'):
+            raise ValueError(f"Unknown pattern_id_scheme '{pattern_id_scheme}'")
+        self.pattern_id_scheme = pattern_id_scheme
+        self.masker = masker if masker is not None else TemplateMasker()
+        self.strategy = strategy
+        self.miner = None
+        if strategy == 'drain':
+            self.miner = miner if miner is not None else DrainTemplateMiner()
+        self.store = TemplateStore()
         self.template_id_counter = 0
         self.template_storage_path = template_storage_path
+        self.journal = None
+        # (service, token count) -> slots whose template has drain wildcards,
+        # so a cluster evicted from the miner can find its stored slot again.
+        self._generalized = defaultdict(set)
         self._load_templates()
+        if self.miner is not None:
+            self._seed_miner()
 
     def _load_templates(self):
-        pass
+        if not self.template_storage_path:
+            return
+        self.journal = TemplateJournal(self.template_storage_path, self.store)
+        self.journal.load()
+        self.template_id_counter = len(self.store)
+        self.journal.start()
 
     def _save_templates(self):
-       
-        pass
+        """Writes pending changes and compacts the journal into a snapshot."""
+        if self.journal is not None:
+            self.journal.flush(compact=True)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
 
     def extract_template(self, message: str) -> (str, dict):
         """
         Extracts a general template from a log message.
         This is a simplified example. Real systems use more robust algorithms
         like Drain, Spell, or deep learning models for pattern extraction.
+        Returns the template and the masked values keyed by pattern name,
+        e.g. {'IP_ADDR': ['192.168.1.100'], 'NUM': ['123']}.
         """
-        template = message
-        template = re.sub(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', '<IP_ADDR>', template) # IP addresses
-        template = re.sub(r'\d+', '<NUM>', template) # Numbers
-        template = re.sub(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}', '<UUID>', template) # UUIDs
-        template = re.sub(r'[a-zA-Z0-9_-]+\.[a-zA-Z]{2,}', '<DOMAIN>', template) # Domains
-
+        return self.masker.mask(message)
 
-        return template, {} 
+    @property
+    def templates(self) -> dict:
+        """Pattern ID -> template stats, materialized from the compact store."""
+        return dict(self.store.items())
 
     def process_log_event(self, parsed_event: dict) -> dict:
         """
         Identifies or creates a pattern for a given parsed log event.
-        Adds a 'pattern_id' and 'template' to the event.
+        Adds a 'pattern_id', 'template' and the masked 'params' to the event.
         """
         message = parsed_event.get('message', '')
         service_name = parsed_event.get('service_name', 'UNKNOWN')
-        timestamp = parsed_event.get('timestamp', datetime.now())
+        template, params = self.extract_template(message)
+        slot = self._assign(service_name, template, to_epoch(parsed_event.get('timestamp')))
+        parsed_event['pattern_id'] = self.store.pattern_ids[slot]
+        parsed_event['template'] = self.store.template_strings[slot]
+        parsed_event['params'] = params
+        return parsed_event
+
+    def process_event_batch(self, batch: EventBatch) -> EventBatch:
+        """
+        Columnar counterpart of process_log_event: sets the batch's pattern
+        codes, pattern IDs, templates and per-event params. A message
+        repeated within the batch is only masked once.
+        """
+        services = batch.services
+        assign = self._assign
+        mask = self.masker.mask
+        masked = {}
+        slot_codes = {}
+        slots = []
+        params = []
+        codes = np.empty(len(batch), dtype=np.int32)
+        for i, (service_code, message, seen_at) in enumerate(zip(batch.service_codes.tolist(), batch.messages,
+                                                                 batch.timestamps.tolist())):
+            result = masked.get(message)
+            if result is None:
+                result = masked[message] = mask(message)
+            params.append(result[1])
+            slot = assign(services[service_code], result[0], seen_at / 1000.0)
+            code = slot_codes.get(slot)
+            if code is None:
+                code = slot_codes[slot] = len(slots)
+                slots.append(slot)
+            codes[i] = code
+        store = self.store
+        batch.pattern_codes = codes
+        batch.patterns = [store.pattern_ids[slot] for slot in slots]
+        # With drain, a template can still gain wildcards later in the batch; report its final form.
+        batch.templates = [store.template_strings[slot] for slot in slots]
+        batch.params = params
+        return batch
+
+    def _assign(self, service_name: str, template: str, seen_at: float) -> int:
+        """Returns the store slot of the masked `template`, creating the pattern if it is new."""
+        store = self.store
+
+        if self.miner is not None:
+            cluster, changed = self.miner.add_message(template, group=service_name)
+            template = cluster.template
+            slot = cluster.slot
+            if slot is not None and changed:
+                slot = self._rename(cluster, service_name)
+        else:
+            cluster = None
+            slot = None
 
-        template, _ = self.extract_template(message)
-        pattern_id = None
+        if slot is None:
+            # A new cluster may reproduce a template that was evicted from the miner.
+            slot = store.lookup(service_name, template)
+            if slot is None and cluster is not None:
+                slot = self._match_generalized(cluster, service_name)
+            if cluster is not None:
+                cluster.slot = slot
 
-        for tid, data in self.templates.items():
-            if data['template'] == template and data.get('service_name') == service_name:
-                pattern_id = tid
-                self.templates[tid]['count'] += 1
-                self.templates[tid]['last_seen'] = timestamp
-                break
+        if slot is not None:
+            store.touch(slot, seen_at)
+            return slot
 
-        if pattern_id is None:
-            self.template_id_counter += 1
+        self.template_id_counter += 1
+        if self.pattern_id_scheme == 'hashed':
+            digest = hashlib.blake2b(f"{service_name}\x00{template}".encode('utf-8', 'surrogatepass'),
+                                     digest_size=8).hexdigest()
+            pattern_id = f"P{digest}"
+        else:
             pattern_id = f"P{self.template_id_counter}"
-            self.templates[pattern_id] = {
-                'template': template,
-                'count': 1,
-                'first_seen': timestamp,
-                'last_seen': timestamp,
-                'service_name': service_name
-            }
-
-        parsed_event['pattern_id'] = pattern_id
-        parsed_event['template'] = template
-        return parsed_event
+        slot = store.add(pattern_id, service_name, template, seen_at)
+        if cluster is not None:
+            cluster.slot = slot
+        return slot
+
+    def _seed_miner(self):
+        """
+        Rebuilds the miner's clusters from the loaded store, so that lines
+        after a restart join their stored templates and keep their pattern
+        IDs. The most recently seen templates are added last, so they are
+        the ones kept under max_clusters.
+        """
+        store = self.store
+        names, templates = store.service_names, store.template_strings
+        owned = []
+        for slot, template in enumerate(templates):
+            self._note_generalized(slot, names[slot], template)
+            # Slots merged into another one share its template and get no cluster of their own.
+            if store.lookup(names[slot], template) == slot:
+                owned.append(slot)
+        owned.sort(key=store.last_seen.__getitem__)
+        if self.miner.max_clusters is not None:
+            owned = owned[max(len(owned) - self.miner.max_clusters, 0):]
+        for slot in owned:
+            self.miner.add_template(templates[slot], group=names[slot], size=store.counts[slot]).slot = slot
+
+    def _note_generalized(self, slot: int, service_name: str, template: str):
+        if self.miner.wildcard in template:
+            self._generalized[service_name, len(template.split())].add(slot)
+
+    def _rename(self, cluster, service_name: str) -> int:
+        """
+        Stores the generalized template of `cluster` and returns its slot. If
+        another slot already has that template the two are merged, and every
+        cluster of the retired slot moves to the one that owns it.
+        """
+        slot = cluster.slot
+        template = cluster.template
+        other = self.store.lookup(service_name, template)
+        owner = self.store.rename(slot, template)
+        self._note_generalized(owner, service_name, template)
+        if other is not None and other != slot:
+            retired = max(slot, other)
+            self._generalized[service_name, len(cluster.tokens)].discard(retired)
+            for live in self.miner.clusters.values():
+                if live.slot == retired:
+                    live.slot = owner
+        return owner
+
+    def _match_generalized(self, cluster, service_name: str):
+        """
+        The stored slot whose wildcard template `cluster`'s first message is an
+        instance of (the most specific one, then the oldest), or None. The
+        cluster takes over that template.
+        """
+        candidates = self._generalized.get((service_name, len(cluster.tokens)))
+        if not candidates:
+            return None
+        wildcard = self.miner.wildcard
+        tokens = cluster.tokens
+        best = None
+        for slot in candidates:
+            stored = self.store.template_strings[slot].split()
+            if all(part == wildcard or part == token for part, token in zip(stored, tokens)):
+                key = (stored.count(wildcard), slot)
+                if best is None or key < best[0]:
+                    best = (key, slot, stored)
+        if best is None:
+            return None
+        cluster.tokens[:] = best[2]
+        return best[1]
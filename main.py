@@ -1,4 +1,5 @@
 from log_patterns import LogPatternRecognizer
+from log_parsers import parse_simple_log
 from datetime import datetime
 raw_logs = [
     '2025-07-04 12:00:01 [INFO] web-server-1 - User 123 logged in from 192.168.1.100',
@@ -8,25 +9,6 @@ raw_logs = [
     '2025-07-04 12:00:20 [ERROR] db-service-prod - Failed to connect to DB on port 5432. Error code 101.'
 ]
 
-def parse_simple_log(log_line: str) -> dict:
-    parts = log_line.split(' ', 4) 
-    timestamp_str = f"{parts[0]} {parts[1]}"
-    log_level = parts[2].strip('[]')
-    service_name = parts[3].strip('- ')
-    message = parts[4]
-
-    try:
-        timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        timestamp = datetime.now()
-
-    return {
-        'timestamp': timestamp,
-        'log_level': log_level,
-        'service_name': service_name,
-        'message': message
-    }
-
 parsed_events = [parse_simple_log(log) for log in raw_logs]
 
 print("--- Log Pattern Recognition ---")
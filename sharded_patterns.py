@@ -0,0 +1,157 @@
+import multiprocessing
+import zlib
+from collections import defaultdict
+
+from event_batch import EventBatch
+from log_patterns import LogPatternRecognizer
+from template_store import TemplateStore
+
+
+def shard_for(service_name: str, shard_count: int) -> int:
+    """Stable shard assignment; unlike hash(), crc32 is the same in every process."""
+    return zlib.crc32(service_name.encode('utf-8', 'surrogatepass')) % shard_count
+
+
+def _shard_worker(connection, recognizer_options: dict):
+    """
+    Worker loop: recognizes each batch of events received on `connection`
+    and replies with their pattern IDs and params, the (service, level,
+    pattern) count deltas, and the template changes made by the batch.
+    """
+    recognizer = LogPatternRecognizer(**recognizer_options)
+    store = recognizer.store
+    slot_by_pattern = {}
+    while True:
+        events = connection.recv()
+        if events is None:
+            recognizer.close()
+            connection.close()
+            return
+
+        pattern_ids = []
+        params = []
+        touched = defaultdict(int)
+        key_deltas = defaultdict(int)
+        process = recognizer.process_log_event
+        for event in events:
+            event = process(event)
+            pattern_id = event['pattern_id']
+            pattern_ids.append(pattern_id)
+            params.append(event['params'])
+            touched[pattern_id] += 1
+            key_deltas[(event.get('service_name'), event.get('log_level'), pattern_id)] += 1
+
+        for slot in range(len(slot_by_pattern), len(store)):
+            slot_by_pattern[store.pattern_ids[slot]] = slot
+        template_deltas = []
+        for pattern_id, count in touched.items():
+            slot = slot_by_pattern[pattern_id]
+            template_deltas.append((pattern_id, store.service_names[slot], store.template_strings[slot],
+                                    store.first_seen[slot], count, store.last_seen[slot]))
+        connection.send((pattern_ids, params, dict(key_deltas), template_deltas))
+
+
+class ShardedPatternRecognizer:
+    """
+    Runs one LogPatternRecognizer per worker process, sharding events by
+    service_name, and merges the shards' templates into a global view.
+
+    Workers use content-hashed pattern IDs (pattern_id_scheme='hashed'), so
+    IDs are stable across shards and restarts without a shared counter.
+    Each call to process_batch merges the template changes of that batch
+    into `store`, and returns batched (service, level, pattern) count
+    deltas for AnomalyDetector.add_counts instead of one dict per event.
+    """
+
+    def __init__(self, workers=4, template_storage_path=None, **recognizer_options):
+        self.workers = workers
+        self.store = TemplateStore()
+        self._slot_by_pattern = {}
+        context = multiprocessing.get_context()
+        self._connections = []
+        self._processes = []
+        recognizer_options['pattern_id_scheme'] = 'hashed'
+        for shard in range(workers):
+            options = dict(recognizer_options)
+            options['template_storage_path'] = f"{template_storage_path}.shard{shard}" if template_storage_path else None
+            parent_end, child_end = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(child_end, options),
+                                      name=f"pattern-shard-{shard}", daemon=True)
+            process.start()
+            child_end.close()
+            self._connections.append(parent_end)
+            self._processes.append(process)
+
+    @property
+    def templates(self) -> dict:
+        return dict(self.store.items())
+
+    def _merge(self, template_deltas: list):
+        store = self.store
+        slot_by_pattern = self._slot_by_pattern
+        for pattern_id, service_name, template, first_seen, count, last_seen in template_deltas:
+            slot = slot_by_pattern.get(pattern_id)
+            if slot is None:
+                slot = store.add(pattern_id, service_name, template, first_seen, count=0)
+                slot_by_pattern[pattern_id] = slot
+            elif store.service_names[slot] != service_name:
+                raise ValueError(f"Pattern ID collision on {pattern_id}: "
+                                 f"{store.service_names[slot]!r} and {service_name!r}")
+            elif store.template_strings[slot] != template:
+                store.rename(slot, template)
+            store.touch(slot, last_seen, count)
+
+    def process_batch(self, events: list) -> (list, dict):
+        """
+        Recognizes `events` across the worker pool. Adds 'pattern_id',
+        'template' and 'params' to each event in place and returns
+        (events, key_deltas).
+        """
+        shards = [[] for _ in range(self.workers)]
+        positions = [[] for _ in range(self.workers)]
+        for position, event in enumerate(events):
+            shard = shard_for(event.get('service_name', 'UNKNOWN'), self.workers)
+            shards[shard].append(event)
+            positions[shard].append(position)
+
+        busy = [shard for shard in range(self.workers) if shards[shard]]
+        for shard in busy:
+            self._connections[shard].send(shards[shard])
+
+        key_deltas = defaultdict(int)
+        store = self.store
+        for shard in busy:
+            pattern_ids, params, shard_deltas, template_deltas = self._connections[shard].recv()
+            self._merge(template_deltas)
+            for key, count in shard_deltas.items():
+                key_deltas[key] += count
+            for position, pattern_id, event_params in zip(positions[shard], pattern_ids, params):
+                event = events[position]
+                event['pattern_id'] = pattern_id
+                event['template'] = store.template_strings[self._slot_by_pattern[pattern_id]]
+                event['params'] = event_params
+        return events, dict(key_deltas)
+
+    def process_event_batch(self, batch: EventBatch) -> EventBatch:
+        """
+        Sets the pattern codes, templates and params of a columnar batch,
+        like LogPatternRecognizer.process_event_batch; the workers still
+        exchange event dicts.
+        """
+        events, _ = self.process_batch(batch.to_events())
+        batch.set_patterns([event['pattern_id'] for event in events], [event['template'] for event in events])
+        batch.params = [event['params'] for event in events]
+        return batch
+
+    def process_log_event(self, parsed_event: dict) -> dict:
+        """Single-event adapter; prefer process_batch for throughput."""
+        return self.process_batch([parsed_event])[0][0]
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(None)
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
@@ -0,0 +1,270 @@
+"""
+Fixed-size streaming summaries for high-cardinality key counts.
+
+All three sketches work on 128-bit blake2b hashes of the keys, so they are
+deterministic across processes and runs, and every one of them is
+mergeable: two sketches built with the same parameters over different
+parts of a stream merge into the sketch of the whole stream.
+
+  CountMinSketch   point count estimates. With width = ceil(e / epsilon)
+                   and depth = ceil(ln(1 / delta)), an estimate is never
+                   below the true count and exceeds it by more than
+                   epsilon * total with probability at most delta.
+  HeavyHitters     Misra-Gries summary with k counters. Every key seen more
+                   than total / (k + 1) times is kept, and a kept count is
+                   at most total / (k + 1) below the true count.
+  HyperLogLog      distinct count with 2**precision registers per group;
+                   relative standard error about 1.04 / sqrt(2**precision).
+
+The Count-Min table is width * depth int64 counters, about 1.5 MB at
+epsilon=1e-4 and delta=1e-3, and is only allocated once it is first added to.
+"""
+import math
+from hashlib import blake2b
+
+import numpy as np
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+# Rough cost of one buffered key in WindowSketch (dict slot, key tuple, count).
+_PENDING_BYTES_PER_KEY = 200
+
+
+def hash_keys(keys: list) -> (np.ndarray, np.ndarray):
+    """Returns two independent uint64 hashes per key."""
+    digests = b''.join(
+        blake2b('\x00'.join(map(str, key)).encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        for key in keys)
+    hashes = np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+    return hashes[:, 0], hashes[:, 1]
+
+
+class CountMinSketch:
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        self.table = None
+        self.total = 0
+
+    def _table(self) -> np.ndarray:
+        if self.table is None:
+            self.table = np.zeros((self.depth, self.width), dtype=np.int64)
+        return self.table
+
+    @classmethod
+    def from_error(cls, epsilon: float, delta: float):
+        return cls(int(math.ceil(math.e / epsilon)), int(math.ceil(math.log(1.0 / delta))))
+
+    def _columns(self, h1: np.ndarray, h2: np.ndarray) -> np.ndarray:
+        # Kirsch-Mitzenmacher double hashing: row i uses h1 + i * h2.
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        with np.errstate(over='ignore'):
+            return ((h1[None, :] + rows * h2[None, :]) % np.uint64(self.width)).astype(np.int64)
+
+    def add_hashes(self, h1: np.ndarray, h2: np.ndarray, counts: np.ndarray):
+        columns = self._columns(h1, h2)
+        table = self._table()
+        for row in range(self.depth):
+            np.add.at(table[row], columns[row], counts)
+        self.total += int(counts.sum())
+
+    def estimate_hashes(self, h1: np.ndarray, h2: np.ndarray) -> np.ndarray:
+        if self.table is None:
+            return np.zeros(len(h1), dtype=np.int64)
+        columns = self._columns(h1, h2)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other: 'CountMinSketch'):
+        if other.table is not None:
+            self._table()[...] += other.table
+        self.total += other.total
+
+    def clear(self):
+        if self.table is not None:
+            self.table.fill(0)
+        self.total = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes if self.table is not None else 0
+
+
+class HeavyHitters:
+    def __init__(self, k: int):
+        self.k = k
+        self.counters = {}
+
+    def update(self, key_counts: dict):
+        counters = self.counters
+        for key, count in key_counts.items():
+            counters[key] = counters.get(key, 0) + count
+        self._prune()
+
+    def merge(self, other: 'HeavyHitters'):
+        self.update(other.counters)
+
+    def _prune(self):
+        counters = self.counters
+        if len(counters) <= self.k:
+            return
+        # Subtracting the (k+1)-th largest count from every counter keeps at
+        # most k of them and is what makes Misra-Gries summaries mergeable.
+        values = np.fromiter(counters.values(), dtype=np.int64, count=len(counters))
+        cut = np.partition(values, len(values) - self.k - 1)[len(values) - self.k - 1]
+        self.counters = {key: count - cut for key, count in counters.items() if count > cut}
+
+    def clear(self):
+        self.counters = {}
+
+
+class HyperLogLog:
+    """One set of registers per group (e.g. per service), grown as groups appear."""
+
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.m = 1 << precision
+        self.groups = {}
+        self.registers = np.zeros((0, self.m), dtype=np.uint8)
+
+    def _group_codes(self, groups: list) -> np.ndarray:
+        codes = self.groups
+        for group in groups:
+            if group not in codes:
+                codes[group] = len(codes)
+        if len(codes) > len(self.registers):
+            grown = np.zeros((max(len(codes), 2 * len(self.registers)), self.m), dtype=np.uint8)
+            grown[:len(self.registers)] = self.registers
+            self.registers = grown
+        return np.fromiter((codes[group] for group in groups), dtype=np.int64, count=len(groups))
+
+    def add_hashes(self, groups: list, hashes: np.ndarray):
+        codes = self._group_codes(groups)
+        precision = np.uint64(self.precision)
+        index = (hashes & np.uint64(self.m - 1)).astype(np.int64)
+        rest = hashes >> precision
+        # Rank of the lowest set bit; rest & -rest isolates it, and log2 of a
+        # power of two is exact in float64.
+        with np.errstate(over='ignore'):
+            lowest = rest & ((~rest + np.uint64(1)) & _MASK64)
+        ranks = np.where(rest == 0, 64 - self.precision + 1,
+                         np.log2(np.maximum(lowest, 1).astype(np.float64)).astype(np.int64) + 1)
+        np.maximum.at(self.registers, (codes, index), ranks.astype(np.uint8))
+
+    def merge(self, other: 'HyperLogLog'):
+        if other.groups:
+            codes = self._group_codes(list(other.groups))
+            count = len(other.groups)
+            self.registers[codes] = np.maximum(self.registers[codes], other.registers[:count])
+
+    def estimates(self) -> dict:
+        """Returns {group: estimated distinct count}."""
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        results = {}
+        for group, code in self.groups.items():
+            registers = self.registers[code]
+            estimate = alpha * m * m / np.ldexp(1.0, -registers.astype(np.int64)).sum()
+            zeros = int(np.count_nonzero(registers == 0))
+            if estimate <= 2.5 * m and zeros:
+                estimate = m * math.log(m / zeros)
+            results[group] = int(round(estimate))
+        return results
+
+    def clear(self):
+        self.groups = {}
+        self.registers = np.zeros((0, self.m), dtype=np.uint8)
+
+    @property
+    def nbytes(self) -> int:
+        return self.registers.nbytes
+
+
+class WindowSketch:
+    """
+    Approximate counts of (service, level, pattern_id) keys over one window:
+    a CountMinSketch for point estimates, HeavyHitters for the keys worth
+    tracking and a HyperLogLog of distinct keys per service.
+
+    Adds are buffered exactly in a dict of at most `pending_limit` keys and
+    folded into the sketches in one vectorized batch, so memory stays fixed
+    no matter how many distinct keys the window sees. A sketch that never
+    filled its buffer (e.g. a quiet pane of a sliding window) holds no
+    Count-Min table at all and merges into another one key by key.
+    """
+
+    def __init__(self, top_k=1000, epsilon=0.0001, delta=0.001, precision=12, pending_limit=None):
+        self.counts = CountMinSketch.from_error(epsilon, delta)
+        self.heavy_hitters = HeavyHitters(top_k)
+        self.distinct = HyperLogLog(precision)
+        self.pending_limit = pending_limit if pending_limit is not None else max(4 * top_k, 4096)
+        self._pending = {}
+
+    def add(self, key, count=1):
+        pending = self._pending
+        pending[key] = pending.get(key, 0) + count
+        if len(pending) >= self.pending_limit:
+            self.fold()
+
+    def update(self, key_counts: dict):
+        pending = self._pending
+        for key, count in key_counts.items():
+            pending[key] = pending.get(key, 0) + count
+        if len(pending) >= self.pending_limit:
+            self.fold()
+
+    def fold(self):
+        """Moves the buffered adds into the sketches."""
+        pending = self._pending
+        if not pending:
+            return
+        keys = list(pending)
+        counts = np.fromiter(pending.values(), dtype=np.int64, count=len(keys))
+        h1, h2 = hash_keys(keys)
+        self.counts.add_hashes(h1, h2, counts)
+        self.distinct.add_hashes([key[0] for key in keys], h2)
+        self.heavy_hitters.update(pending)
+        self._pending = {}
+
+    def merge(self, other: 'WindowSketch'):
+        if other.counts.table is None:
+            # Never folded: its buffer holds its exact counts.
+            self.update(other._pending)
+            return
+        self.fold()
+        other.fold()
+        self.counts.merge(other.counts)
+        self.heavy_hitters.merge(other.heavy_hitters)
+        self.distinct.merge(other.distinct)
+
+    def estimate(self, keys: list) -> np.ndarray:
+        """Count-Min estimates for `keys`; never below the true counts."""
+        self.fold()
+        if not keys or not self.counts.total:
+            return np.zeros(len(keys), dtype=np.int64)
+        return self.counts.estimate_hashes(*hash_keys(keys))
+
+    def top_keys(self) -> list:
+        self.fold()
+        return list(self.heavy_hitters.counters)
+
+    def cardinality(self) -> dict:
+        """Estimated distinct keys per service."""
+        self.fold()
+        return self.distinct.estimates()
+
+    @property
+    def total(self) -> int:
+        return self.counts.total + sum(self._pending.values())
+
+    def clear(self):
+        self._pending = {}
+        self.counts.clear()
+        self.heavy_hitters.clear()
+        self.distinct.clear()
+
+    @property
+    def nbytes(self) -> int:
+        """The sketch tables plus a rough cost for the buffered keys."""
+        return self.counts.nbytes + self.distinct.nbytes + len(self._pending) * _PENDING_BYTES_PER_KEY
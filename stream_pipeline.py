@@ -0,0 +1,353 @@
+"""
+Streaming log pipeline.
+
+Lines flow from a source (file tail, stdin, TCP socket) through
+parse -> pattern -> anomaly -> predict -> alert stages. Each stage runs in
+its own thread and hands batches to the next through a bounded queue, so a
+slow stage blocks its producers instead of letting memory grow. Windows
+close on event time, never on a wall-clock timer: the AnomalyDetector runs
+in event-time mode and emits each window once its watermark passes it.
+
+    python stream_pipeline.py --file app.log --follow --templates log_templates.bin
+    tail -F app.log | python stream_pipeline.py
+    python stream_pipeline.py --socket 0.0.0.0:5140
+"""
+import argparse
+import queue
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+
+from alerting_system import AlertingSystem
+from anomaly_detector import AnomalyDetector
+from event_batch import EventBatch
+from incident_predictor import IncidentPredictionEngine
+from log_parsers import parse_simple_log
+from log_patterns import LogPatternRecognizer
+
+_END = object()
+
+
+def tail_file(path: str, follow: bool = False, poll_interval: float = 0.25):
+    """Yields lines from `path`; with `follow`, keeps waiting for new ones like `tail -f`."""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        while True:
+            line = f.readline()
+            if line:
+                yield line.rstrip('\r\n')
+            elif follow:
+                time.sleep(poll_interval)
+            else:
+                return
+
+
+def read_stream(stream=None):
+    """Yields lines from a text stream, stdin by default."""
+    for line in stream if stream is not None else sys.stdin:
+        yield line.rstrip('\r\n')
+
+
+def read_socket(host: str, port: int):
+    """Accepts TCP connections one at a time and yields their newline-delimited lines."""
+    with socket.create_server((host, port)) as server:
+        while True:
+            connection, _ = server.accept()
+            with connection, connection.makefile('r', encoding='utf-8', errors='replace') as stream:
+                yield from read_stream(stream)
+
+
+class StageMetrics:
+    __slots__ = ('name', 'items_in', 'items_out', 'batches', 'errors', 'last_error', 'busy_seconds',
+                 'max_queue_depth', 'inbox')
+
+    def __init__(self, name: str, inbox: queue.Queue):
+        self.name = name
+        self.inbox = inbox
+        self.items_in = 0
+        self.items_out = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error = None
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def as_dict(self) -> dict:
+        return {
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'batches': self.batches,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'busy_seconds': self.busy_seconds,
+            'items_per_busy_second': self.items_in / self.busy_seconds if self.busy_seconds else 0.0,
+            'queue_depth': self.inbox.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+        }
+
+
+class Stage(threading.Thread):
+    """
+    Runs `process(batch) -> list` on every batch from `inbox` and forwards
+    non-empty results to `outbox`. `finish() -> list` runs once the input
+    ends, to flush anything the stage is still holding.
+
+    A batch whose processing raises is dropped and counted in
+    `metrics.errors`; the stage keeps draining its inbox and always passes
+    the end of input on, so one bad batch cannot stall the pipeline.
+    """
+
+    def __init__(self, name: str, process, inbox: queue.Queue, outbox: queue.Queue = None, finish=None):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.process = process
+        self.finish = finish
+        self.inbox = inbox
+        self.outbox = outbox
+        self.metrics = StageMetrics(name, inbox)
+
+    def _emit(self, batch):
+        if batch and self.outbox is not None:
+            self.metrics.items_out += len(batch)
+            self.outbox.put(batch)
+
+    def _failed(self, error: Exception):
+        self.metrics.errors += 1
+        self.metrics.last_error = repr(error)
+        print(f"pipeline stage {self.metrics.name} failed: {error!r}", file=sys.stderr)
+
+    def run(self):
+        metrics = self.metrics
+        while True:
+            depth = self.inbox.qsize()
+            if depth > metrics.max_queue_depth:
+                metrics.max_queue_depth = depth
+            batch = self.inbox.get()
+            if batch is _END:
+                try:
+                    if self.finish is not None:
+                        self._emit(self.finish())
+                except Exception as error:
+                    self._failed(error)
+                finally:
+                    if self.outbox is not None:
+                        self.outbox.put(_END)
+                return
+            start = time.perf_counter()
+            try:
+                result = self.process(batch)
+            except Exception as error:
+                self._failed(error)
+                result = None
+            metrics.busy_seconds += time.perf_counter() - start
+            metrics.items_in += len(batch)
+            metrics.batches += 1
+            self._emit(result)
+
+
+class StreamPipeline:
+    """
+    Wires the analysis components into a staged streaming pipeline.
+
+    `window_seconds` is the event-time length of one anomaly window, used
+    when no detector is passed in; a detector passed in must have its own
+    `window_seconds` set. The anomalies of every closed window are run
+    through predict_incidents with the window end as the prediction time.
+
+    With `columnar` (the default) batches travel between the parse, pattern
+    and anomaly stages as EventBatch columns rather than lists of event
+    dicts; the recognizer then needs a process_event_batch method.
+
+    A `publisher` (e.g. a DashboardPublisher) is handed every recognized
+    batch and, per closed window, its anomalies and the predicted incidents.
+    A `store` (an EventStore) gets every recognized batch appended, and is
+    flushed once the input ends.
+
+    The alert stage ticks `alerting` as the watermark advances, so dedupe
+    roll-ups go out on event time even while no new incidents arrive.
+    """
+
+    def __init__(self, recognizer=None, detector=None, engine=None, alerting=None, parser=parse_simple_log,
+                 window_seconds=60, batch_size=512, queue_size=64, columnar=True, publisher=None,
+                 store=None):
+        if detector is None:
+            detector = AnomalyDetector(window_seconds=window_seconds)
+        elif detector.window_seconds is None:
+            raise ValueError("StreamPipeline needs an AnomalyDetector with window_seconds set")
+        self.recognizer = recognizer if recognizer is not None else LogPatternRecognizer()
+        self.detector = detector
+        self.engine = engine if engine is not None else IncidentPredictionEngine()
+        self.alerting = alerting if alerting is not None else AlertingSystem()
+        self.parser = parser
+        self.columnar = columnar
+        self.publisher = publisher
+        self.store = store
+        self.window_seconds = detector.window_seconds
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.lines_read = 0
+        self._event_time = None
+        self._parse_stage = None
+        self.stages = []
+        self._source_thread = None
+
+    def _parse(self, lines: list) -> list:
+        events = []
+        parser = self.parser
+        for line in lines:
+            if not line:
+                continue
+            try:
+                events.append(parser(line))
+            except (ValueError, IndexError):
+                self._parse_stage.metrics.errors += 1
+        return EventBatch.from_events(events) if self.columnar else events
+
+    def _recognize(self, events):
+        if self.columnar:
+            self.recognizer.process_event_batch(events)
+        else:
+            process = self.recognizer.process_log_event
+            for event in events:
+                process(event)
+        if self.publisher is not None:
+            self.publisher.publish(events=events)
+        if self.store is not None:
+            self.store.append(events)
+        return events
+
+    def _finish_recognize(self) -> list:
+        if self.store is not None:
+            self.store.flush()
+        return []
+
+    @staticmethod
+    def _group_by_window(anomalies: list) -> list:
+        # The window end travels with the anomalies so prediction runs on event time.
+        windows = {}
+        for anomaly in anomalies:
+            windows.setdefault(anomaly['window_end'], []).append(anomaly)
+        return list(windows.items())
+
+    def _count(self, events) -> list:
+        if self.columnar:
+            windows = self._group_by_window(self.detector.update_counts(events))
+        else:
+            anomalies = []
+            update_counts = self.detector.update_counts
+            for event in events:
+                anomalies.extend(update_counts(event))
+            windows = self._group_by_window(anomalies)
+        # A trailing (watermark, []) entry carries event time on to the alert stage.
+        watermark = self.detector.watermark
+        if watermark is not None and (self._event_time is None or watermark > self._event_time):
+            self._event_time = watermark
+            windows.append((datetime.fromtimestamp(watermark), []))
+        return windows
+
+    def _finish_counts(self) -> list:
+        return self._group_by_window(self.detector.flush())
+
+    def _predict(self, windows: list) -> list:
+        """Returns (window end, incidents) per window; watermark entries pass through with none."""
+        incidents = []
+        predicted = []
+        for window_end, anomalies in windows:
+            window_incidents = []
+            if anomalies:
+                for anomaly in anomalies:
+                    self.engine.add_active_anomaly(anomaly)
+                window_incidents = self.engine.predict_incidents(now=window_end)
+                incidents.extend(window_incidents)
+            predicted.append((window_end, window_incidents))
+        anomalies = [anomaly for _, window_anomalies in windows for anomaly in window_anomalies]
+        if self.publisher is not None and (anomalies or incidents):
+            self.publisher.publish(anomalies=anomalies, incidents=incidents)
+        return predicted
+
+    def _alert(self, windows: list) -> list:
+        send_alert = self.alerting.send_alert
+        for window_end, incidents in windows:
+            for incident in incidents:
+                # Incidents carry the window end, so dedupe windows run on event time too.
+                send_alert(incident, now=incident['timestamp'])
+            self.alerting.tick(window_end)
+        return []
+
+    def _build_stages(self):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(5)]
+        self.inbox = queues[0]
+        self._parse_stage = Stage('parse', self._parse, queues[0], queues[1])
+        self.stages = [
+            self._parse_stage,
+            Stage('pattern', self._recognize, queues[1], queues[2], finish=self._finish_recognize),
+            Stage('anomaly', self._count, queues[2], queues[3], finish=self._finish_counts),
+            Stage('predict', self._predict, queues[3], queues[4]),
+            Stage('alert', self._alert, queues[4]),
+        ]
+
+    def _feed(self, lines):
+        batch = []
+        batch_size = self.batch_size
+        put = self.inbox.put
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= batch_size:
+                self.lines_read += len(batch)
+                put(batch)
+                batch = []
+        if batch:
+            self.lines_read += len(batch)
+            put(batch)
+        put(_END)
+
+    def start(self, lines):
+        """Starts the stages and feeds `lines` (any iterable) from a background thread."""
+        self._build_stages()
+        for stage in self.stages:
+            stage.start()
+        self._source_thread = threading.Thread(target=self._feed, args=(lines,), name='pipeline-source', daemon=True)
+        self._source_thread.start()
+
+    def join(self, timeout=None):
+        """Waits until the input is exhausted and every stage has drained."""
+        self._source_thread.join(timeout)
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def run(self, lines) -> dict:
+        """Processes `lines` to completion and returns the stage metrics."""
+        self.start(lines)
+        self.join()
+        return self.metrics()
+
+    def metrics(self) -> dict:
+        return {
+            'lines_read': self.lines_read,
+            'stages': {stage.metrics.name: stage.metrics.as_dict() for stage in self.stages},
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', help="read lines from this file instead of stdin")
+    parser.add_argument('--follow', action='store_true', help="keep reading as the file grows")
+    parser.add_argument('--socket', help="listen on HOST:PORT for newline-delimited logs")
+    parser.add_argument('--window-seconds', type=int, default=60)
+    parser.add_argument('--templates', help="persist pattern templates to this file (one process per file)")
+    args = parser.parse_args()
+
+    if args.socket:
+        host, port = args.socket.rsplit(':', 1)
+        source = read_socket(host, int(port))
+    elif args.file:
+        source = tail_file(args.file, follow=args.follow)
+    else:
+        source = read_stream()
+
+    pipeline = StreamPipeline(recognizer=LogPatternRecognizer(template_storage_path=args.templates),
+                              window_seconds=args.window_seconds)
+    for name, stage in pipeline.run(source)['stages'].items():
+        print(f"{name:<8} {stage}")
+    pipeline.alerting.close()
+    pipeline.recognizer.close()
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+
+
+class LogCluster:
+    __slots__ = ('cluster_id', 'tokens', 'size', 'leaf', 'slot')
+
+    def __init__(self, cluster_id: int, tokens: list, leaf):
+        self.cluster_id = cluster_id
+        self.tokens = tokens
+        self.size = 1
+        self.leaf = leaf
+        # Free for the caller to use; LogPatternRecognizer keeps its template slot here.
+        self.slot = None
+
+    @property
+    def template(self) -> str:
+        return ' '.join(self.tokens)
+
+
+class _Node:
+    __slots__ = ('children', 'clusters')
+
+    def __init__(self):
+        self.children = {}
+        self.clusters = []
+
+
+class DrainTemplateMiner:
+    """
+    Online template miner using Drain's fixed-depth parse tree.
+
+    The tree is keyed on an optional group (e.g. the service name), the
+    token count and the first `depth - 2` tokens of a message. A leaf holds
+    a short list of clusters; a message joins the most similar one when the
+    share of matching tokens reaches `similarity_threshold`, and differing
+    tokens are merged into wildcards. Each line therefore costs O(depth)
+    plus a scan of one leaf.
+
+    Memory is bounded by `max_children` per node and, when `max_clusters`
+    is set, by evicting the least recently matched cluster.
+    """
+
+    def __init__(self, depth=4, similarity_threshold=0.4, max_children=100, max_clusters=None, wildcard='<*>'):
+        if depth < 3:
+            raise ValueError("depth must be at least 3")
+        self.depth = depth
+        self.similarity_threshold = similarity_threshold
+        self.max_children = max_children
+        self.max_clusters = max_clusters
+        self.wildcard = wildcard
+        self.root = _Node()
+        self.clusters = OrderedDict()
+        self.cluster_id_counter = 0
+        self.evicted_count = 0
+
+    def _is_variable(self, token: str) -> bool:
+        return any(char.isdigit() for char in token) or (token.startswith('<') and token.endswith('>'))
+
+    def _child_key(self, node: _Node, token: str, create: bool):
+        if self._is_variable(token):
+            return self.wildcard
+        if token in node.children:
+            return token
+        if create and len(node.children) < self.max_children - 1:
+            return token
+        return self.wildcard
+
+    def _leaf(self, tokens: list, group, create: bool):
+        node = self.root
+        keys = [group, len(tokens)] + tokens[:self.depth - 2]
+        for level, key in enumerate(keys):
+            if level >= 2:
+                key = self._child_key(node, key, create)
+            child = node.children.get(key)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[key] = _Node()
+            node = child
+        return node
+
+    def _similarity(self, template_tokens: list, tokens: list):
+        matched = 0
+        wildcards = 0
+        wildcard = self.wildcard
+        for template_token, token in zip(template_tokens, tokens):
+            if template_token == wildcard:
+                wildcards += 1
+            elif template_token == token:
+                matched += 1
+        return matched / len(tokens), wildcards
+
+    def _best_cluster(self, leaf: _Node, tokens: list):
+        best = None
+        best_score = (-1.0, -1)
+        for cluster in leaf.clusters:
+            score = self._similarity(cluster.tokens, tokens)
+            if score > best_score:
+                best, best_score = cluster, score
+        if best is not None and best_score[0] >= self.similarity_threshold:
+            return best
+        return None
+
+    def add_message(self, message: str, group=None) -> (LogCluster, bool):
+        """
+        Assigns a message to a cluster, creating one if nothing is similar enough.
+        Returns the cluster and whether its template changed (including creation).
+        """
+        tokens = message.split()
+        if not tokens:
+            tokens = ['']
+
+        leaf = self._leaf(tokens, group, create=False)
+        cluster = self._best_cluster(leaf, tokens) if leaf is not None else None
+
+        if cluster is not None:
+            wildcard = self.wildcard
+            changed = False
+            template_tokens = cluster.tokens
+            for i, token in enumerate(tokens):
+                if template_tokens[i] != token and template_tokens[i] != wildcard:
+                    template_tokens[i] = wildcard
+                    changed = True
+            cluster.size += 1
+            self.clusters.move_to_end(cluster.cluster_id)
+            return cluster, changed
+
+        return self._new_cluster(tokens, group), True
+
+    def add_template(self, template: str, group=None, size=1) -> LogCluster:
+        """
+        Adds a cluster for an already mined template (e.g. one restored from
+        disk) without matching it against the existing clusters.
+        """
+        cluster = self._new_cluster(template.split() or [''], group)
+        cluster.size = size
+        return cluster
+
+    def _new_cluster(self, tokens: list, group) -> LogCluster:
+        leaf = self._leaf(tokens, group, create=True)
+        self.cluster_id_counter += 1
+        cluster = LogCluster(self.cluster_id_counter, tokens, leaf)
+        leaf.clusters.append(cluster)
+        self.clusters[cluster.cluster_id] = cluster
+        if self.max_clusters is not None and len(self.clusters) > self.max_clusters:
+            self._evict_oldest()
+        return cluster
+
+    def _evict_oldest(self):
+        _, cluster = self.clusters.popitem(last=False)
+        cluster.leaf.clusters.remove(cluster)
+        self.evicted_count += 1
@@ -0,0 +1,409 @@
+import atexit
+import json
+import os
+import struct
+import threading
+import zlib
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+
+class TemplateStore:
+    """
+    Compact, hash-indexed storage for log templates.
+
+    Templates are addressed by an integer slot. A per-service dict maps
+    each template to its slot, and per-template statistics live in
+    parallel typed arrays instead of one dict per template. Timestamps are
+    kept as float epoch seconds.
+
+    After load_columns the per-service index is built lazily, on the first
+    lookup for that service, so a large store restores without hashing
+    every template up front.
+
+    Renaming a slot to a template another slot of the service already has
+    merges the two: the lower (older) slot owns the template from then on,
+    and the other is retired as its alias, keeping the same text through
+    later renames so the merge survives a reload.
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._unindexed = {}
+        # Owning slot -> slots merged into it.
+        self._aliases = {}
+        self.pattern_ids = []
+        self.template_strings = []
+        self.service_names = []
+        self.counts = array('q')
+        self.first_seen = array('d')
+        self.last_seen = array('d')
+        # Called with the slot whenever a template is renamed.
+        self.on_rename = None
+
+    def __len__(self):
+        return len(self.pattern_ids)
+
+    def _service_index(self, service_name: str) -> dict:
+        index = self._index.get(service_name)
+        if index is None:
+            slots = self._unindexed.pop(service_name, None)
+            if slots is None:
+                index = {}
+            else:
+                templates = self.template_strings
+                slots = slots.tolist()
+                index = dict(zip([templates[slot] for slot in slots], slots))
+                if len(index) < len(slots):
+                    # Merged slots share a template; the lowest one owns it.
+                    index = {}
+                    for slot in slots:
+                        owner = index.setdefault(templates[slot], slot)
+                        if owner != slot:
+                            self._aliases.setdefault(owner, []).append(slot)
+            self._index[service_name] = index
+        return index
+
+    def lookup(self, service_name: str, template: str):
+        """Returns the slot for (service_name, template), or None."""
+        index = self._index.get(service_name)
+        if index is None:
+            index = self._service_index(service_name)
+        return index.get(template)
+
+    def add(self, pattern_id: str, service_name: str, template: str, seen_at: float, count: int = 1) -> int:
+        """Creates a new template and returns its slot."""
+        slot = len(self.pattern_ids)
+        owner = self._service_index(service_name).setdefault(template, slot)
+        if owner != slot:
+            # Only when restoring a merged slot; see rename().
+            self._aliases.setdefault(owner, []).append(slot)
+        self.pattern_ids.append(pattern_id)
+        self.template_strings.append(template)
+        self.service_names.append(service_name)
+        self.counts.append(count)
+        self.first_seen.append(seen_at)
+        self.last_seen.append(seen_at)
+        return slot
+
+    def rename(self, slot: int, template: str) -> int:
+        """
+        Replaces the template text of `slot`, keeping its pattern ID, and
+        returns the slot that owns `template` afterwards: `slot` itself, or
+        the lower of the two if another slot already had the template.
+        """
+        index = self._service_index(self.service_names[slot])
+        old_template = self.template_strings[slot]
+        if index.get(old_template) == slot:
+            del index[old_template]
+        owner = index.get(template)
+        if owner is None or owner == slot:
+            owner = slot
+        else:
+            owner, retired = min(owner, slot), max(owner, slot)
+            merged = self._aliases.setdefault(owner, [])
+            merged.append(retired)
+            merged.extend(self._aliases.pop(retired, ()))
+        index[template] = owner
+        for renamed in [owner] + self._aliases.get(owner, []):
+            if self.template_strings[renamed] != template:
+                self.template_strings[renamed] = template
+                if self.on_rename is not None:
+                    self.on_rename(renamed)
+        return owner
+
+    def touch(self, slot: int, seen_at: float, count: int = 1):
+        """Records `count` more occurrences of the template in `slot`."""
+        self.counts[slot] += count
+        if seen_at > self.last_seen[slot]:
+            self.last_seen[slot] = seen_at
+
+    def as_dict(self, slot: int) -> dict:
+        return {
+            'template': self.template_strings[slot],
+            'count': self.counts[slot],
+            'first_seen': datetime.fromtimestamp(self.first_seen[slot]),
+            'last_seen': datetime.fromtimestamp(self.last_seen[slot]),
+            'service_name': self.service_names[slot]
+        }
+
+    def items(self):
+        """Yields (pattern_id, stats dict) pairs in creation order."""
+        for slot, pattern_id in enumerate(self.pattern_ids):
+            yield pattern_id, self.as_dict(slot)
+
+    def load_columns(self, pattern_ids, service_table, service_codes, template_strings, counts, first_seen, last_seen):
+        """
+        Replaces the contents of an empty store with pre-built columns.
+        Service names are given dictionary-encoded: service_table[service_codes[slot]].
+        """
+        if self.pattern_ids:
+            raise ValueError("load_columns requires an empty store")
+        codes = np.asarray(service_codes)
+        self.pattern_ids = pattern_ids
+        self.service_names = [service_table[code] for code in codes.tolist()]
+        self.template_strings = template_strings
+        self.counts = counts
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self._index = {}
+        order = np.argsort(codes, kind='stable')
+        groups = np.split(order, np.cumsum(np.bincount(codes, minlength=len(service_table)))[:-1])
+        self._unindexed = {service_table[code]: slots for code, slots in enumerate(groups) if len(slots)}
+
+
+_SNAPSHOT_MAGIC = b'LTPLSNP1'
+_JOURNAL_MAGIC = b'LTPLJRN1'
+_HEADER = struct.Struct('<8sQQ')
+_BATCH_HEADER = struct.Struct('<II')
+_UPDATES_HEADER = struct.Struct('<II')
+
+
+def _pack_strings(strings) -> bytes:
+    # NUL-joined text splits back fastest; strings that contain NUL fall
+    # back to an explicit offsets table.
+    if '\x00' not in ''.join(strings):
+        blob = '\x00'.join(strings).encode('utf-8', 'surrogatepass')
+        return struct.pack('<BQQ', 0, len(strings), len(blob)) + blob
+    offsets = array('q', [0])
+    total = 0
+    for string in strings:
+        total += len(string)
+        offsets.append(total)
+    blob = ''.join(strings).encode('utf-8', 'surrogatepass')
+    return struct.pack('<BQQ', 1, len(strings), len(blob)) + offsets.tobytes() + blob
+
+
+def _unpack_strings(data: memoryview, position: int):
+    mode, count, size = struct.unpack_from('<BQQ', data, position)
+    position += 17
+    if mode == 0:
+        text = bytes(data[position:position + size]).decode('utf-8', 'surrogatepass')
+        return (text.split('\x00') if count else []), position + size
+    offsets = np.frombuffer(data, dtype=np.int64, count=count + 1, offset=position).tolist()
+    position += (count + 1) * 8
+    text = bytes(data[position:position + size]).decode('utf-8', 'surrogatepass')
+    return [text[start:end] for start, end in zip(offsets, offsets[1:])], position + size
+
+
+class TemplateJournal:
+    """
+    Crash-safe persistence for a TemplateStore.
+
+    The store lives in two files: a binary snapshot at `path` and an
+    append-only journal at `path + '.journal'`. A background thread wakes
+    every `flush_interval` seconds, diffs the store's count and last_seen
+    columns against what it last wrote, and appends one CRC-checked batch
+    holding the new templates, renames and current values of every changed
+    slot. The hot path never touches the disk.
+
+    Once the journal grows past `compact_bytes` it is folded into a new
+    snapshot. Both files carry a generation number, so a crash between
+    writing the snapshot and resetting the journal cannot replay stale
+    records. On load, a torn batch at the end of the journal is discarded.
+    The files are not locked, so each path needs its own process.
+    """
+
+    def __init__(self, path: str, store: TemplateStore, flush_interval=1.0, compact_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.store = store
+        self.flush_interval = flush_interval
+        self.compact_bytes = compact_bytes
+        self.generation = 0
+        self._persisted_len = 0
+        self._persisted_counts = np.zeros(0, dtype=np.int64)
+        self._persisted_last_seen = np.zeros(0, dtype=np.float64)
+        self._renamed = []
+        self._journal = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        store.on_rename = self._renamed.append
+
+    def load(self):
+        """Fills the (empty) store from the snapshot and journal on disk."""
+        if os.path.exists(self.path):
+            self._read_snapshot()
+        journal_generation = None
+        good_size = 0
+        if os.path.exists(self.journal_path):
+            journal_generation, good_size = self._replay_journal()
+        # Renames replayed from the journal are already on disk.
+        del self._renamed[:]
+        self._persisted_len = len(self.store)
+        self._persisted_counts = np.array(self.store.counts, dtype=np.int64)
+        self._persisted_last_seen = np.array(self.store.last_seen, dtype=np.float64)
+        if journal_generation == self.generation:
+            self._journal = open(self.journal_path, 'r+b')
+            self._journal.truncate(good_size)
+            self._journal.seek(good_size)
+        else:
+            self._reset_journal()
+
+    def _read_snapshot(self):
+        with open(self.path, 'rb') as f:
+            data = memoryview(f.read())
+        magic, self.generation, count = _HEADER.unpack_from(data, 0)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{self.path} is not a template snapshot")
+        position = _HEADER.size
+        columns = []
+        for typecode in ('q', 'd', 'd', 'I'):
+            column = array(typecode)
+            column.frombytes(data[position:position + count * column.itemsize])
+            position += count * column.itemsize
+            columns.append(column)
+        counts, first_seen, last_seen, service_codes = columns
+        service_table, position = _unpack_strings(data, position)
+        pattern_ids, position = _unpack_strings(data, position)
+        template_strings, position = _unpack_strings(data, position)
+        self.store.load_columns(pattern_ids, service_table, np.frombuffer(service_codes, dtype=np.uint32),
+                                template_strings, counts, first_seen, last_seen)
+
+    def _replay_journal(self):
+        with open(self.journal_path, 'rb') as f:
+            data = memoryview(f.read())
+        if len(data) < _HEADER.size:
+            return None, 0
+        magic, generation, _ = _HEADER.unpack_from(data, 0)
+        if magic != _JOURNAL_MAGIC or generation != self.generation:
+            return None, 0
+        position = _HEADER.size
+        while position + _BATCH_HEADER.size <= len(data):
+            size, checksum = _BATCH_HEADER.unpack_from(data, position)
+            start = position + _BATCH_HEADER.size
+            payload = data[start:start + size]
+            if len(payload) < size or zlib.crc32(payload) != checksum:
+                break
+            self._apply_batch(payload)
+            position = start + size
+        return generation, position
+
+    def _apply_batch(self, payload: memoryview):
+        store = self.store
+        meta_size, update_count = _UPDATES_HEADER.unpack_from(payload, 0)
+        position = _UPDATES_HEADER.size
+        meta = json.loads(bytes(payload[position:position + meta_size]))
+        position += meta_size
+        for slot, pattern_id, service_name, template, first_seen in meta['created']:
+            if slot == len(store):
+                store.add(pattern_id, service_name, template, first_seen, count=0)
+        for slot, template in meta['renamed']:
+            if slot < len(store):
+                store.rename(slot, template)
+        slots = np.frombuffer(payload, dtype=np.uint32, count=update_count, offset=position)
+        position += update_count * 4
+        counts = np.frombuffer(payload, dtype=np.int64, count=update_count, offset=position)
+        position += update_count * 8
+        last_seen = np.frombuffer(payload, dtype=np.float64, count=update_count, offset=position)
+        for slot, count, seen_at in zip(slots.tolist(), counts.tolist(), last_seen.tolist()):
+            if slot < len(store):
+                store.counts[slot] = count
+                store.last_seen[slot] = seen_at
+
+    def _reset_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'wb')
+        self._journal.write(_HEADER.pack(_JOURNAL_MAGIC, self.generation, 0))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def start(self):
+        """Starts the background flush thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='template-journal', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self, compact=False):
+        """Appends everything changed since the last flush to the journal."""
+        with self._lock:
+            if self._journal is None:
+                return
+            store = self.store
+            # add() appends last_seen last, so every column holds at least
+            # `count` entries. tobytes() copies each column in one call, so
+            # the hot path can keep appending while the diff is computed.
+            count = len(store.last_seen)
+            counts = np.frombuffer(store.counts.tobytes(), dtype=np.int64)[:count]
+            last_seen = np.frombuffer(store.last_seen.tobytes(), dtype=np.float64)[:count]
+            previous = self._persisted_len
+
+            renamed_count = len(self._renamed)
+            renamed = sorted(set(self._renamed[:renamed_count]))
+            del self._renamed[:renamed_count]
+
+            if not compact:
+                changed = np.flatnonzero((counts[:previous] != self._persisted_counts) |
+                                         (last_seen[:previous] != self._persisted_last_seen))
+                slots = np.concatenate([changed, np.arange(previous, count)]).astype(np.uint32)
+                if len(slots) or renamed:
+                    self._append_batch(previous, count, slots, counts, last_seen, renamed)
+
+            self._persisted_len = count
+            self._persisted_counts = counts
+            self._persisted_last_seen = last_seen
+            # A snapshot supersedes the journal, so a requested compaction
+            # skips writing the batch altogether.
+            if compact or self._journal.tell() > self.compact_bytes:
+                self._compact(count)
+
+    def _append_batch(self, previous, count, slots, counts, last_seen, renamed):
+        store = self.store
+        meta = json.dumps({
+            'created': [[slot, store.pattern_ids[slot], store.service_names[slot],
+                         store.template_strings[slot], store.first_seen[slot]]
+                        for slot in range(previous, count)],
+            'renamed': [[slot, store.template_strings[slot]] for slot in renamed if slot < previous],
+        }).encode('utf-8', 'surrogatepass')
+        payload = b''.join([
+            _UPDATES_HEADER.pack(len(meta), len(slots)), meta, slots.tobytes(),
+            counts[slots].tobytes(), last_seen[slots].tobytes(),
+        ])
+        self._journal.write(_BATCH_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _compact(self, count: int):
+        store = self.store
+        service_table = {}
+        service_codes = array('I', [service_table.setdefault(name, len(service_table))
+                                    for name in store.service_names[:count]])
+        self.generation += 1
+        columns = [
+            _HEADER.pack(_SNAPSHOT_MAGIC, self.generation, count),
+            self._persisted_counts.tobytes(),
+            np.frombuffer(store.first_seen.tobytes(), dtype=np.float64)[:count].tobytes(),
+            self._persisted_last_seen.tobytes(),
+            service_codes.tobytes(),
+            _pack_strings(list(service_table)),
+            _pack_strings(store.pattern_ids[:count]),
+            _pack_strings(store.template_strings[:count]),
+        ]
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.writelines(columns)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._reset_journal()
+
+    def close(self):
+        """Stops the flush thread and folds the journal into a fresh snapshot."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush(compact=True)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from alert_delivery import AlertDelivery, Destination
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Records each POSTed body with its arrival time; answers with the next queued status, else 200."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+            self.server.received.append((time.monotonic(), status, body))
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    server.lock = threading.Lock()
+    server.statuses = []
+    server.received = []
+    server.url = f"http://127.0.0.1:{server.server_port}/hook"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class _PerAlertDestination(Destination):
+    """Like PagerDuty: every message of a batch is its own request."""
+
+    def payloads(self, messages: list) -> list:
+        return messages
+
+
+def _accepted(server) -> list:
+    return [body for _, status, body in server.received if status < 300]
+
+
+def test_failed_batch_is_retried_after_a_server_error(server):
+    server.statuses = [503, 500]
+    delivery = AlertDelivery([Destination('hook', server.url)], coalesce_seconds=0, backoff_base=0.01)
+    delivery.submit({'alert_id': 'A1'})
+    assert delivery.flush(timeout=10)
+    delivery.close()
+    assert [status for _, status, _ in server.received] == [503, 500, 200]
+    assert _accepted(server) == [{'alerts': [{'alert_id': 'A1'}]}]
+    assert delivery.stats()['failed_attempts'] == 2
+    assert delivery.stats()['delivered'] == 1
+
+
+def test_alerts_within_the_coalesce_window_share_one_request(server):
+    delivery = AlertDelivery([Destination('hook', server.url)], coalesce_seconds=0.5)
+    for i in range(5):
+        delivery.submit({'alert_id': f"A{i}"})
+    assert delivery.flush(timeout=10)
+    delivery.close()
+    assert _accepted(server) == [{'alerts': [{'alert_id': f"A{i}"} for i in range(5)]}]
+    assert delivery.stats()['batches_sent'] == 1
+
+
+def test_rate_limit_counts_every_request_of_a_batch(server):
+    # 600/minute is 10 requests a second with a burst of 10, so 20 single-alert
+    # requests cannot all go out in less than a second.
+    delivery = AlertDelivery([_PerAlertDestination('hook', server.url, rate_per_minute=600)], coalesce_seconds=0)
+    for i in range(20):
+        delivery.submit({'alert_id': f"A{i}"})
+    assert delivery.flush(timeout=10)
+    delivery.close()
+    times = [arrived for arrived, _, _ in server.received]
+    assert len(times) == 20
+    assert times[-1] - times[0] >= 0.9
+    assert sum(1 for arrived in times if arrived - times[0] < 0.5) <= 16
+    assert [body['alert_id'] for body in _accepted(server)] == [f"A{i}" for i in range(20)]
+
+
+def test_outbox_is_replayed_after_a_restart(server, tmp_path):
+    outbox = str(tmp_path / 'alerts.outbox')
+    # Nothing listens on the discard port; the alerts stay queued until this instance is abandoned.
+    down = AlertDelivery([Destination('hook', 'http://127.0.0.1:9/unreachable')], outbox_path=outbox,
+                         coalesce_seconds=60, max_attempts=1_000, backoff_base=60)
+    for i in range(3):
+        down.submit({'alert_id': f"A{i}"})
+    down.close(timeout=0)
+
+    restarted = AlertDelivery([Destination('hook', server.url)], outbox_path=outbox, coalesce_seconds=0)
+    assert restarted.flush(timeout=10)
+    restarted.close()
+    assert [alert['alert_id'] for body in _accepted(server) for alert in body['alerts']] == ['A0', 'A1', 'A2']
+
+    # Delivered alerts are marked done, so a further restart sends nothing.
+    again = AlertDelivery([Destination('hook', server.url)], outbox_path=outbox, coalesce_seconds=0)
+    assert again.pending() == 0
+    again.close()
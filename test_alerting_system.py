@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from alerting_system import AlertingSystem, DedupeCache
+
+START = datetime(2025, 7, 4, 12, 0)
+
+
+def _incident(alert_id):
+    return {'alert_id': alert_id, 'timestamp': START, 'severity': 'HIGH', 'rule_name': 'disk',
+            'component_s_affected': ['web']}
+
+
+def test_dedupe_cache_clamps_time_that_goes_backwards():
+    cache = DedupeCache(ttl_seconds=60)
+    assert cache.check('f', {}, START + timedelta(seconds=30))
+    # An earlier `now` counts as the latest seen, so the entry still expires in insertion order.
+    assert cache.check('g', {}, START)
+    assert cache.now == START + timedelta(seconds=30)
+    assert cache.expire(START + timedelta(seconds=89)) == []
+    assert len(cache) == 2
+    cache.expire(START + timedelta(seconds=90))
+    assert len(cache) == 0
+
+
+def test_rollups_are_sent_by_tick_and_on_close():
+    alerting = AlertingSystem(dedupe_seconds=60)
+    for i in range(3):
+        alerting.send_alert(_incident(f"A{i}"), now=START + timedelta(seconds=i))
+    assert alerting.stats()['suppressed'] == 2
+    alerting.tick(START + timedelta(seconds=61))
+    assert alerting.rollups_sent == 1
+
+    alerting.send_alert(_incident('B0'), now=START + timedelta(seconds=70))
+    alerting.send_alert(_incident('B1'), now=START + timedelta(seconds=71))
+    alerting.close()
+    assert alerting.rollups_sent == 2
+    assert alerting.stats()['dedupe_entries'] == 0
+
+
+def test_dedupe_cache_evicts_only_when_inserting():
+    cache = DedupeCache(ttl_seconds=60, max_entries=2)
+    assert cache.check('f', {'alert_id': 'F'}, START)
+    assert cache.check('g', {}, START)
+    assert not cache.check('f', {'alert_id': 'F'}, START)
+    # A full cache keeps its entries through ticks that insert nothing.
+    assert cache.expire(START + timedelta(seconds=10)) == []
+    assert len(cache) == 2
+    assert cache.evicted == 0
+
+    assert cache.check('h', {}, START + timedelta(seconds=20))
+    assert 'f' not in cache and len(cache) == 2
+    assert cache.evicted == 1
+    # The evicted entry had a suppressed duplicate, so the next expire rolls it up.
+    assert [entry['alert']['alert_id'] for entry in cache.expire(START + timedelta(seconds=21))] == ['F']
+    assert cache.expire(START + timedelta(seconds=22)) == []
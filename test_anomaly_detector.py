@@ -0,0 +1,321 @@
+import random
+from collections import defaultdict, deque
+
+import numpy as np
+
+from anomaly_detector import AnomalyDetector
+
+
+class _BaselineDetector:
+    """The deque-per-key detector AnomalyDetector replaced, kept as a reference."""
+
+    def __init__(self, window_size=60, z_score_threshold=3.0, history_size=1000):
+        self.metrics_history = defaultdict(lambda: deque(maxlen=history_size))
+        self.window_size = window_size
+        self.z_score_threshold = z_score_threshold
+        self.current_window_counts = defaultdict(int)
+
+    def detect_anomalies_in_window(self) -> list:
+        anomalies = []
+        for key, current_count in self.current_window_counts.items():
+            history = self.metrics_history[key]
+            history.append(current_count)
+            if len(history) >= self.window_size:
+                mean = np.mean(list(history)[-self.window_size:])
+                std_dev = np.std(list(history)[-self.window_size:])
+                if std_dev == 0:
+                    if current_count > mean and mean > 0:
+                        anomalies.append({'type': 'Frequency Spike', 'key': key, 'current_count': current_count,
+                                          'baseline_mean': mean,
+                                          'severity': 'Medium' if current_count > mean * 2 else 'Low'})
+                    continue
+                z_score = (current_count - mean) / std_dev
+                if abs(z_score) > self.z_score_threshold:
+                    anomalies.append({
+                        'type': "High Frequency" if z_score > 0 else "Low Frequency", 'key': key,
+                        'current_count': current_count, 'baseline_mean': mean, 'z_score': z_score,
+                        'severity': 'High' if abs(z_score) > self.z_score_threshold * 1.5 else 'Medium'})
+        self.current_window_counts.clear()
+        return anomalies
+
+
+def _summary(anomalies):
+    return sorted((a['key'], a['type'], a['severity'], a['current_count'], round(float(a['baseline_mean']), 9),
+                   round(float(a.get('z_score', 0.0)), 9)) for a in anomalies)
+
+
+def _tick(detector, counts):
+    for key, count in counts.items():
+        detector.update_counts({'service_name': key[0], 'log_level': key[1], 'pattern_id': key[2]}) \
+            if count == 1 else detector.add_counts({key: count})
+    return detector.detect_anomalies_in_window()
+
+
+def test_matches_the_baseline_detector_on_a_fixed_stream():
+    rng = random.Random(7)
+    keys = [(f"svc-{i}", 'ERROR' if i % 2 else 'INFO', f"P{i}") for i in range(6)]
+    # With the current count inside the window, |z| cannot exceed (n - 1) / sqrt(n),
+    # so n = 20 is needed to get past the default threshold of 3.
+    baseline = _BaselineDetector(window_size=20)
+    detector = AnomalyDetector(window_size=20)
+    found = 0
+    for tick in range(80):
+        counts = {}
+        for i, key in enumerate(keys):
+            # Key 0 is constant with an occasional spike; the rest are noisy
+            # with bursts and dips. Every key has events every tick, which is
+            # all the baseline could evaluate.
+            if i == 0:
+                counts[key] = 5 if tick % 25 else 12
+            else:
+                count = rng.randint(20, 30)
+                if rng.random() < 0.05:
+                    count = rng.choice([1, 2, 200])
+                counts[key] = count
+        for key, count in counts.items():
+            baseline.current_window_counts[key] += count
+        expected = baseline.detect_anomalies_in_window()
+        actual = _tick(detector, counts)
+        assert _summary(actual) == _summary(expected), f"tick {tick}"
+        found += len(expected)
+    assert found >= 5, found
+
+
+def test_silence_fires_once_and_clears_when_traffic_returns():
+    key = ('web', 'INFO', 'P1')
+    detector = AnomalyDetector(window_size=5)
+    for _ in range(5):
+        assert _tick(detector, {key: 10}) == []
+    silence = _tick(detector, {})
+    assert [(a['type'], a['key'], a['severity'], a['baseline_mean']) for a in silence] == [
+        ('Silence', key, 'High', 10.0)]
+    # Still quiet: the window is no longer steady, so it is not reported again.
+    assert _tick(detector, {}) == []
+    assert all(a['type'] != 'Silence' for tick in range(5) for a in _tick(detector, {key: 10}))
+
+
+def _live_keys(detector):
+    return sorted(key[2] for key in detector._rows)
+
+
+def test_least_recently_active_keys_are_evicted_beyond_max_keys():
+    detector = AnomalyDetector(window_size=5, max_keys=3)
+    key = lambda name: ('web', 'INFO', name)
+    for names in (['A', 'B'], ['A', 'C'], ['A', 'D']):
+        _tick(detector, {key(name): 1 for name in names})
+    # B was last active on tick 1, the longest ago.
+    assert _live_keys(detector) == ['A', 'C', 'D']
+    _tick(detector, {key('A'): 1, key('E'): 1})
+    assert _live_keys(detector) == ['A', 'D', 'E']
+    stats = detector.stats()
+    assert (stats['keys'], stats['evicted_lru'], stats['evicted_idle']) == (3, 2, 0)
+    assert detector.get_history(key('B')) == []
+
+
+def test_equally_recent_keys_evict_the_shortest_history_first():
+    detector = AnomalyDetector(window_size=5, max_keys=2)
+    key = lambda name: ('web', 'INFO', name)
+    _tick(detector, {key('A'): 1})
+    _tick(detector, {key('A'): 1, key('B'): 1})
+    _tick(detector, {key('A'): 1, key('B'): 1, key('C'): 1})
+    assert _live_keys(detector) == ['A', 'B']
+    assert detector.stats()['evicted_lru'] == 1
+
+
+def test_idle_keys_are_evicted_after_idle_ttl_and_their_rows_reused():
+    detector = AnomalyDetector(window_size=5, idle_ttl=2)
+    a, b = ('web', 'INFO', 'A'), ('web', 'INFO', 'B')
+    _tick(detector, {a: 1, b: 1})
+    _tick(detector, {a: 1})
+    _tick(detector, {a: 1})
+    assert _live_keys(detector) == ['A', 'B']
+    _tick(detector, {a: 1})
+    assert _live_keys(detector) == ['A']
+    assert detector.stats()['evicted_idle'] == 1
+    row = detector._free_rows[-1]
+    _tick(detector, {a: 1, ('web', 'INFO', 'C'): 1})
+    assert detector._rows[('web', 'INFO', 'C')] == row
+    assert detector.get_history(('web', 'INFO', 'C')) == [1]
+
+
+def test_memory_budget_caps_the_tracked_keys():
+    probe = AnomalyDetector(window_size=5)
+    detector = AnomalyDetector(window_size=5, memory_budget_bytes=10 * probe.bytes_per_key)
+    assert detector.max_keys == 10
+    for tick in range(3):
+        _tick(detector, {('web', 'INFO', f"T{tick}-{i}"): 1 for i in range(50)})
+        stats = detector.stats()
+        assert stats['keys'] == 10
+        assert stats['bytes'] <= 10 * probe.bytes_per_key
+    assert detector.stats()['evicted_lru'] == 140
+    # The survivors are the newest tick's keys.
+    assert all(name.startswith('T2-') for name in _live_keys(detector))
+
+
+BASE = 1_750_000_020  # a multiple of 60, so panes line up with minutes
+
+
+def _event(seconds, pattern_id='A', service='web', level='INFO'):
+    return {'timestamp': BASE + seconds, 'service_name': service, 'log_level': level, 'pattern_id': pattern_id}
+
+
+def _feed(detector, seconds_list, pattern_id='A'):
+    anomalies = []
+    for seconds in seconds_list:
+        anomalies.extend(detector.update_counts(_event(seconds, pattern_id)))
+    return anomalies
+
+
+def test_tumbling_windows_close_on_the_watermark():
+    detector = AnomalyDetector(window_size=3, window_seconds=60)
+    key = ('web', 'INFO', 'A')
+    _feed(detector, [0, 10, 20, 61])
+    assert detector.get_history(key) == [3]
+    _feed(detector, [62, 125])
+    assert detector.get_history(key) == [3, 2]
+    assert detector.flush() == []
+    assert detector.get_history(key) == [3, 2, 1]
+    assert detector.stats()['windows_emitted'] == 3
+
+
+def test_sliding_windows_share_their_panes():
+    detector = AnomalyDetector(window_size=5, window_seconds=120, slide_seconds=60)
+    key = ('web', 'INFO', 'A')
+    _feed(detector, [0, 60, 61, 120, 121, 122])
+    assert detector.get_history(key) == [1 + 2]
+    _feed(detector, [180])
+    assert detector.get_history(key) == [1 + 2, 2 + 3]
+    detector.flush()
+    assert detector.get_history(key) == [1 + 2, 2 + 3, 3 + 1, 1]
+
+
+def test_late_event_within_the_allowed_lateness_is_counted():
+    detector = AnomalyDetector(window_size=3, window_seconds=60, allowed_lateness=30)
+    key = ('web', 'INFO', 'A')
+    _feed(detector, [0, 70])
+    assert detector.watermark == BASE + 40
+    assert detector.get_history(key) == []
+    _feed(detector, [50, 95])
+    assert detector.get_history(key) == [2]
+    assert detector.late_events_dropped == 0
+
+
+def test_late_event_past_the_allowed_lateness_is_dropped_and_counted():
+    detector = AnomalyDetector(window_size=3, window_seconds=60, allowed_lateness=30)
+    key = ('web', 'INFO', 'A')
+    _feed(detector, [0, 50, 70, 95])
+    _feed(detector, [20])
+    assert detector.late_events_dropped == 1
+    assert detector.stats()['late_events_dropped'] == 1
+    detector.flush()
+    assert detector.get_history(key) == [2, 2]
+
+
+def test_flush_closes_every_window_still_holding_events():
+    detector = AnomalyDetector(window_size=3, window_seconds=60, allowed_lateness=600)
+    key = ('web', 'INFO', 'A')
+    _feed(detector, [0, 1, 70, 130, 131, 132])
+    assert detector.get_history(key) == []
+    detector.flush()
+    assert detector.get_history(key) == [2, 1, 3]
+    assert detector.flush() == []
+
+
+def _shuffled_stream(seed=3, minutes=40):
+    rng = random.Random(seed)
+    events = []
+    for minute in range(minutes):
+        for i, pattern_id in enumerate(('A', 'B', 'C')):
+            count = 30 + rng.randint(-3, 3)
+            if pattern_id == 'B' and minute in (25, 33):
+                count *= 4
+            if pattern_id == 'C' and minute >= 30:
+                count = 0
+            events.extend(_event(minute * 60 + rng.uniform(0, 60), pattern_id,
+                                 level='ERROR' if i == 2 else 'INFO') for _ in range(count))
+    # Out of order by up to 2.5 minutes, so some events land past the lateness bound.
+    events.sort(key=lambda event: event['timestamp'] + rng.uniform(0, 150))
+    return events
+
+
+def _event_time_summary(anomalies):
+    return sorted((a['window_end'], a['key'], a['type'], a['current_count'], round(a['baseline_mean'], 9),
+                   round(a.get('z_score', 0.0), 9)) for a in anomalies)
+
+
+def test_batch_counting_matches_per_event_counting_on_shuffled_input():
+    from event_batch import EventBatch
+
+    events = _shuffled_stream()
+    options = dict(window_size=20, window_seconds=120, slide_seconds=60, allowed_lateness=15)
+    one_by_one = AnomalyDetector(**options)
+    batched = AnomalyDetector(**options)
+    expected = []
+    for event in events:
+        expected.extend(one_by_one.update_counts(event))
+    expected.extend(one_by_one.flush())
+    actual = []
+    for start in range(0, len(events), 97):
+        actual.extend(batched.update_counts(EventBatch.from_events(events[start:start + 97])))
+    actual.extend(batched.flush())
+
+    assert one_by_one.late_events_dropped > 0
+    assert batched.late_events_dropped == one_by_one.late_events_dropped
+    assert {a['type'] for a in expected} >= {'High Frequency', 'Silence'}
+    assert _event_time_summary(actual) == _event_time_summary(expected)
+    for key in one_by_one._rows:
+        assert batched.get_history(key) == one_by_one.get_history(key)
+
+
+def test_approximate_sliding_window_holds_one_count_min_table_for_quiet_panes():
+    from sketches import CountMinSketch
+
+    table = CountMinSketch.from_error(0.0001, 0.001)
+    table_bytes = table.width * table.depth * 8
+    detector = AnomalyDetector(window_size=5, window_seconds=600, slide_seconds=60, approximate=True)
+    peak = 0
+    for seconds in range(0, 1800, 5):
+        detector.update_counts(_event(seconds, f"P{seconds % 7}"))
+        peak = max(peak, detector.stats()['sketch_bytes'])
+    # Ten open panes, but only the window's own table is dense.
+    assert table_bytes <= peak < 1.5 * table_bytes
+
+
+def test_approximate_mode_matches_exact_mode_on_a_sliding_window():
+    events = _shuffled_stream()
+    options = dict(window_size=20, window_seconds=120, slide_seconds=60, allowed_lateness=15)
+    exact = AnomalyDetector(**options)
+    approximate = AnomalyDetector(approximate=True, **options)
+    expected, found = [], []
+    for event in events:
+        expected.extend(exact.update_counts(dict(event)))
+        found.extend(approximate.update_counts(dict(event)))
+    expected.extend(exact.flush())
+    found.extend(approximate.flush())
+    assert expected
+    assert _event_time_summary(found) == _event_time_summary(expected)
+
+
+def test_batch_counting_matches_per_event_counting_per_tick():
+    from event_batch import EventBatch
+
+    rng = random.Random(9)
+    one_by_one = AnomalyDetector(window_size=20)
+    batched = AnomalyDetector(window_size=20)
+    expected, actual = [], []
+    for tick in range(40):
+        events = []
+        for pattern_id in ('A', 'B', 'C'):
+            count = 30 + rng.randint(-3, 3)
+            if pattern_id == 'B' and tick in (25, 33):
+                count *= 4
+            events.extend({'timestamp': BASE + tick, 'service_name': 'web', 'pattern_id': pattern_id,
+                           'log_level': rng.choice(['INFO', 'ERROR'])} for _ in range(count))
+        rng.shuffle(events)
+        for event in events:
+            one_by_one.update_counts(event)
+        batched.update_counts(EventBatch.from_events(events))
+        expected.extend(one_by_one.detect_anomalies_in_window())
+        actual.extend(batched.detect_anomalies_in_window())
+    assert expected
+    assert _summary(actual) == _summary(expected)
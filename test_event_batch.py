@@ -0,0 +1,48 @@
+import random
+from datetime import datetime, timedelta
+
+from event_batch import EventBatch
+
+
+def _events(count=500, seed=2):
+    rng = random.Random(seed)
+    start = datetime(2025, 7, 4, 12, 0)
+    return [{'timestamp': start + timedelta(seconds=rng.randrange(600)),
+             'service_name': rng.choice(['web', 'db', 'queue']),
+             'log_level': rng.choice(['INFO', 'WARN', 'ERROR']),
+             'message': f"request {rng.randrange(50)} done",
+             'pattern_id': rng.choice(['P1', 'P2', 'P3', 'P4']),
+             'template': None} for _ in range(count)]
+
+
+def test_key_codes_give_each_event_its_key():
+    events = _events()
+    for event in events:
+        event['template'] = f"template of {event['pattern_id']}"
+    batch = EventBatch.from_events(events)
+    keys, key_index = batch.key_codes()
+    assert len(set(keys)) == len(keys)
+    assert [keys[k] for k in key_index.tolist()] == \
+        [(e['service_name'], e['log_level'], e['pattern_id']) for e in events]
+
+
+def test_key_codes_without_patterns_use_none():
+    events = _events()
+    for event in events:
+        del event['pattern_id']
+    keys, key_index = EventBatch.from_events(events).key_codes()
+    assert [keys[k] for k in key_index.tolist()] == [(e['service_name'], e['log_level'], None) for e in events]
+
+
+def test_set_patterns_round_trips_through_to_events():
+    events = _events()
+    batch = EventBatch.from_events([dict(event, pattern_id=None) for event in events])
+    assert batch.pattern_codes is None
+    pattern_ids = [event['pattern_id'] for event in events]
+    batch.set_patterns(pattern_ids, [f"template of {pattern_id}" for pattern_id in pattern_ids])
+    assert [batch.patterns[code] for code in batch.pattern_codes.tolist()] == pattern_ids
+    assert len(batch.patterns) == len(set(pattern_ids))
+    rebuilt = batch.to_events()
+    assert [(e['pattern_id'], e['template']) for e in rebuilt] == [(p, f"template of {p}") for p in pattern_ids]
+    assert [(e['timestamp'], e['service_name'], e['log_level'], e['message']) for e in rebuilt] == \
+        [(e['timestamp'], e['service_name'], e['log_level'], e['message']) for e in events]
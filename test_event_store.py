@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from event_batch import EventBatch
+from event_store import EventStore
+from log_patterns import LogPatternRecognizer
+
+
+def _events():
+    return [{'timestamp': datetime(2025, 7, 4, 12, 0, second), 'log_level': 'INFO', 'service_name': 'web',
+             'message': message}
+            for second, message in enumerate(['request 42 served', 'cache miss', 'request 43 served'])]
+
+
+def test_recognized_event_dicts_keep_their_patterns():
+    recognizer = LogPatternRecognizer(template_storage_path=None)
+    events = [recognizer.process_log_event(event) for event in _events()]
+    batch = EventBatch.from_events(events)
+    assert [event['pattern_id'] for event in batch.to_events()] == ['P1', 'P2', 'P1']
+    assert batch.templates == ['request <NUM> served', 'cache miss']
+    assert batch.params == [{'NUM': ['42']}, {}, {'NUM': ['43']}]
+
+
+def test_appended_event_dicts_round_trip_through_the_store(tmp_path):
+    recognizer = LogPatternRecognizer(template_storage_path=None)
+    store = EventStore(str(tmp_path))
+    store.append([recognizer.process_log_event(event) for event in _events()])
+    store.flush()
+    found = store.query(pattern_id='P1')
+    assert [(event['message'], event['params']) for event in found] == [
+        ('request 42 served', {'NUM': ['42']}), ('request 43 served', {'NUM': ['43']})]
+    assert [event['pattern_id'] for event in store.query()] == ['P1', 'P2', 'P1']
@@ -0,0 +1,184 @@
+import random
+from datetime import datetime, timedelta
+
+from incident_predictor import ALERT_COOLDOWN_SECONDS, IncidentPredictionEngine
+
+START = datetime(2024, 1, 1)
+SERVICES = [f"service-{i}" for i in range(8)]
+TYPES = ['Frequency Spike', 'High Frequency', 'Low Frequency', 'Silence']
+
+
+def _linear_scan(engine, now):
+    """The original rule x trigger x anomaly scan, as a reference."""
+    incidents = []
+    for rule in engine.incident_rules:
+        matched = []
+        for trigger in rule['trigger_patterns']:
+            for anomaly in engine.active_anomalies.values():
+                service_name, _, pattern_id = anomaly['key']
+                if trigger[0] == 'service_name' and service_name == trigger[1] and pattern_id and trigger[2] in pattern_id:
+                    matched.append(anomaly)
+                    break
+        for anomaly_type in rule.get('trigger_anomalies', []):
+            matched.extend(a for a in engine.active_anomalies.values() if a['type'] == anomaly_type)
+        if len(matched) < rule['min_concurrency']:
+            continue
+        if (now - min(m['timestamp'] for m in matched)).total_seconds() / 60 > rule['time_window_minutes']:
+            continue
+        incident_key = f"{rule['name']}-{matched[0]['key']}"
+        previous = engine.potential_incidents.get(incident_key)
+        if previous is None or (now - previous['last_alert_time']).total_seconds() > ALERT_COOLDOWN_SECONDS:
+            incidents.append({'rule_name': rule['name'], 'timestamp': now,
+                              'contextual_data': {'active_anomalies_matched': [m['key'] for m in matched]}})
+            engine.potential_incidents[incident_key] = {'last_alert_time': now}
+    return incidents
+
+
+def _rules(rng, count=60):
+    return [{
+        'name': f"rule-{i}",
+        'trigger_patterns': [('service_name', rng.choice(SERVICES), f"P{rng.randrange(6)}")
+                             for _ in range(rng.randint(1, 3))],
+        'trigger_anomalies': [rng.choice(TYPES)] if rng.random() < 0.1 else [],
+        'min_concurrency': rng.randint(1, 3),
+        'time_window_minutes': 10,
+        'severity': 'HIGH',
+        'predicted_impact': '',
+    } for i in range(count)]
+
+
+def _anomaly(rng, timestamp):
+    return {'type': rng.choice(TYPES), 'key': (rng.choice(SERVICES), 'ERROR', f"P{rng.randrange(12)}"),
+            'timestamp': timestamp}
+
+
+def _anomaly_id(anomaly):
+    return f"{anomaly['type']}-{anomaly['key']}-{anomaly['timestamp']}"
+
+
+def _summary(incidents):
+    return [(i['rule_name'], i['timestamp'], i['contextual_data']['active_anomalies_matched']) for i in incidents]
+
+
+def _run(engine, predict, seed=5, ticks=30):
+    """Churns anomalies that all stay inside the rule windows and collects the incidents."""
+    rng = random.Random(seed)
+    live = []
+    incidents = []
+    for tick in range(ticks):
+        now = START + timedelta(minutes=tick)
+        for anomaly in [a for a in live if now - a['timestamp'] > timedelta(minutes=5)]:
+            live.remove(anomaly)
+            engine.clear_resolved_anomaly(_anomaly_id(anomaly))
+        for _ in range(rng.randint(0, 6)):
+            anomaly = _anomaly(rng, now - timedelta(seconds=rng.randrange(60)))
+            live.append(anomaly)
+            engine.add_active_anomaly(anomaly)
+        incidents.extend(predict(engine, now))
+    return incidents
+
+
+def test_indexed_matching_gives_the_same_incidents_as_a_linear_scan():
+    indexed, scanned = IncidentPredictionEngine(), IncidentPredictionEngine()
+    for engine in (indexed, scanned):
+        engine.set_rules(_rules(random.Random(1)))
+    expected = _run(scanned, _linear_scan)
+    found = _run(indexed, lambda engine, now: engine.predict_incidents(now=now))
+    assert expected
+    assert _summary(found) == _summary(expected)
+
+
+def _db_rule(min_concurrency=2):
+    return {'name': 'DB', 'trigger_patterns': [('service_name', 'db', 'timeout')], 'trigger_anomalies': ['Silence'],
+            'min_concurrency': min_concurrency, 'time_window_minutes': 10, 'severity': 'HIGH', 'predicted_impact': ''}
+
+
+def test_set_rules_and_add_rule_rebuild_the_index():
+    engine = IncidentPredictionEngine()
+    engine.set_rules([_db_rule(min_concurrency=3)])
+    engine.add_active_anomaly({'type': 'High Frequency', 'key': ('db', 'ERROR', 'timeout-1'), 'timestamp': START})
+    engine.add_active_anomaly({'type': 'Silence', 'key': ('web', 'INFO', 'P1'), 'timestamp': START})
+    assert engine.predict_incidents(now=START) == []
+
+    engine.set_rules([_db_rule(min_concurrency=2)])
+    assert [i['rule_name'] for i in engine.predict_incidents(now=START)] == ['DB']
+
+    engine.add_rule(dict(_db_rule(), name='DB-2'))
+    assert [i['rule_name'] for i in engine.predict_incidents(now=START)] == ['DB-2']
+
+
+def _engine(window_minutes=10, **options):
+    engine = IncidentPredictionEngine(**options)
+    engine.set_rules([dict(_db_rule(), time_window_minutes=window_minutes)])
+    return engine
+
+
+def _db_anomaly(minutes, anomaly_type='High Frequency', pattern_id='timeout-1'):
+    return {'type': anomaly_type, 'key': ('db', 'ERROR', pattern_id), 'timestamp': START + timedelta(minutes=minutes)}
+
+
+def test_anomalies_leave_the_rule_window_and_expire_after_the_ttl():
+    engine = _engine()
+    engine.add_active_anomaly(_db_anomaly(0, 'Silence'))
+    engine.add_active_anomaly(_db_anomaly(8, 'Silence', 'P2'))
+    assert [i['rule_name'] for i in engine.predict_incidents(now=START + timedelta(minutes=9))] == ['DB']
+
+    # The first Silence is now older than the 10 minute window (and the default TTL).
+    assert engine.predict_incidents(now=START + timedelta(minutes=16)) == []
+    stats = engine.stats()
+    assert stats['active_anomalies'] == 1
+    assert stats['expired_anomalies'] == 1
+    assert stats['satisfied_rules'] == 0
+
+    engine.predict_incidents(now=START + timedelta(minutes=19))
+    assert engine.stats()['active_anomalies'] == 0
+    assert engine.stats()['expired_anomalies'] == 2
+
+
+def test_incident_cooldown_expires_and_the_incident_is_raised_again():
+    engine = _engine(window_minutes=60)
+    engine.add_active_anomaly(_db_anomaly(0))
+    engine.add_active_anomaly(_db_anomaly(0, 'Silence'))
+    first = START + timedelta(minutes=1)
+    assert len(engine.predict_incidents(now=first)) == 1
+    assert engine.predict_incidents(now=first + timedelta(seconds=ALERT_COOLDOWN_SECONDS)) == []
+
+    again = first + timedelta(seconds=ALERT_COOLDOWN_SECONDS + 1)
+    assert len(engine.predict_incidents(now=again)) == 1
+    assert engine.stats()['expired_incidents'] == 1
+    (entry,) = engine.potential_incidents.values()
+    assert entry['last_alert_time'] == again
+
+
+def test_incident_cooldown_is_forgotten_once_it_runs_out():
+    engine = _engine()
+    engine.add_active_anomaly(_db_anomaly(0))
+    engine.add_active_anomaly(_db_anomaly(0, 'Silence'))
+    assert len(engine.predict_incidents(now=START)) == 1
+    for anomaly_id in list(engine.active_anomalies):
+        engine.clear_resolved_anomaly(anomaly_id)
+    engine.predict_incidents(now=START + timedelta(seconds=ALERT_COOLDOWN_SECONDS + 1))
+    assert engine.potential_incidents == {}
+    assert engine.stats()['expired_incidents'] == 1
+
+
+def test_heap_entries_of_cleared_and_replaced_anomalies_are_skipped():
+    engine = _engine()
+    cleared = _db_anomaly(0, 'Silence', 'P1')
+    engine.add_active_anomaly(cleared)
+    engine.predict_incidents(now=START)
+    engine.clear_resolved_anomaly(_anomaly_id(cleared))
+
+    replaced = _db_anomaly(1)
+    engine.add_active_anomaly(replaced)
+    engine.predict_incidents(now=START + timedelta(minutes=1))
+    # Same id, so the replacement takes over; the first copy's heap entries are stale.
+    replacement = dict(replaced, severity='High')
+    engine.add_active_anomaly(replacement)
+    assert engine.active_anomalies[_anomaly_id(replaced)] is replacement
+
+    engine.predict_incidents(now=START + timedelta(minutes=30))
+    stats = engine.stats()
+    assert stats['active_anomalies'] == 0
+    assert stats['expired_anomalies'] == 1
+    assert stats['expiry_queue'] == 0
@@ -0,0 +1,106 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from log_parsers import LogParserRegistry, parse_simple_log
+from log_patterns import LogPatternRecognizer
+
+
+def test_simple_format():
+    event = LogParserRegistry().parse("2025-07-04 12:00:01 [ERROR] web - Disk full on /dev/sda")
+    # Same fields as parse_simple_log, which keeps the separator in the message.
+    assert event == parse_simple_log("2025-07-04 12:00:01 [ERROR] web - Disk full on /dev/sda")
+    assert (event['timestamp'], event['log_level'], event['service_name']) == (
+        datetime(2025, 7, 4, 12, 0, 1), 'ERROR', 'web')
+
+
+def test_json_format_maps_field_names_and_keeps_the_rest():
+    event = LogParserRegistry().parse('{"ts": "2025-07-04T12:00:01", "level": "warn", "service": "api", '
+                                      '"msg": "slow query", "duration_ms": 812}')
+    assert event == {'timestamp': datetime(2025, 7, 4, 12, 0, 1), 'log_level': 'WARN', 'service_name': 'api',
+                     'message': 'slow query', 'duration_ms': 812}
+
+
+def test_json_epoch_seconds_and_milliseconds():
+    registry = LogParserRegistry()
+    assert registry.parse('{"ts": 1751630401, "msg": "x"}')['timestamp'] == datetime.fromtimestamp(1751630401)
+    assert registry.parse('{"ts": 1751630401500, "msg": "x"}')['timestamp'] == \
+        datetime.fromtimestamp(1751630401.5)
+
+
+def test_log4j_format_with_error_type():
+    event = LogParserRegistry().parse("2025-07-04 12:00:01,250 ERROR [main] com.example.Db - "
+                                      "Query failed: java.sql.SQLException: timeout")
+    assert event['timestamp'] == datetime(2025, 7, 4, 12, 0, 1, 250_000)
+    assert (event['log_level'], event['service_name']) == ('ERROR', 'com.example.Db')
+    assert event['error_type'] == 'SQLException'
+
+
+def test_nginx_combined_format():
+    event = LogParserRegistry().parse('10.0.0.1 - - [04/Jul/2025:12:00:01 +0000] "GET /api/orders HTTP/1.1" '
+                                      '503 120 "-" "curl/8.0"')
+    assert event['timestamp'] == datetime.fromtimestamp(
+        datetime(2025, 7, 4, 12, 0, 1, tzinfo=timezone.utc).timestamp())
+    assert (event['log_level'], event['service_name'], event['status_code']) == ('ERROR', 'nginx', 503)
+    assert event['message'] == 'Request /api/orders returned 503'
+    assert event['user_agent'] == 'curl/8.0'
+
+
+def test_syslog_format():
+    event = LogParserRegistry().parse("<11>Oct 11 22:14:15 host1 sshd[4242]: Failed password for root")
+    assert (event['timestamp'].month, event['timestamp'].day, event['timestamp'].hour) == (10, 11, 22)
+    assert (event['log_level'], event['service_name'], event['host'], event['pid']) == ('ERROR', 'sshd', 'host1', 4242)
+    assert event['message'] == 'Failed password for root'
+
+
+@pytest.mark.parametrize('line, name', [
+    ("2025-07-04 12:00:01 [INFO] web - ok", 'simple'),
+    ('{"msg": "ok"}', 'json'),
+    ("2025-07-04 12:00:01,000 [INFO] app - ok", 'log4j'),
+    ('10.0.0.1 - - [04/Jul/2025:12:00:01 +0000] "GET / HTTP/1.1" 200 5', 'nginx'),
+    ("Oct 11 22:14:15 host1 cron: ok", 'syslog'),
+])
+def test_detect_names_the_format(line, name):
+    detected, event = LogParserRegistry().detect(line)
+    assert detected[0] == name
+    assert event is not None
+
+
+def test_format_is_remembered_per_source():
+    registry = LogParserRegistry()
+    registry.parse('{"msg": "ok"}', source='a')
+    registry.parse("2025-07-04 12:00:01 [INFO] web - ok", source='b')
+    assert registry.source_format('a') == 'json'
+    assert registry.source_format('b') == 'simple'
+    assert registry.parse("2025-07-04 12:00:02 [INFO] web - switched", source='a')['service_name'] == 'web'
+    assert registry.source_format('a') == 'simple'
+
+
+def test_unparseable_line_becomes_an_unknown_event():
+    registry = LogParserRegistry()
+    event = registry.parse("not a log line")
+    assert (event['log_level'], event['service_name'], event['message']) == ('UNKNOWN', 'UNKNOWN', 'not a log line')
+    assert registry.unparsed == 1
+
+
+@pytest.mark.parametrize('line', [
+    '{"timestamp": 1e20, "msg": "x"}',
+    '{"ts": -1e300, "msg": "x"}',
+    '{"ts": true, "msg": "x"}',
+    '{"ts": [1], "msg": "x"}',
+    '{"ts": "yesterday", "msg": "x"}',
+])
+def test_json_with_a_bad_timestamp_is_unknown_rather_than_an_error(line):
+    registry = LogParserRegistry()
+    event = registry.parse(line)
+    assert (event['log_level'], event['message']) == ('UNKNOWN', line)
+    assert registry.unparsed == 1
+
+
+def test_json_message_and_service_are_coerced_to_text():
+    event = LogParserRegistry().parse('{"msg": 5, "service": 7, "ts": 1751630401}')
+    assert (event['message'], event['service_name']) == ('5', '7')
+    assert LogParserRegistry().parse('{"msg": null}')['message'] == ''
+    # The pattern stage can mask it like any other message.
+    recognized = LogPatternRecognizer(template_storage_path=None).process_log_event(event)
+    assert recognized['template'] == '<NUM>'
@@ -0,0 +1,103 @@
+from datetime import datetime
+
+from log_patterns import LogPatternRecognizer
+from template_miner import DrainTemplateMiner
+from template_store import TemplateJournal, TemplateStore
+
+
+def _event(message, service='web'):
+    return {'message': message, 'service_name': service, 'timestamp': datetime(2025, 7, 4, 12, 0)}
+
+
+def _pattern_ids(recognizer, messages):
+    return [recognizer.process_log_event(_event(message))['pattern_id'] for message in messages]
+
+
+def test_evicted_cluster_returns_to_its_stored_pattern():
+    recognizer = LogPatternRecognizer(template_storage_path=None, strategy='drain',
+                                      miner=DrainTemplateMiner(max_clusters=1))
+    ids = _pattern_ids(recognizer, ['login ok for alice', 'login ok for bob', 'disk full on sda',
+                                    'login ok for carol', 'login ok for dave'])
+    assert ids == ['P1', 'P1', 'P2', 'P1', 'P1']
+    assert {pattern_id: stats['template'] for pattern_id, stats in recognizer.templates.items()} == {
+        'P1': 'login ok for <*>', 'P2': 'disk full on sda'}
+
+
+def test_rename_onto_existing_template_merges_slots(tmp_path):
+    path = str(tmp_path / 'templates.bin')
+    store = TemplateStore()
+    journal = TemplateJournal(path, store)
+    journal.load()
+    first = store.add('P1', 'web', 'login ok for alice', 1.0)
+    second = store.add('P2', 'web', 'login ok for bob', 1.0)
+    assert store.rename(second, 'login ok for <*>') == second
+    assert store.rename(first, 'login ok for <*>') == first
+    assert store.lookup('web', 'login ok for <*>') == first
+    # The retired slot follows later renames of the one that owns it.
+    assert store.rename(first, 'login <*> for <*>') == first
+    assert store.template_strings[second] == 'login <*> for <*>'
+
+    journal.flush()
+    replayed = TemplateStore()
+    TemplateJournal(path, replayed).load()
+    assert replayed.lookup('web', 'login <*> for <*>') == first
+
+    journal.close()
+    restored = TemplateStore()
+    TemplateJournal(path, restored).load()
+    assert restored.lookup('web', 'login <*> for <*>') == first
+    assert restored.rename(first, '<*> <*> for <*>') == first
+    assert restored.template_strings[second] == '<*> <*> for <*>'
+
+
+def test_drain_patterns_keep_their_ids_across_restarts(tmp_path):
+    path = str(tmp_path / 'templates.bin')
+    recognizer = LogPatternRecognizer(template_storage_path=path, strategy='drain')
+    before = _pattern_ids(recognizer, ['login ok for alice', 'login ok for bob', 'disk full on sda'])
+    recognizer.close()
+
+    recognizer = LogPatternRecognizer(template_storage_path=path, strategy='drain')
+    assert len(recognizer.miner.clusters) == 2
+    after = _pattern_ids(recognizer, ['login ok for carol', 'disk full on sda', 'login ok for dave'])
+    recognizer.close()
+    assert before == ['P1', 'P1', 'P2']
+    assert after == ['P1', 'P2', 'P1']
+    assert len(recognizer.templates) == 2
+
+
+_BATCH_MESSAGES = [
+    'User 123 logged in from 192.168.1.100',
+    'User 456 logged in from 192.168.1.101',
+    'Failed to connect to DB on port 5432. Error code 101.',
+    'Processing message 3f2a9c1e-0d4b-4c59-9a1e-2b7c8d9e0f11 completed successfully in 15ms.',
+    'User 789 logged in from 10.0.0.7',
+    'Failed to connect to DB on port 5433. Error code 102.',
+    'disk full on sda',
+]
+
+
+def _batch_events():
+    return [_event(message, service) for service in ('web', 'db') for message in _BATCH_MESSAGES * 3]
+
+
+def test_batch_path_assigns_the_same_patterns_as_the_dict_path():
+    from event_batch import EventBatch
+
+    for strategy in ('regex', 'drain'):
+        one_by_one = LogPatternRecognizer(template_storage_path=None, strategy=strategy)
+        batched = LogPatternRecognizer(template_storage_path=None, strategy=strategy)
+        expected = [one_by_one.process_log_event(event) for event in _batch_events()]
+        batch = batched.process_event_batch(EventBatch.from_events(_batch_events()))
+        assert [batch.patterns[code] for code in batch.pattern_codes.tolist()] == \
+            [event['pattern_id'] for event in expected]
+        assert batch.params == [event['params'] for event in expected]
+        assert batched.templates == one_by_one.templates
+
+
+def test_templates_stay_in_memory_unless_a_path_is_given(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    recognizer = LogPatternRecognizer()
+    recognizer.process_log_event(_event('login ok for alice'))
+    recognizer.close()
+    assert recognizer.journal is None
+    assert list(tmp_path.iterdir()) == []
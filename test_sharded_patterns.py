@@ -0,0 +1,35 @@
+from datetime import datetime
+
+from event_batch import EventBatch
+from log_patterns import LogPatternRecognizer
+from sharded_patterns import ShardedPatternRecognizer
+
+_MESSAGES = [
+    'User 123 logged in from 192.168.1.100',
+    'Failed to connect to DB on port 5432. Error code 101.',
+    'User 456 logged in from 10.0.0.7',
+    'disk full on sda',
+]
+
+
+def _events():
+    return [{'message': message, 'service_name': service, 'log_level': 'INFO',
+             'timestamp': datetime(2025, 7, 4, 12, 0, second)}
+            for second, (service, message) in enumerate((service, message) for service in ('web', 'db', 'queue')
+                                                        for message in _MESSAGES * 2)]
+
+
+def test_event_batch_gets_the_same_patterns_and_params_as_a_single_recognizer():
+    single = LogPatternRecognizer(template_storage_path=None, pattern_id_scheme='hashed')
+    expected = single.process_event_batch(EventBatch.from_events(_events()))
+    sharded = ShardedPatternRecognizer(workers=2)
+    try:
+        batch = sharded.process_event_batch(EventBatch.from_events(_events()))
+    finally:
+        sharded.close()
+    assert [batch.patterns[code] for code in batch.pattern_codes.tolist()] == \
+        [expected.patterns[code] for code in expected.pattern_codes.tolist()]
+    assert [batch.templates[code] for code in batch.pattern_codes.tolist()] == \
+        [expected.templates[code] for code in expected.pattern_codes.tolist()]
+    assert batch.params == expected.params
+    assert batch.params[0] == {'NUM': ['123'], 'IP_ADDR': ['192.168.1.100']}
@@ -0,0 +1,54 @@
+import random
+
+import numpy as np
+
+from sketches import CountMinSketch, WindowSketch, hash_keys
+
+
+def _zipf_stream(events=50_000, keys=5_000, seed=11):
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(keys)]
+    counts = {}
+    for index in rng.choices(range(keys), weights=weights, k=events):
+        key = ('web', 'INFO', f"P{index}")
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def test_count_min_error_stays_within_epsilon_times_total():
+    epsilon, delta = 0.001, 0.01
+    counts = _zipf_stream()
+    sketch = CountMinSketch.from_error(epsilon, delta)
+    keys = list(counts)
+    true = np.array([counts[key] for key in keys], dtype=np.int64)
+    sketch.add_hashes(*hash_keys(keys), true)
+    errors = sketch.estimate_hashes(*hash_keys(keys)) - true
+    assert errors.min() >= 0
+    # Each estimate may exceed epsilon * total with probability at most delta.
+    assert np.count_nonzero(errors > epsilon * sketch.total) <= delta * len(keys)
+
+
+def test_window_sketch_merges_panes_into_the_same_estimates():
+    counts = _zipf_stream(events=20_000, keys=8_000)
+    options = dict(top_k=50, epsilon=0.001, delta=0.01, pending_limit=500)
+    whole = WindowSketch(**options)
+    whole.update(counts)
+    panes = [WindowSketch(**options) for _ in range(4)]
+    for i, (key, count) in enumerate(counts.items()):
+        panes[i % 4].add(key, count)
+    assert panes[0].counts.table is not None
+    # A pane that never fills its buffer keeps exact counts and no Count-Min table.
+    quiet = WindowSketch(**options)
+    quiet.update({('web', 'INFO', 'P0'): 3})
+    assert quiet.counts.table is None
+    assert quiet.nbytes < 10_000
+
+    merged = WindowSketch(**options)
+    for pane in panes + [quiet]:
+        merged.merge(pane)
+    whole.add(('web', 'INFO', 'P0'), 3)
+    keys = list(counts)
+    assert merged.total == whole.total
+    assert merged.estimate(keys).tolist() == whole.estimate(keys).tolist()
+    heavy = sorted(counts, key=counts.get, reverse=True)[:5]
+    assert set(heavy) <= set(merged.top_keys())
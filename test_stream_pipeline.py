@@ -0,0 +1,58 @@
+import threading
+from datetime import timedelta
+
+from alerting_system import AlertingSystem
+from anomaly_detector import AnomalyDetector
+from log_patterns import LogPatternRecognizer
+from stream_pipeline import StreamPipeline
+
+
+class _FailingRecognizer(LogPatternRecognizer):
+    def __init__(self, fail_on):
+        super().__init__(template_storage_path=None)
+        self.fail_on = fail_on
+        self.calls = 0
+
+    def process_event_batch(self, batch):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError('bad batch')
+        return super().process_event_batch(batch)
+
+
+class _TickRecorder(AlertingSystem):
+    def __init__(self):
+        super().__init__()
+        self.ticks = []
+
+    def tick(self, now=None):
+        self.ticks.append(now)
+        super().tick(now)
+
+
+def test_failing_batch_is_counted_and_pipeline_drains():
+    lines = [f"2025-07-04 12:{i // 60:02d}:{i % 60:02d} [INFO] web - request {i} served" for i in range(3_000)]
+    pipeline = StreamPipeline(recognizer=_FailingRecognizer(fail_on=2), detector=AnomalyDetector(window_seconds=60),
+                              batch_size=100, queue_size=2)
+    runner = threading.Thread(target=pipeline.run, args=(lines,), daemon=True)
+    runner.start()
+    runner.join(timeout=30)
+    assert not runner.is_alive()
+
+    stages = pipeline.metrics()['stages']
+    assert stages['pattern']['errors'] == 1
+    assert stages['pattern']['last_error'] == "RuntimeError('bad batch')"
+    assert stages['pattern']['items_in'] == 3_000
+    assert stages['anomaly']['items_in'] == 2_900
+
+
+def test_alerting_ticks_as_event_time_advances():
+    # Steady traffic raises no anomalies, so no incidents; roll-ups still need the clock to move.
+    lines = [f"2025-07-04 12:{i // 60:02d}:{i % 60:02d} [INFO] web - request {i} served" for i in range(600)]
+    alerting = _TickRecorder()
+    pipeline = StreamPipeline(recognizer=LogPatternRecognizer(template_storage_path=None),
+                              detector=AnomalyDetector(window_seconds=60), alerting=alerting, batch_size=100)
+    pipeline.run(lines)
+    assert len(alerting.ticks) == 6
+    assert alerting.ticks == sorted(alerting.ticks)
+    assert alerting.ticks[-1] - alerting.ticks[0] >= timedelta(minutes=8)
@@ -0,0 +1,97 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import web_dashboard
+from dashboard_snapshots import DashboardPublisher
+
+START = datetime(2025, 7, 4, 12, 0)
+
+
+def _events(count, first=0):
+    return [{'timestamp': START + timedelta(seconds=i), 'service_name': 'web', 'log_level': 'INFO',
+             'message': f"request {i}", 'pattern_id': 'P1', 'template': 'request <NUM>'}
+            for i in range(first, first + count)]
+
+
+@pytest.fixture
+def publisher(monkeypatch):
+    publisher = DashboardPublisher(chunk_size=64)
+    monkeypatch.setattr(web_dashboard, 'publisher', publisher)
+    return publisher
+
+
+@pytest.fixture
+def client():
+    return web_dashboard.app.test_client()
+
+
+def test_index_answers_304_until_something_is_published(publisher, client):
+    publisher.publish(events=_events(3))
+    first = client.get('/')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+
+    # An empty publish keeps the version, so the client's copy stays current.
+    publisher.publish(events=[], anomalies=[], incidents=[])
+    assert publisher.snapshot.version == 1
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+
+    publisher.publish(events=_events(1, first=3))
+    changed = client.get('/', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_logs_page_through_by_cursor(publisher, client):
+    publisher.publish(events=_events(250))
+    seen = []
+    cursor = 0
+    while True:
+        page = client.get(f'/api/logs?cursor={cursor}&limit=100').get_json()
+        seen.extend(event['seq'] for event in page['events'])
+        if page['next_cursor'] == page['end_seq']:
+            break
+        cursor = page['next_cursor']
+    assert seen == list(range(250))
+
+    latest = client.get('/api/logs?limit=10')
+    assert [event['message'] for event in latest.get_json()['events']] == [f"request {i}" for i in range(240, 250)]
+    # A page's range never changes, so its ETag holds across later publishes.
+    publisher.publish(events=_events(5, first=250))
+    again = client.get('/api/logs?cursor=240&limit=10', headers={'If-None-Match': latest.headers['ETag']})
+    assert again.status_code == 304
+
+
+def _first_sse_event(response) -> (str, str, dict):
+    chunk = next(iter(response.response))
+    response.close()
+    fields = dict(line.split(': ', 1) for line in chunk.decode().strip().split('\n'))
+    return fields['id'], fields['event'], json.loads(fields['data'])
+
+
+def test_stream_resumes_from_last_event_id(publisher, client):
+    publisher.publish(events=_events(2))
+    publisher.publish(anomalies=[{'key': ['web', 'ERROR', 'P2'], 'timestamp': START}])
+    publisher.publish(events=_events(3, first=2))
+
+    response = client.get('/api/stream', headers={'Last-Event-ID': '1'}, buffered=False)
+    event_id, kind, delta = _first_sse_event(response)
+    assert (event_id, kind) == ('3', 'delta')
+    assert (delta['from_seq'], delta['end_seq']) == (2, 5)
+    assert [event['seq'] for event in delta['events']] == [2, 3, 4]
+    assert delta['anomalies'] == [{'key': ['web', 'ERROR', 'P2'], 'timestamp': '2025-07-04 12:00:00'}]
+
+
+def test_stream_resets_a_client_too_far_behind(client, monkeypatch):
+    publisher = DashboardPublisher(max_deltas=2)
+    monkeypatch.setattr(web_dashboard, 'publisher', publisher)
+    for i in range(4):
+        publisher.publish(events=_events(1, first=i))
+
+    response = client.get('/api/stream?since=0', buffered=False)
+    event_id, kind, data = _first_sse_event(response)
+    assert (event_id, kind) == ('4', 'reset')
+    assert data == {'version': 4, 'first_seq': 0, 'end_seq': 4}
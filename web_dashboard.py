@@ -1,9 +1,29 @@
-from flask import Flask, render_template, jsonify
-from datetime import datetime
-from log_patterns import LogPatternRecognizer
+"""
+Log analysis dashboard.
+
+Processing runs in a background StreamPipeline that publishes immutable
+snapshots to `publisher`; the routes only read the latest snapshot. Every
+response carries an ETag and answers If-None-Match with 304 before any
+body is built, /api/logs pages through events by `cursor` (the event
+sequence number) and /api/stream pushes deltas as Server-Sent Events.
+/metrics exposes stage, component and (with --instrument) per-method
+metrics in the Prometheus text format.
+
+    python web_dashboard.py --file app.log --follow --instrument --templates log_templates.bin
+"""
+import argparse
+import json
+
+from flask import Flask, Response, jsonify, render_template, request
+
+import instrumentation
+from alerting_system import AlertingSystem
 from anomaly_detector import AnomalyDetector
+from dashboard_snapshots import DashboardPublisher
 from incident_predictor import IncidentPredictionEngine
-from alerting_system import AlertingSystem
+from log_parsers import LogParserRegistry
+from log_patterns import LogPatternRecognizer
+from stream_pipeline import StreamPipeline, tail_file
 
 app = Flask(__name__)
 
@@ -15,61 +35,157 @@ raw_logs = [
     '2025-07-04 12:00:20 [ERROR] db-service-prod - Failed to connect to DB on port 5432. Error code 101.'
 ]
 
-def parse_simple_log(log_line: str) -> dict:
-    parts = log_line.split(' ', 4)
-    timestamp_str = f"{parts[0]} {parts[1]}"
-    log_level = parts[2].strip('[]')
-    service_name = parts[3].strip('- ')
-    message = parts[4]
-    try:
-        timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        timestamp = datetime.now()
-    return {
-        'timestamp': timestamp,
-        'log_level': log_level,
-        'service_name': service_name,
-        'message': message
-    }
-
-
-pattern_recognizer = LogPatternRecognizer()
-anomaly_detector = AnomalyDetector(window_size=5, history_size=10)
-prediction_engine = IncidentPredictionEngine()
-alerting_system = AlertingSystem()
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1_000
+SSE_KEEPALIVE_SECONDS = 15
+
+publisher = DashboardPublisher()
+pipeline = None
+
+
+def start_pipeline(lines, template_storage_path=None):
+    """
+    Starts the background pipeline that feeds `publisher` from `lines`.
+    Templates are persisted to `template_storage_path` if one is given.
+    """
+    global pipeline
+    pipeline = StreamPipeline(recognizer=LogPatternRecognizer(template_storage_path=template_storage_path),
+                              detector=AnomalyDetector(window_size=5, history_size=10, window_seconds=60),
+                              engine=IncidentPredictionEngine(),
+                              alerting=AlertingSystem(),
+                              parser=LogParserRegistry(),
+                              publisher=publisher)
+    pipeline.start(lines)
+    return pipeline
+
+
+_STAGE_GAUGES = ('queue_depth', 'max_queue_depth', 'items_per_busy_second')
+
+
+def _numeric(stats: dict):
+    for name, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def _pipeline_metrics() -> list:
+    """Stage metrics, component stats and publisher state for instrumentation.render()."""
+    samples = [('log_analysis_snapshot_version', {}, publisher.snapshot.version),
+               ('log_analysis_published_events', {}, publisher.snapshot.end_seq)]
+    if pipeline is None:
+        return samples
+    samples.append(('log_analysis_lines_read', {}, pipeline.lines_read))
+    for stage, metrics in pipeline.metrics()['stages'].items():
+        samples.extend((f"log_analysis_stage_{name}" + ('' if name in _STAGE_GAUGES else '_total'),
+                        {'stage': stage}, value) for name, value in _numeric(metrics))
+    for component, stats in (('detector', pipeline.detector.stats()), ('engine', pipeline.engine.stats()),
+                             ('alerting', pipeline.alerting.stats())):
+        samples.extend((f"log_analysis_{component}_{name}", {}, value) for name, value in _numeric(stats))
+    return samples
+
+
+instrumentation.register_collector(_pipeline_metrics)
+
+
+def _conditional(tag: str, build):
+    """Answers 304 if the client already holds `tag`; otherwise builds the response."""
+    if request.if_none_match.contains(tag):
+        response = app.response_class(status=304)
+    else:
+        response = build()
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _page_args():
+    cursor = request.args.get('cursor', type=int)
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return cursor, limit
+
 
 @app.route('/')
 def index():
-    parsed_events = [parse_simple_log(log) for log in raw_logs]
-    processed_events = [pattern_recognizer.process_log_event(e) for e in parsed_events]
-    for event in processed_events:
-        anomaly_detector.update_counts(event)
-    anomalies = anomaly_detector.detect_anomalies_in_window()
-    for anomaly in anomalies:
-        anomaly['timestamp'] = datetime.now()
-        prediction_engine.add_active_anomaly(anomaly)
-    predicted_incidents = prediction_engine.predict_incidents()
-    for incident in predicted_incidents:
-        alerting_system.send_alert(incident)
-    return render_template('dashboard.html',
-                           logs=processed_events,
-                           anomalies=anomalies,
-                           incidents=predicted_incidents)
+    snapshot = publisher.snapshot
+    events, _, _ = snapshot.page(None, PAGE_SIZE)
+    return _conditional(snapshot.etag, lambda: app.make_response(render_template(
+        'dashboard.html', logs=events, anomalies=snapshot.anomalies, incidents=snapshot.incidents)))
+
 
 @app.route('/api/logs')
 def api_logs():
-    parsed_events = [parse_simple_log(log) for log in raw_logs]
-    processed_events = [pattern_recognizer.process_log_event(e) for e in parsed_events]
-    return jsonify(processed_events)
+    """Events from `cursor` (default: the latest page), at most `limit` of them."""
+    snapshot = publisher.snapshot
+    cursor, limit = _page_args()
+    events, start, stop = snapshot.page(cursor, limit)
+    # Events never change once published, so a page is identified by its range.
+    return _conditional(f"logs-{start}-{stop}", lambda: jsonify({
+        'events': events,
+        'cursor': start,
+        'next_cursor': stop,
+        'first_seq': snapshot.first_seq,
+        'end_seq': snapshot.end_seq,
+    }))
+
 
 @app.route('/api/anomalies')
 def api_anomalies():
-    return jsonify(anomaly_detector.detect_anomalies_in_window())
+    snapshot = publisher.snapshot
+    return _conditional(f"anomalies-{snapshot.anomalies_version}", lambda: jsonify(list(snapshot.anomalies)))
+
 
 @app.route('/api/incidents')
 def api_incidents():
-    incidents = prediction_engine.predict_incidents()
-    return jsonify(incidents)
+    snapshot = publisher.snapshot
+    return _conditional(f"incidents-{snapshot.incidents_version}", lambda: jsonify(list(snapshot.incidents)))
+
+
+@app.route('/api/stream')
+def api_stream():
+    """
+    Server-Sent Events: one 'delta' event per published change, with the new
+    events, anomalies and incidents. A client resuming from a Last-Event-ID
+    the server no longer has deltas for gets a 'reset' event instead and
+    should reload through the other routes.
+    """
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    version = int(last_id) if last_id and last_id.isdigit() else publisher.snapshot.version
+
+    def stream(version):
+        while True:
+            snapshot = publisher.wait(version, timeout=SSE_KEEPALIVE_SECONDS)
+            if snapshot.version == version:
+                yield ": keepalive\n\n"
+                continue
+            delta = publisher.delta(version, snapshot)
+            if delta is None:
+                kind, delta = 'reset', {'version': snapshot.version, 'first_seq': snapshot.first_seq,
+                                        'end_seq': snapshot.end_seq}
+            else:
+                kind = 'delta'
+            version = snapshot.version
+            yield f"id: {version}\nevent: {kind}\ndata: {json.dumps(delta)}\n\n"
+
+    return Response(stream(version), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(instrumentation.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', help="process this log file instead of the built-in sample")
+    parser.add_argument('--follow', action='store_true', help="keep reading as the file grows")
+    parser.add_argument('--templates', help="persist pattern templates to this file (one process per file)")
+    parser.add_argument('--instrument', action='store_true', help="record per-method latency for /metrics")
+    parser.add_argument('--track-allocations', action='store_true',
+                        help="with --instrument, also trace the bytes each method allocates (slower)")
+    args = parser.parse_args()
+
+    if args.instrument:
+        instrumentation.enable(track_allocations=args.track_allocations)
+    start_pipeline(tail_file(args.file, follow=args.follow) if args.file else raw_logs, args.templates)
+    app.run(debug=True, use_reloader=False, threaded=True)